@@ -6,8 +6,10 @@ from enum import Enum
 import discord
 from discord.ext import commands
 
+import common.migrations as migrations
 import common.paginator as paginator
 import common.star_classes as star_classes
+import common.storage as storage
 import common.utils as utils
 
 
@@ -114,9 +116,263 @@ class OwnerCMDs(commands.Cog, name="Owner", command_attrs=dict(hidden=True)):
 
         await ctx.reply("Removed all commands.")
 
+    @commands.command(hidden=True, aliases=["starboardstats", "sbstats"])
+    async def starboard_stats(self, ctx: utils.SeraContextBase):
+        flush_stats = self.bot.starboard.flush_stats
+        lookup_stats = self.bot.starboard.lookup_stats
+        entry_cache = self.bot.starboard.entry_cache
+        statement_stats = self.bot.starboard.statement_stats
+        refresh_stats = self.bot.star_refresher.stats
+        message_cache = self.bot.star_messages
+        embed_cache = self.bot.star_embeds
+        lock_stats = self.bot.star_locks.stats
+        reconcile_stats = self.bot.star_reconciler.stats
+        queue_stats = self.bot.star_workers.stats
+        edit_stats = self.bot.star_edits.stats
+
+        stats_embed = discord.Embed(
+            title="Starboard Stats",
+            colour=discord.Colour(0xCFCA76),
+            timestamp=discord.utils.utcnow(),
+        )
+        stats_embed.add_field(
+            name="SQL Flushes",
+            value="\n".join(
+                (
+                    f"**Flushes:** {flush_stats.flushes}",
+                    f"**Rows Written:** {flush_stats.rows}",
+                    f"**Rows Last Flush:** {flush_stats.last_rows}",
+                    f"**Avg. Rows/Flush:** {flush_stats.avg_rows:.2f}",
+                    f"**Last Latency:** {flush_stats.last_latency * 1000:.2f}ms",
+                    f"**Avg. Latency:** {flush_stats.avg_latency * 1000:.2f}ms",
+                    f"**Max Latency:** {flush_stats.max_latency * 1000:.2f}ms",
+                    f"**Events Logged:** {flush_stats.events}",
+                    f"**Failed Flushes:** {flush_stats.failures}",
+                    f"**Rows Dropped:** {flush_stats.dropped}",
+                    f"**Tick:** {self.bot.starboard.flush_interval}s, max"
+                    f" {self.bot.starboard.max_batch_size} rows",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Entry Cache",
+            value="\n".join(
+                (
+                    f"**Entries:** {len(entry_cache)}",
+                    f"**Resident:** {entry_cache.resident_bytes / 1048576:.2f} MiB /"
+                    f" {entry_cache.max_bytes / 1048576:.2f} MiB",
+                    f"**Hits:** {entry_cache.stats.hits}",
+                    f"**Misses:** {entry_cache.stats.misses}",
+                    f"**Hit Ratio:** {entry_cache.stats.hit_ratio:.2%}",
+                    f"**Evictions:** {entry_cache.stats.evictions}",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Cache Misses",
+            value="\n".join(
+                (
+                    f"**DB Lookups:** {lookup_stats.db_lookups}",
+                    f"**Coalesced Waiters:** {lookup_stats.coalesced}",
+                    f"**Coalesced Ratio:** {lookup_stats.coalesced_ratio:.2%}",
+                    f"**Known Missing Hits:** {lookup_stats.negative_hits}",
+                )
+            ),
+            inline=False,
+        )
+
+        stats_embed.add_field(
+            name="Star Queue",
+            value="\n".join(
+                (
+                    f"**Queued:** {self.bot.star_queue.qsize()}",
+                    f"**Set Aside:** {self.bot.star_workers.deferred}",
+                    f"**Processed:** {queue_stats.processed}",
+                    f"**Last Wait:** {queue_stats.last_wait * 1000:.2f}ms",
+                    f"**Avg. Wait:** {queue_stats.avg_wait * 1000:.2f}ms",
+                    f"**Max Wait:** {queue_stats.max_wait * 1000:.2f}ms",
+                    f"**Workers:** {self.bot.star_workers.workers}, max"
+                    f" {self.bot.star_workers.channel_cap} per channel",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Message Cache",
+            value="\n".join(
+                (
+                    f"**Messages:** {len(message_cache)}",
+                    f"**Hits:** {message_cache.stats.hits}",
+                    f"**Fetches:** {message_cache.stats.misses}",
+                    f"**Hit Ratio:** {message_cache.stats.hit_ratio:.2%}",
+                    f"**TTL:** {message_cache.ttl}s",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Embed Cache",
+            value="\n".join(
+                (
+                    f"**Renders:** {len(embed_cache)}",
+                    f"**Hits:** {embed_cache.stats.hits}",
+                    f"**Misses:** {embed_cache.stats.misses}",
+                    f"**Hit Ratio:** {embed_cache.stats.hit_ratio:.2%}",
+                    f"**TTL:** {embed_cache.ttl}s",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Message Refreshes",
+            value="\n".join(
+                (
+                    f"**Requested:** {refresh_stats.requested}",
+                    f"**Refreshes:** {refresh_stats.refreshes}",
+                    f"**Immediate:** {refresh_stats.immediate}",
+                    f"**Coalesced Ratio:** {refresh_stats.coalesced_ratio:.2%}",
+                    f"**Pending:** {len(self.bot.star_refresher)}",
+                    f"**Window:** {self.bot.star_refresher.window}s",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Message Edits",
+            value="\n".join(
+                (
+                    f"**Requested:** {edit_stats.requested}",
+                    f"**Sent:** {edit_stats.sent}",
+                    f"**Superseded:** {edit_stats.superseded}",
+                    f"**Deferred:** {edit_stats.deferred}",
+                    f"**Dropped:** {edit_stats.dropped}",
+                    f"**Pending:** {len(self.bot.star_edits)}",
+                    f"**Budget:** {self.bot.star_edits.rate} edits/channel"
+                    f" per {self.bot.star_edits.per:g}s,"
+                    f" {self.bot.star_edits.reserve} kept for counts",
+                )
+            ),
+            inline=False,
+        )
+        if self.bot.invalidation:
+            bus_stats = self.bot.invalidation.stats
+            stats_embed.add_field(
+                name="Cache Invalidation",
+                value="\n".join(
+                    (
+                        f"**Published:** {bus_stats.published}",
+                        f"**Failed:** {bus_stats.failed}",
+                        f"**Received:** {bus_stats.received}",
+                        f"**Gaps:** {bus_stats.gaps}",
+                        f"**Resyncs:** {bus_stats.resyncs}",
+                    )
+                ),
+                inline=False,
+            )
+
+        stats_embed.add_field(
+            name="Reactor Reconciliation",
+            value="\n".join(
+                (
+                    f"**Pending:** {len(self.bot.star_reconciler)}",
+                    f"**Marked:** {reconcile_stats.marked}",
+                    f"**Reconciled:** {reconcile_stats.reconciled}",
+                    f"**Requests:** {reconcile_stats.requests}",
+                    f"**Reactors Added:** {reconcile_stats.added}",
+                    f"**Reactors Removed:** {reconcile_stats.removed}",
+                    f"**Budget:** {self.bot.star_reconciler.budget} requests/guild"
+                    f" per {self.bot.star_reconciler.per:g}s",
+                )
+            ),
+            inline=False,
+        )
+        stats_embed.add_field(
+            name="Entry Locks",
+            value="\n".join(
+                (
+                    f"**Live Locks:** {len(self.bot.star_locks)}",
+                    f"**Acquisitions:** {lock_stats.acquisitions}",
+                    f"**Contended:** {lock_stats.contended}",
+                    f"**Contention Ratio:** {lock_stats.contention_ratio:.2%}",
+                    f"**Avg. Wait:** {lock_stats.avg_wait * 1000:.2f}ms",
+                    f"**Max Wait:** {lock_stats.max_wait * 1000:.2f}ms",
+                )
+            ),
+            inline=False,
+        )
+
+        stats_embed.add_field(
+            name="Prepared Statements",
+            value="\n".join(
+                (
+                    f"**Executions:** {statement_stats.executions}",
+                    f"**Prepares:** {statement_stats.prepares}",
+                    f"**Cache Hit Ratio:** {statement_stats.hit_ratio:.2%}",
+                    f"**Backend:** {self.bot.starboard.backend.name}",
+                )
+            ),
+            inline=False,
+        )
+
+        await ctx.reply(embed=stats_embed)
+
+    @commands.command(hidden=True, aliases=["starboardcachesize", "sbcachesize"])
+    async def starboard_cache_size(self, ctx: utils.SeraContextBase, mebibytes: float):
+        if mebibytes <= 0:
+            raise commands.BadArgument("The cache size must be above 0 MiB.")
+
+        self.bot.starboard.resize_cache(int(mebibytes * 1048576))
+        entry_cache = self.bot.starboard.entry_cache
+        await ctx.reply(
+            f"Resized the starboard cache to {mebibytes:.2f} MiB. It now holds"
+            f" {len(entry_cache)} entries, using about"
+            f" {entry_cache.resident_bytes / 1048576:.2f} MiB."
+        )
+
+    @commands.command(hidden=True)
+    async def migrate(self, ctx: utils.SeraContextBase):
+        async with ctx.typing():
+            ran = await self.bot.storage.migrate()
+
+        if not ran:
+            await ctx.reply("The database is already up to date.")
+        else:
+            ran_str = "\n".join(f"`{m.version}`: {m.name}" for m in ran)
+            await ctx.reply(f"Ran migrations:\n{ran_str}")
+
+    @commands.command(hidden=True, aliases=["migrationstatus"])
+    async def migration_status(self, ctx: utils.SeraContextBase):
+        applied = await self.bot.storage.get_applied_migrations()
+
+        status_list = [
+            f"`{m.version}`: {m.name} -"
+            f" {'applied' if m.version in applied else 'pending'}"
+            for m in self.bot.storage.get_migrations()
+        ]
+        await ctx.reply("\n".join(status_list) or "There are no migrations.")
+
+    @commands.command(hidden=True, aliases=["explainstarboard", "sbexplain"])
+    async def explain_starboard(self, ctx: utils.SeraContextBase):
+        async with ctx.typing():
+            plans = await self.bot.starboard.explain_hot_queries(
+                ctx.guild.id, ctx.author.id, ctx.message.id
+            )
+
+        plan_entries = [
+            # field values can only be 1024 characters long
+            (name, f"```\n{plan[:1000]}\n```")
+            for name, plan in plans.items()
+        ]
+        pages = paginator.FieldPages(ctx, entries=plan_entries, per_page=3)
+        await pages.paginate()
+
 
 async def setup(bot):
     importlib.reload(utils)
+    importlib.reload(migrations)
+    importlib.reload(storage)
     importlib.reload(star_classes)
     importlib.reload(paginator)
 
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3.8
 import asyncio
 import importlib
+import logging
 import typing
 
 from discord.ext import commands
 from discord.ext import tasks
 
+import common.star_events as star_events
 import common.utils as utils
 
 
@@ -15,18 +17,43 @@ class DBHandler(commands.Cog):
 
     async def cog_load(self):
         self.commit_loop.start()
+        # the log is shared, so only one process needs to compact it
+        if self.bot.starboard.log_events and self.bot.is_primary:
+            self.compact_loop.start()
+        if self.bot.invalidation:
+            self.bot.invalidation.subscribe(
+                "config",
+                lambda _, guild_ids: self.refresh_configs(guild_ids),
+                self.refresh_configs,
+            )
 
     async def cog_unload(self):
         self.commit_loop.cancel()
+        self.compact_loop.cancel()
 
     async def get_dbs(self):
-        config_db = await self.fetch_table("seraphim_config")
+        config_db = await self.bot.storage.fetch_configs()
 
         for row in config_db:
             self.bot.config.import_entry(row)
 
         self.bot.added_db_info = True
 
+    async def refresh_configs(
+        self, guild_ids: typing.Optional[typing.List[int]] = None
+    ):
+        """Reloads the configs of guilds another process changed, or every config.
+        Anything changed here that hasn't been written yet is kept."""
+        config_db = await self.bot.storage.fetch_configs(guild_ids)
+
+        for row in config_db:
+            guild_id = row["guild_id"]
+            if (
+                guild_id not in self.bot.config.added
+                and guild_id not in self.bot.config.updated
+            ):
+                self.bot.config.import_entry(row)
+
     @tasks.loop(minutes=2)
     async def commit_loop(self):
         insert_config = [
@@ -47,6 +74,20 @@ class DBHandler(commands.Cog):
         error = args[-1]
         await utils.error_handle(self.bot, error)
 
+    @tasks.loop(hours=6)
+    async def compact_loop(self):
+        # keeps the star event log from growing forever
+        folded = await star_events.compact(self.bot.storage)
+        if folded:
+            logging.getLogger("discord").info(
+                f"Folded {folded} star events into the snapshot."
+            )
+
+    @compact_loop.error
+    async def compact_error_handle(self, *args):
+        error = args[-1]
+        await utils.error_handle(self.bot, error)
+
     @commit_loop.before_loop
     async def before_commit_loop(self):
         if not self.bot.added_db_info:
@@ -57,31 +98,21 @@ class DBHandler(commands.Cog):
 
         await asyncio.sleep(60)
 
-    async def fetch_table(self, table):
-        async with self.bot.pool.acquire() as conn:
-            data = await conn.fetch(f"SELECT * FROM {table}")
-
-        return data
-
     async def update_db(
         self,
-        insert_config: typing.Tuple[int, dict],
-        update_config: typing.Tuple[int, dict],
+        insert_config: typing.List[typing.Tuple[int, dict]],
+        update_config: typing.List[typing.Tuple[int, dict]],
     ):
-        async with self.bot.pool.acquire() as conn:
-            async with conn.transaction():
-                if insert_config:
-                    await conn.executemany(
-                        "INSERT INTO seraphim_config(guild_id, config) VALUES($1, $2)",
-                        args=insert_config,
-                    )
-                if update_config:
-                    await conn.executemany(
-                        "UPDATE seraphim_config SET config = $2 WHERE guild_id = $1",
-                        args=update_config,
-                    )
+        await self.bot.storage.write_configs(insert_config, update_config)
+
+        if self.bot.invalidation:
+            self.bot.invalidation.publish(
+                "config",
+                guild_ids=[c[0] for c in insert_config] + [c[0] for c in update_config],
+            )
 
 
 async def setup(bot):
     importlib.reload(utils)
+    importlib.reload(star_events)
     await bot.add_cog(DBHandler(bot))
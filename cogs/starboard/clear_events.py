@@ -1,9 +1,13 @@
 #!/usr/bin/env python3.8
+import asyncio
+import contextlib
 import importlib
+import typing
 
 import discord
 from discord.ext import commands
 
+import common.star_classes as star_classes
 import common.star_utils as star_utils
 import common.utils as utils
 
@@ -13,86 +17,97 @@ class ClearEvents(commands.Cog):
         self.bot: utils.SeraphimBase = bot
 
     async def auto_clear_stars(self, payload):
-        star_variant = await self.bot.starboard.get(payload.message_id)
-        if star_variant:
-            star_utils.clear_stars(self.bot, star_variant, payload.message_id)
-            await star_utils.star_entry_refresh(
-                self.bot, star_variant, payload.guild_id
+        async with star_utils.entry_lock(self.bot, payload.message_id):
+            star_variant = await self.bot.starboard.get(payload.message_id)
+            if star_variant:
+                star_utils.clear_stars(self.bot, star_variant, payload.message_id)
+                await self.bot.star_refresher.schedule(star_variant)
+
+    def entry_messages_deleted(
+        self, star_variant: star_classes.StarboardEntry, message_ids: typing.Set[int]
+    ) -> bool:
+        """Updates an entry for some of its messages being deleted.
+        Returns if the whole entry has to go, which is left to the caller
+        so bulk deletes can remove them all at once."""
+        # should only be run with the entry's lock held
+        if star_variant.star_var_id != None:
+            # whatever edit was waiting for the starboard message is useless now
+            self.bot.star_edits.discard(
+                star_variant.starboard_id, star_variant.star_var_id
             )
 
+        if star_variant.star_var_id not in message_ids:
+            return True
+
+        star_variant.star_var_id = None
+        star_variant.starboard_id = None
+        star_variant.forced = False
+        self.bot.starboard.upsert(star_variant)
+        return False
+
+    async def delete_star_message(self, star_variant: star_classes.StarboardEntry):
+        # should only be run with the entry's lock held
+        if star_variant.star_var_id == None:
+            return
+
+        star_chan = self.bot.get_partial_messageable(star_variant.starboard_id)
+        try:
+            star_mes = await star_chan.fetch_message(star_variant.star_var_id)
+            await star_mes.delete()
+            self.bot.star_queue.remove_from_copy(
+                (
+                    star_variant.ori_chan_id,
+                    star_variant.ori_mes_id,
+                    star_variant.guild_id,
+                )
+            )
+        except discord.HTTPException:
+            pass
+
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload):
+        self.bot.star_messages.discard(payload.message_id)
+
         if not star_utils.star_check(self.bot, payload):
             return
 
-        star_variant = await self.bot.starboard.get(payload.message_id)
+        async with star_utils.entry_lock(self.bot, payload.message_id):
+            star_variant = await self.bot.starboard.get(payload.message_id)
 
-        if star_variant:
-            if star_variant.star_var_id != payload.message_id:
+            if star_variant and self.entry_messages_deleted(
+                star_variant, {payload.message_id}
+            ):
                 self.bot.starboard.delete(star_variant.ori_mes_id)
-
-                if star_variant.star_var_id != None:
-                    star_chan = self.bot.get_partial_messageable(
-                        star_variant.starboard_id
-                    )
-                    try:
-                        star_mes = await star_chan.fetch_message(
-                            star_variant.star_var_id
-                        )
-                        await star_mes.delete()
-                        self.bot.star_queue.remove_from_copy(
-                            (
-                                star_variant.ori_chan_id,
-                                star_variant.ori_mes_id,
-                                star_variant.guild_id,
-                            )
-                        )
-                    except discord.HTTPException:
-                        pass
-            else:
-                star_variant.star_var_id = None
-                star_variant.starboard_id = None
-                star_variant.forced = False
-                self.bot.starboard.upsert(star_variant)
+                await self.delete_star_message(star_variant)
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.bot.star_messages.discard(message_id)
+
         if not star_utils.star_check(self.bot, payload):
             return
 
-        init_star_variants = [
-            await self.bot.starboard.get(k) for k in payload.message_ids
-        ]
-        star_variants = [k for k in init_star_variants if k != None]
-
-        if star_variants != []:
-            for star_variant in star_variants:
-                if star_variant.star_var_id not in payload.message_ids:
-                    self.bot.starboard.delete(star_variant.ori_mes_id)
-
-                    if star_variant.star_var_id != None:
-                        star_chan = self.bot.get_partial_messageable(
-                            star_variant.starboard_id
-                        )
-                        try:
-                            star_mes = await star_chan.fetch_message(
-                                star_variant.star_var_id
-                            )
-                            await star_mes.delete()
-                            self.bot.star_queue.remove_from_copy(
-                                (
-                                    star_variant.ori_chan_id,
-                                    star_variant.ori_mes_id,
-                                    star_variant.guild_id,
-                                )
-                            )
-                        except discord.HTTPException:
-                            pass
-                else:
-                    star_variant.star_var_id = None
-                    star_variant.starboard_id = None
-                    star_variant.forced = False
-                    self.bot.starboard.upsert(star_variant)
+        found_variants = await self.bot.starboard.get_many(payload.message_ids)
+        # an entry can be found through both its original and starboard message
+        ori_mes_ids = sorted({k.ori_mes_id for k in found_variants.values()})
+
+        async with contextlib.AsyncExitStack() as stack:
+            # always locked in the same order, so two bulk deletes can't deadlock
+            for ori_mes_id in ori_mes_ids:
+                await stack.enter_async_context(self.bot.star_locks(ori_mes_id))
+
+            removed: typing.List[star_classes.StarboardEntry] = []
+            for ori_mes_id in ori_mes_ids:
+                # it may have changed while waiting for the lock
+                star_variant = await self.bot.starboard.get(ori_mes_id)
+                if star_variant and self.entry_messages_deleted(
+                    star_variant, payload.message_ids
+                ):
+                    removed.append(star_variant)
+
+            self.bot.starboard.delete_many(e.ori_mes_id for e in removed)
+            await asyncio.gather(*(self.delete_star_message(e) for e in removed))
 
     @commands.Cog.listener()
     async def on_raw_reaction_clear(self, payload):
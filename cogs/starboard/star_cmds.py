@@ -2,7 +2,6 @@
 import importlib
 import typing
 
-import attr
 import discord
 from discord.ext import commands
 
@@ -15,28 +14,22 @@ import common.star_utils as star_utils
 import common.utils as utils
 
 
-@attr.define(slots=True)
-class StarRankEntry:
-    author_id: int
-    stars: int
-
-
 class StarCMDs(commands.Cog, name="Starboard"):
     """Commands for the starboard. See the settings command to set up the starboard."""
 
     def __init__(self, bot):
         self.bot: utils.SeraphimBase = bot
 
-    async def get_star_rankings(self, query: str):
-        sorted_entries = await self.bot.starboard.super_raw_query(
-            "SELECT author_id, SUM(cardinality(ori_reactors || var_reactors)) FROM"
-            f" starboard WHERE {query} AND NOT (ori_reactors = '{{}}' AND"
-            " var_reactors = '{}') GROUP BY author_id ORDER BY sum DESC"
-        )
-        return tuple(StarRankEntry(r["author_id"], r["sum"]) for r in sorted_entries)
+    async def get_star_rankings(
+        self, guild_id: int, author_ids: typing.Optional[typing.FrozenSet[int]] = None
+    ):
+        leaderboard = await self.bot.starboard.get_leaderboard(guild_id)
+        if author_ids is None:
+            return tuple(leaderboard)
+        return tuple(e for e in leaderboard if e.author_id in author_ids)
 
     def get_user_placing(
-        self, user_star_list: typing.Tuple[StarRankEntry, ...], author_id
+        self, user_star_list: typing.Tuple[star_classes.StarRankEntry, ...], author_id
     ):
         if author_entry := discord.utils.find(
             lambda e: e.author_id == author_id, user_star_list
@@ -46,6 +39,15 @@ class StarCMDs(commands.Cog, name="Starboard"):
         else:
             return "position: N/A - no stars found!"
 
+    def get_leaderboard_placing(
+        self, leaderboard: star_classes.StarLeaderboard, author_id: int
+    ):
+        if placing := leaderboard.position(author_id):
+            position, stars = placing
+            return f"position: #{position} with {stars} ⭐"
+        else:
+            return "position: N/A - no stars found!"
+
     async def cog_check(self, ctx):
         return self.bot.config.getattr(ctx.guild.id, "star_toggle")
 
@@ -136,22 +138,21 @@ class StarCMDs(commands.Cog, name="Starboard"):
 
         await ctx.trigger_typing()
 
-        conditions = ""
+        # if bots are filtered out, some of the entries may be dropped, so get a few more
+        amount = 10 if flags.bots else self.bot.starboard.top_entries_size
 
         if flags.user:
-            conditions = f"guild_id = {ctx.guild.id} AND author_id = {flags.user.id}"
+            guild_entries = await self.bot.starboard.get_top_entries(
+                ctx.guild.id, amount, author_id=flags.user.id
+            )
         elif flags.role:
-            conditions = (
-                f"guild_id = {ctx.guild.id} AND author_id IN ({','.join(role_members)})"
+            guild_entries = await self.bot.starboard.query_top_entries(
+                ctx.guild.id, amount, author_ids=[int(i) for i in role_members]
             )
         else:
-            conditions = f"guild_id = {ctx.guild.id}"
-
-        guild_entries = await self.bot.starboard.select_query(
-            f"{conditions} AND star_var_id IS NOT NULL AND NOT (ori_reactors = '{{}}'"
-            " AND var_reactors = '{}') ORDER BY cardinality(ori_reactors ||"
-            " var_reactors) DESC"
-        )
+            guild_entries = await self.bot.starboard.get_top_entries(
+                ctx.guild.id, amount
+            )
 
         if not guild_entries:
             raise utils.CustomCheckFailure(
@@ -238,13 +239,16 @@ class StarCMDs(commands.Cog, name="Starboard"):
         await ctx.trigger_typing()
 
         optional_role = flags.role
+        leaderboard = await self.bot.starboard.get_leaderboard(ctx.guild.id)
+
         if optional_role:
-            role_members = frozenset(str(r.id) for r in optional_role.members)
-            user_star_list = await self.get_star_rankings(
-                f"guild_id = {ctx.guild.id} AND author_id IN ({','.join(role_members)})"
-            )
+            role_members = frozenset(r.id for r in optional_role.members)
+            user_star_list = await self.get_star_rankings(ctx.guild.id, role_members)
+        elif flags.bots:
+            # nothing's filtered, so only the top 10 are needed
+            user_star_list = leaderboard.top(10)
         else:
-            user_star_list = await self.get_star_rankings(f"guild_id = {ctx.guild.id}")
+            user_star_list = await self.get_star_rankings(ctx.guild.id)
 
         if not user_star_list:
             raise utils.CustomCheckFailure(
@@ -301,7 +305,7 @@ class StarCMDs(commands.Cog, name="Starboard"):
             )
         else:
             top_embed.set_footer(
-                text=f"Your {self.get_user_placing(filtered_star_list, ctx.author.id)}"
+                text=f"Your {self.get_leaderboard_placing(leaderboard, ctx.author.id)}"
             )
         await ctx.reply(embed=top_embed)
 
@@ -320,16 +324,16 @@ class StarCMDs(commands.Cog, name="Starboard"):
         await ctx.trigger_typing()
 
         member = ctx.author if not user else user
-        user_star_list = await self.get_star_rankings(f"guild_id = {ctx.guild.id}")
+        leaderboard = await self.bot.starboard.get_leaderboard(ctx.guild.id)
 
-        if user_star_list:
+        if leaderboard:
             if user:
                 placing = (
                     f"{member.display_name}'s"
-                    f" {self.get_user_placing(user_star_list, member.id)}"
+                    f" {self.get_leaderboard_placing(leaderboard, member.id)}"
                 )
             else:
-                placing = f"Your {self.get_user_placing(user_star_list, member.id)}"
+                placing = f"Your {self.get_leaderboard_placing(leaderboard, member.id)}"
 
             place_embed = discord.Embed(
                 colour=discord.Colour(0xCFCA76),
@@ -520,11 +524,8 @@ class StarCMDs(commands.Cog, name="Starboard"):
                 starboard_entry = star_classes.StarboardEntry.new_entry(
                     msg, author_id, None, forced=forced
                 )
-                ctx.bot.starboard.add(starboard_entry)
-
-                await star_utils.sync_prev_reactors(
-                    ctx.bot, author_id, starboard_entry, remove=False
-                )
+                ctx.bot.starboard.upsert(starboard_entry)
+                ctx.bot.star_reconciler.mark(starboard_entry, remove=False)
             else:
                 raise commands.BadArgument(
                     "This message does not have an entry here internally."
@@ -546,17 +547,18 @@ class StarCMDs(commands.Cog, name="Starboard"):
 
         await ctx.trigger_typing()
 
-        starboard_entry = await self.initial_get(ctx, msg, forced=True)
+        async with star_utils.entry_lock(self.bot, msg.id):
+            starboard_entry = await self.initial_get(ctx, msg, forced=True)
 
-        if starboard_entry.star_var_id:
-            raise commands.BadArgument("This message is already on the starboard!")
+            if starboard_entry.star_var_id:
+                raise commands.BadArgument("This message is already on the starboard!")
 
-        starboard_entry.forced = True
-        self.bot.starboard.upsert(starboard_entry)
-        self.bot.star_queue.put_nowait((msg.channel.id, msg.id, msg.guild.id))
-        await ctx.reply(
-            "Done! Please wait a couple of seconds for the message to appear."
-        )
+            starboard_entry.forced = True
+            self.bot.starboard.upsert(starboard_entry)
+            self.bot.star_queue.put_nowait((msg.channel.id, msg.id, msg.guild.id))
+            await ctx.reply(
+                "Done! Please wait a couple of seconds for the message to appear."
+            )
 
     @sb.command()
     @utils.proper_permissions()
@@ -569,14 +571,17 @@ class StarCMDs(commands.Cog, name="Starboard"):
 
         await ctx.trigger_typing()
 
-        starboard_entry = await self.initial_get(ctx, msg)
-        starboard_entry.frozen = True
-        starboard_entry.updated = False
-        self.bot.starboard.upsert(starboard_entry)
-        if starboard_entry.star_var_id:
-            await star_utils.star_entry_refresh(self.bot, starboard_entry, ctx.guild.id)
+        async with star_utils.entry_lock(self.bot, msg.id):
+            starboard_entry = await self.initial_get(ctx, msg)
+            starboard_entry.frozen = True
+            starboard_entry.updated = False
+            self.bot.starboard.upsert(starboard_entry)
+            if starboard_entry.star_var_id:
+                await star_utils.star_entry_refresh(
+                    self.bot, starboard_entry, ctx.guild.id
+                )
 
-        await ctx.reply("The message's star count has been frozen.")
+            await ctx.reply("The message's star count has been frozen.")
 
     @sb.command()
     @utils.proper_permissions()
@@ -590,33 +595,34 @@ class StarCMDs(commands.Cog, name="Starboard"):
 
         await ctx.trigger_typing()
 
-        starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
-
-        if not starboard_entry.star_var_id:
-            raise commands.BadArgument("That message is not on the starboard!")
-
-        starboard_entry.trashed = True
-        starboard_entry.var_reactors = set()
-        starboard_entry.updated = False
-        self.bot.starboard.upsert(starboard_entry)
-
-        chan = msg.guild.get_channel_or_thread(starboard_entry.starboard_id)
-        try:
-            mes = await chan.fetch_message(starboard_entry.star_var_id)
-            await mes.delete()
-            self.bot.star_queue.remove_from_copy(
-                (
-                    starboard_entry.ori_chan_id,
-                    starboard_entry.ori_mes_id,
-                    starboard_entry.guild_id,
+        async with star_utils.entry_lock(self.bot, msg.id):
+            starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
+
+            if not starboard_entry.star_var_id:
+                raise commands.BadArgument("That message is not on the starboard!")
+
+            starboard_entry.trashed = True
+            starboard_entry.var_reactors = set()
+            starboard_entry.updated = False
+            self.bot.starboard.upsert(starboard_entry)
+
+            chan = msg.guild.get_channel_or_thread(starboard_entry.starboard_id)
+            try:
+                mes = await chan.fetch_message(starboard_entry.star_var_id)
+                await mes.delete()
+                self.bot.star_queue.remove_from_copy(
+                    (
+                        starboard_entry.ori_chan_id,
+                        starboard_entry.ori_mes_id,
+                        starboard_entry.guild_id,
+                    )
+                )
+                await ctx.reply("The message has been trashed.")
+            except discord.HTTPException or AttributeError:
+                raise commands.BadArgument(
+                    "I couldn't trash this message! I most likely "
+                    + "lack the permissions to do so."
                 )
-            )
-            await ctx.reply("The message has been trashed.")
-        except discord.HTTPException or AttributeError:
-            raise commands.BadArgument(
-                "I couldn't trash this message! I most likely "
-                + "lack the permissions to do so."
-            )
 
     @sb.command()
     @utils.proper_permissions()
@@ -629,17 +635,20 @@ class StarCMDs(commands.Cog, name="Starboard"):
 
         await ctx.trigger_typing()
 
-        starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
-        if not starboard_entry.frozen:
-            raise commands.BadArgument("This message is not frozen.")
-
-        starboard_entry.frozen = False
-        starboard_entry.updated = False
-        self.bot.starboard.upsert(starboard_entry)
-        if starboard_entry.star_var_id:
-            await star_utils.star_entry_refresh(self.bot, starboard_entry, ctx.guild.id)
+        async with star_utils.entry_lock(self.bot, msg.id):
+            starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
+            if not starboard_entry.frozen:
+                raise commands.BadArgument("This message is not frozen.")
+
+            starboard_entry.frozen = False
+            starboard_entry.updated = False
+            self.bot.starboard.upsert(starboard_entry)
+            if starboard_entry.star_var_id:
+                await star_utils.star_entry_refresh(
+                    self.bot, starboard_entry, ctx.guild.id
+                )
 
-        await ctx.reply("The message's star count has been unfrozen.")
+            await ctx.reply("The message's star count has been unfrozen.")
 
     @sb.command()
     @utils.proper_permissions()
@@ -651,15 +660,16 @@ class StarCMDs(commands.Cog, name="Starboard"):
 
         await ctx.trigger_typing()
 
-        starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
-        if not starboard_entry.trashed:
-            raise commands.BadArgument("This message is not trashed.")
+        async with star_utils.entry_lock(self.bot, msg.id):
+            starboard_entry = await self.initial_get(ctx, msg, do_not_create=True)
+            if not starboard_entry.trashed:
+                raise commands.BadArgument("This message is not trashed.")
 
-        starboard_entry.trashed = False
-        starboard_entry.updated = False
-        self.bot.starboard.upsert(starboard_entry)
+            starboard_entry.trashed = False
+            starboard_entry.updated = False
+            self.bot.starboard.upsert(starboard_entry)
 
-        await ctx.reply("The message has been untrashed.")
+            await ctx.reply("The message has been untrashed.")
 
     @sb.command(aliases=["update"])
     @commands.cooldown(1, 5, commands.BucketType.guild)
@@ -684,11 +694,7 @@ class StarCMDs(commands.Cog, name="Starboard"):
         )
 
         starboard_chan = ctx.guild.get_channel_or_thread(starboard_entry.starboard_id)
-        try:
-            starboard_msg = await starboard_chan.fetch_message(
-                starboard_entry.star_var_id
-            )
-        except discord.HTTPException or AttributeError:
+        if not starboard_chan:
             raise utils.CustomCheckFailure(
                 "The starboard message cannot be found! Make sure the bot can see the"
                 " channel."
@@ -703,10 +709,28 @@ class StarCMDs(commands.Cog, name="Starboard"):
                 " channel."
             )
 
-        new_embed = await star_mes.star_generate(self.bot, ori_msg)
+        # this is for picking up new avatars and the like, so nothing cached
+        new_embed = await star_mes.star_generate(self.bot, ori_msg, fresh=True)
         new_content = star_utils.generate_content_str(starboard_entry)
 
-        await starboard_msg.edit(content=new_content, embed=new_embed)
+        # a remade embed isn't urgent, so count updates get to go first
+        try:
+            starboard_msg = await self.bot.star_edits.edit(
+                starboard_chan.id,
+                starboard_entry.star_var_id,
+                star_utils.EDIT_EMBED,
+                content=new_content,
+                embed=new_embed,
+            )
+        except discord.HTTPException:
+            starboard_msg = None
+
+        if not starboard_msg:
+            raise utils.CustomCheckFailure(
+                "The starboard message cannot be found! Make sure the bot can see the"
+                " channel."
+            )
+
         await ctx.reply(
             f"Updated! Check out {starboard_msg.jump_url} to see the updated message!"
         )
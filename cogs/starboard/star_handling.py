@@ -12,34 +12,34 @@ import common.utils as utils
 class Star(commands.Cog):
     def __init__(self, bot):
         self.bot: utils.SeraphimBase = bot
-        self.star_task = bot.loop.create_task(self.starboard_queue())
+        self.bot.star_workers.start(self.send_queued)
 
     def cog_unload(self):
-        self.star_task.cancel()
-
-    async def starboard_queue(self):
-        while True:
-            entry = await self.bot.star_queue.get()
+        self.bot.star_workers.stop()
 
+    async def send_queued(self, entry: star_utils.StarQueueItem):
+        # the entry may change while sending, and sending twice is no good
+        async with self.bot.star_locks(entry[1]):
             starboard_entry = await self.bot.starboard.get(entry[1])
+            if not starboard_entry:
+                return
+
             guild = self.bot.get_guild(starboard_entry.guild_id)
             chan = guild.get_channel_or_thread(entry[0])
 
-            # if the entry for the message exists in the bot and if the entry is above or at the required amount
-            # for that server
-            if starboard_entry and (
+            # if the entry is above or at the required amount for that server,
+            # and it wasn't already sent while this was queued up
+            if not starboard_entry.star_var_id and (
                 starboard_entry.num_reactors
                 >= self.bot.config.getattr(entry[2], "star_limit")
                 or starboard_entry.forced
             ):
                 try:
-                    mes = await chan.fetch_message(entry[1])
+                    mes = await self.bot.star_messages.fetch(chan, entry[1])
                     await star_mes.send(self.bot, mes)
                 except discord.HTTPException:  # you never know
                     pass
 
-            self.bot.star_queue.task_done()
-
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
         if not (star_utils.star_check(self.bot, payload) and str(payload.emoji) == "⭐"):
@@ -56,6 +56,11 @@ class Star(commands.Cog):
         except discord.HTTPException:
             return
 
+        async with star_utils.entry_lock(self.bot, mes.id):
+            await self.star_added(payload, user, channel, mes)
+
+    async def star_added(self, payload, user, channel, mes):
+        # should only be run with the entry's lock held
         if not user.bot and channel.id not in self.bot.config.getattr(
             mes.guild.id, "star_blacklist"
         ):
@@ -98,9 +103,7 @@ class Star(commands.Cog):
                     new_entry = await self.bot.starboard.get(mes.id)
                     new_stars = new_entry.num_reactors
                     if old_stars != new_stars:  # we don't want to refresh too often
-                        await star_utils.star_entry_refresh(
-                            self.bot, starboard_entry, mes.guild.id
-                        )
+                        await self.bot.star_refresher.schedule(new_entry)
 
             elif self.bot.config.getattr(mes.guild.id, "remove_reaction"):
                 # the previous if confirms this is the author who is reaction (simply by elimination), so...
@@ -127,6 +130,11 @@ class Star(commands.Cog):
         except discord.HTTPException:
             return
 
+        async with star_utils.entry_lock(self.bot, mes.id):
+            await self.star_removed(payload, user, channel, mes)
+
+    async def star_removed(self, payload, user, channel, mes):
+        # should only be run with the entry's lock held
         if (
             not user.bot
             and mes.author.id != user.id
@@ -141,9 +149,7 @@ class Star(commands.Cog):
                 )
 
                 if star_variant.star_var_id:
-                    await star_utils.star_entry_refresh(
-                        self.bot, star_variant, mes.guild.id
-                    )
+                    await self.bot.star_refresher.schedule(star_variant)
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
@@ -154,50 +160,48 @@ class Star(commands.Cog):
         # if the message contents were update.
         # The best I can do is see if the raw data has the content in it, and just assume if it does,
         # that it means that it's a valid edit.
+        self.bot.star_messages.update_from_edit(payload)
+
         if payload.data.get("content") is None:
             return
 
-        # So we passed that initial check, but now we actually need the message
-        # (we could use the raw data, but better safe than sorry). Sometimes we might not
-        # have to waste API calls on it, but sometimes we do.
-        mes = payload.cached_message
-        if not mes:
-            guild = self.bot.get_guild(payload.guild_id)
-            if not guild:
-                return
+        guild = self.bot.get_guild(payload.guild_id)
+        # only starboard entries care about edits, and only if the edit message toggle is on
+        if not guild or not self.bot.config.getattr(guild.id, "star_edit_messages"):
+            return
 
-            chan = guild.get_channel_or_thread(payload.channel_id)
-            try:
-                mes = await chan.fetch_message(payload.message_id)
-            except discord.HTTPException or AttributeError:
-                return
+        starboard_entry = await self.bot.starboard.get(
+            payload.message_id, check_for_var=True
+        )
+        # if the starboard entry exists and the star variant of the entry is not the message edited
+        if not starboard_entry or starboard_entry.star_var_id == payload.message_id:
+            return
 
-        # if message exists and the edit message toggle is on
-        if (
-            mes
-            and mes.guild
-            and self.bot.config.getattr(mes.guild.id, "star_edit_messages")
-        ):
-            starboard_entry = await self.bot.starboard.get(mes.id, check_for_var=True)
+        # So we passed those checks, but now we actually need the message
+        # (we could use the raw data, but better safe than sorry).
+        # cached_message is from before the edit, which would give an outdated embed,
+        # and our own copy was just dropped for the same reason
+        chan = guild.get_channel_or_thread(payload.channel_id)
+        try:
+            # caches the edited version for the reactions that follow
+            mes = await self.bot.star_messages.fetch(chan, payload.message_id)
+        except (discord.HTTPException, AttributeError):
+            return
 
-            # if the starboard entry exists and the star variant of the entry is not the message edited
-            if starboard_entry and starboard_entry.star_var_id != mes.id:
-                new_embed = await star_mes.star_generate(self.bot, mes)
+        new_embed = await star_mes.star_generate(self.bot, mes)
 
-                star_chan = mes.guild.get_channel_or_thread(
-                    starboard_entry.starboard_id
+        star_chan = guild.get_channel_or_thread(starboard_entry.starboard_id)
+        if star_chan:
+            # the content stays as is, so the message doesn't need fetching
+            try:
+                await self.bot.star_edits.edit(
+                    star_chan.id,
+                    starboard_entry.star_var_id,
+                    star_utils.EDIT_EMBED,
+                    embed=new_embed,
                 )
-                if star_chan:
-                    try:
-                        starboard_mes = await star_chan.fetch_message(
-                            starboard_entry.star_var_id
-                        )
-                        starboard_content = starboard_mes.content
-                        await starboard_mes.edit(
-                            content=starboard_content, embed=new_embed
-                        )
-                    except discord.HTTPException:
-                        pass
+            except discord.HTTPException:
+                pass
 
 
 async def setup(bot):
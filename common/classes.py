@@ -1,7 +1,11 @@
 #!/usr/bin/env python3.8
 import asyncio
+import collections
+import contextlib
 import datetime
+import time
 import typing
+import weakref
 
 import attr
 import discord
@@ -23,7 +27,11 @@ class SnipedMessage:
 if typing.TYPE_CHECKING:
 
     class SetAsyncQueue(asyncio.Queue[_T]):
-        ...
+        def __contains__(self, item: _T) -> bool:
+            ...
+
+        def __iter__(self) -> typing.Iterator[_T]:
+            ...
 
     class SetUpdateAsyncQueue(SetAsyncQueue[_T]):
         ...
@@ -31,6 +39,15 @@ if typing.TYPE_CHECKING:
     class SetNoReaddAsyncQueue(asyncio.Queue[_T]):
         ...
 
+    class FairSetNoReaddAsyncQueue(SetNoReaddAsyncQueue[_T]):
+        def __init__(
+            self, key: typing.Callable[[_T], typing.Hashable], maxsize: int = 0
+        ):
+            ...
+
+        def queued_for(self, item: _T) -> float:
+            ...
+
 else:
 
     class SetAsyncQueue(asyncio.Queue):
@@ -45,6 +62,12 @@ else:
         def _put(self, item):
             self._queue.add(item)
 
+        def __contains__(self, item):
+            return item in self._queue
+
+        def __iter__(self):
+            return iter(self._queue)
+
     class SetUpdateAsyncQueue(SetAsyncQueue):
         """A special type of async queue that uses a set instead of a list.
         Also updates instead of discards entries if it encounters a duplicate."""
@@ -77,6 +100,156 @@ else:
         def clear_memory(self):
             self._queuecopy.clear()
 
+    class FairSetNoReaddAsyncQueue(SetNoReaddAsyncQueue):
+        """A SetNoReaddAsyncQueue that goes round-robin through groups of entries,
+        grouped by the key given. Within a group, entries come out in the order
+        they went in. Also keeps track of when entries were put in."""
+
+        def __init__(self, key, maxsize=0):
+            self._key = key
+            super().__init__(maxsize)
+
+        def _init(self, maxsize):
+            super()._init(maxsize)
+            self._groups = {}
+            self._group_order = collections.deque()
+            self._queued_at = {}
+
+        def _get(self):
+            key = self._group_order.popleft()
+            group = self._groups[key]
+            item = group.popleft()
+
+            if group:
+                self._group_order.append(key)
+            else:
+                del self._groups[key]
+
+            self._queue.discard(item)
+            return item
+
+        def _put(self, item):
+            if item in self._queuecopy:
+                return
+
+            self._queue.add(item)
+            self._queuecopy.add(item)
+            self._queued_at[item] = time.monotonic()
+
+            key = self._key(item)
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = collections.deque()
+                self._group_order.append(key)
+            group.append(item)
+
+        def queued_for(self, item) -> float:
+            """How long the item was waiting in the queue. Only works once per item."""
+            queued_at = self._queued_at.pop(item, None)
+            return time.monotonic() - queued_at if queued_at is not None else 0.0
+
+
+@attr.s(slots=True)
+class LockStats:
+    """Keeps track of how often locks had to be waited on, and for how long."""
+
+    acquisitions: int = attr.ib(default=0)
+    contended: int = attr.ib(default=0)
+    total_wait: float = attr.ib(default=0.0)
+    max_wait: float = attr.ib(default=0.0)
+
+    @property
+    def contention_ratio(self) -> float:
+        """How many acquisitions had to wait on someone else."""
+        if not self.acquisitions:
+            return 0.0
+        return self.contended / self.acquisitions
+
+    @property
+    def avg_wait(self) -> float:
+        """How long contended acquisitions waited, on average."""
+        if not self.contended:
+            return 0.0
+        return self.total_wait / self.contended
+
+
+class KeyedLock:
+    """Gives out a lock per key, so anything using the same key runs one at a time
+    while different keys run in parallel.
+
+    Locks are only weakly referenced, so they go away once nothing is holding
+    or waiting on them. Use it like `async with keyed_lock(key):`."""
+
+    def __init__(self):
+        self._locks: weakref.WeakValueDictionary[
+            typing.Hashable, asyncio.Lock
+        ] = weakref.WeakValueDictionary()
+        self.stats = LockStats()
+
+    def __len__(self):
+        return len(self._locks)
+
+    def locked(self, key: typing.Hashable) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key: typing.Hashable):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+
+        self.stats.acquisitions += 1
+
+        if lock.locked():
+            self.stats.contended += 1
+            start = time.perf_counter()
+            await lock.acquire()
+            wait = time.perf_counter() - start
+            self.stats.total_wait += wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+        else:
+            await lock.acquire()
+
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+class TokenBucket:
+    """A token bucket, for spreading out requests.
+    Holds up to capacity tokens, and gets rate more every second."""
+
+    __slots__ = ("rate", "capacity", "tokens", "_updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def delay(self) -> float:
+        """How long until there's a token to take. 0 if there's one now."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        """Takes a token, waiting for one if there are none."""
+        while (delay := self.delay()) > 0:
+            await asyncio.sleep(delay)
+        self.tokens -= 1
+
 
 class PowerofTwoConverter(commands.Converter[int]):
     """A converter to check if the argument provided is a valid Discord power of 2."""
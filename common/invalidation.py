@@ -0,0 +1,216 @@
+#!/usr/bin/env python3.8
+"""Keeps caches in sync between bot processes through postgres's LISTEN/NOTIFY.
+
+Whenever a process writes something other processes may have cached, it sends out
+the IDs of what changed, and every other process drops or refreshes its copy.
+Each process numbers what it sends, so a skipped number means something got lost
+and everything cached has to be thrown out. Same goes for if the listening
+connection drops, since anything sent while it was down is gone."""
+import asyncio
+import logging
+import typing
+import uuid
+
+import asyncpg
+import attr
+import discord
+import orjson
+from lru import LRU
+
+# (ids, guild_ids) -> whatever, sync or async
+InvalidateCallback = typing.Callable[[typing.List[int], typing.List[int]], typing.Any]
+ResyncCallback = typing.Callable[[], typing.Any]
+
+_Incoming = typing.Tuple[typing.Optional[str], typing.List[int], typing.List[int]]
+# errors that mean the connection or database went away
+_CONNECTION_ERRORS = (
+    asyncpg.PostgresError,
+    asyncpg.InterfaceError,
+    OSError,
+    asyncio.TimeoutError,
+)
+
+# notify payloads max out at 8000 bytes, and a snowflake and comma is about 20
+MAX_IDS_PER_NOTIFY = 150
+
+
+@attr.s(slots=True)
+class InvalidationStats:
+    """Keeps track of what's been sent and received over the bus."""
+
+    published: int = attr.ib(default=0)
+    failed: int = attr.ib(default=0)
+    received: int = attr.ib(default=0)
+    gaps: int = attr.ib(default=0)
+    resyncs: int = attr.ib(default=0)
+
+
+@attr.s(slots=True)
+class _Subscription:
+    on_invalidate: InvalidateCallback = attr.ib()
+    on_resync: ResyncCallback = attr.ib()
+
+
+class InvalidationBus:
+    """Sends and receives cache invalidations for every other process using
+    the same database. Messages are sent in order, one NOTIFY per publish
+    (or a few, if there are a lot of IDs).
+
+    Each kind of thing cached subscribes with a callback for when some of it
+    changed, and one for when everything needs reloading."""
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        channel: str = "seraphim_invalidate",
+        ping_interval: float = 30,
+    ):
+        self.pool = pool
+        self.channel = channel
+        self.ping_interval = ping_interval
+        self.stats = InvalidationStats()
+        # tells our own messages apart from everyone else's
+        self.source = uuid.uuid4().hex
+        self._seq = 0
+        # source -> the last sequence number seen from it
+        self._last_seqs: typing.Dict[str, int] = LRU(256)
+        self._subscriptions: typing.Dict[str, _Subscription] = {}
+        self._outgoing: "asyncio.Queue[bytes]" = asyncio.Queue()
+        # (kind, ids, guild_ids), with a kind of None meaning resync everything
+        self._incoming: "asyncio.Queue[_Incoming]" = asyncio.Queue()
+
+        loop = asyncio.get_event_loop()
+        self._tasks = [
+            loop.create_task(self._listen_loop()),
+            loop.create_task(self._send_loop()),
+            loop.create_task(self._handle_loop()),
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def subscribe(
+        self, kind: str, on_invalidate: InvalidateCallback, on_resync: ResyncCallback
+    ):
+        """Listens for changes to a kind of thing. Subscribing to the same kind again
+        replaces the old callbacks, which is handy for cogs that get reloaded."""
+        self._subscriptions[kind] = _Subscription(on_invalidate, on_resync)
+
+    def publish(
+        self,
+        kind: str,
+        ids: typing.Collection[int] = (),
+        guild_ids: typing.Collection[int] = (),
+    ):
+        """Tells every other process that the things with these IDs changed.
+        Doesn't wait for it to be sent."""
+        ids = list(ids)
+        guild_ids = list(guild_ids)
+
+        for i in range(0, max(len(ids), len(guild_ids), 1), MAX_IDS_PER_NOTIFY):
+            self._seq += 1
+            self._outgoing.put_nowait(
+                orjson.dumps(
+                    {
+                        "src": self.source,
+                        "seq": self._seq,
+                        "kind": kind,
+                        "ids": ids[i : i + MAX_IDS_PER_NOTIFY],
+                        "guilds": guild_ids[i : i + MAX_IDS_PER_NOTIFY],
+                    }
+                )
+            )
+
+    async def _send_loop(self):
+        try:
+            while True:
+                payload = await self._outgoing.get()
+                try:
+                    await self.pool.execute(
+                        "SELECT pg_notify($1, $2)", self.channel, payload.decode()
+                    )
+                    self.stats.published += 1
+                except _CONNECTION_ERRORS as e:
+                    # the sequence number's used up anyways, so everyone
+                    # else will see the gap and resync
+                    self.stats.failed += 1
+                    logging.getLogger("discord").warning(
+                        f"Could not send a cache invalidation: {e}"
+                    )
+        except asyncio.CancelledError:
+            pass
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        data = orjson.loads(payload)
+        if data["src"] == self.source:
+            return
+
+        self.stats.received += 1
+
+        last_seq = self._last_seqs.get(data["src"])
+        self._last_seqs[data["src"]] = data["seq"]
+        # a source we haven't heard from either just started, or started before us,
+        # and there's nothing to have missed either way
+        if last_seq is not None and data["seq"] != last_seq + 1:
+            self.stats.gaps += 1
+            self._incoming.put_nowait((None, [], []))
+            return
+
+        self._incoming.put_nowait((data["kind"], data["ids"], data["guilds"]))
+
+    async def _handle_loop(self):
+        try:
+            while True:
+                kind, ids, guild_ids = await self._incoming.get()
+
+                try:
+                    if kind is None:
+                        self.stats.resyncs += 1
+                        for subscription in list(self._subscriptions.values()):
+                            await discord.utils.maybe_coroutine(subscription.on_resync)
+                    elif subscription := self._subscriptions.get(kind):
+                        await discord.utils.maybe_coroutine(
+                            subscription.on_invalidate, ids, guild_ids
+                        )
+                except Exception as e:
+                    logging.getLogger("discord").exception(
+                        f"Could not handle a cache invalidation: {e}"
+                    )
+        except asyncio.CancelledError:
+            pass
+
+    async def _listen_loop(self):
+        """Holds onto a connection to listen on, getting a new one if it dies."""
+        logger = logging.getLogger("discord")
+        connected_before = False
+
+        try:
+            while True:
+                try:
+                    async with self.pool.acquire() as conn:
+                        await conn.add_listener(self.channel, self._on_notify)
+
+                        if connected_before:
+                            # anything sent while we weren't listening is gone
+                            self._incoming.put_nowait((None, [], []))
+                        connected_before = True
+
+                        try:
+                            # a dead connection won't say so until it's used
+                            while True:
+                                await asyncio.sleep(self.ping_interval)
+                                await conn.fetchval(
+                                    "SELECT 1", timeout=self.ping_interval
+                                )
+                        finally:
+                            if not conn.is_closed():
+                                await conn.remove_listener(
+                                    self.channel, self._on_notify
+                                )
+                except _CONNECTION_ERRORS as e:
+                    connected_before = True
+                    logger.warning(f"Lost the cache invalidation listener: {e}")
+                    await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3.8
+import logging
+import os
+import re
+import sqlite3
+import typing
+
+import asyncpg
+import attr
+
+# migrations live next to common, named like 0001_some_description.sql
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations"
+)
+# sqlite has its own, since the sql is different enough
+SQLITE_MIGRATIONS_DIR = os.path.join(MIGRATIONS_DIR, "sqlite")
+_MIGRATION_NAME = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+
+# any number works, as long as nothing else uses it for an advisory lock
+_MIGRATION_LOCK_ID = 7_011_958_462
+
+
+@attr.s(slots=True, frozen=True)
+class Migration:
+    """A numbered SQL migration."""
+
+    version: int = attr.ib()
+    name: str = attr.ib()
+    path: str = attr.ib()
+
+    def read(self) -> str:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return f.read()
+
+
+def get_migrations(directory: str = MIGRATIONS_DIR) -> typing.List[Migration]:
+    """Gets every migration in the directory, sorted by version."""
+    migrations: typing.List[Migration] = []
+
+    for filename in os.listdir(directory):
+        if match := _MIGRATION_NAME.match(filename):
+            migrations.append(
+                Migration(
+                    int(match.group(1)),
+                    match.group(2),
+                    os.path.join(directory, filename),
+                )
+            )
+
+    migrations.sort(key=lambda m: m.version)
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Two migrations share the same version.")
+
+    return migrations
+
+
+async def _ensure_table(conn: asyncpg.Connection):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+               version INTEGER PRIMARY KEY,
+               name TEXT NOT NULL,
+               applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+           )"""
+    )
+
+
+async def get_applied(pool: asyncpg.Pool) -> typing.Dict[int, str]:
+    """Gets the versions and names of every migration already run."""
+    async with pool.acquire() as conn:
+        await _ensure_table(conn)
+        data = await conn.fetch("SELECT version, name FROM schema_migrations")
+
+    return {r["version"]: r["name"] for r in data}
+
+
+async def get_pending(pool: asyncpg.Pool) -> typing.List[Migration]:
+    """Gets every migration that hasn't been run yet."""
+    applied = await get_applied(pool)
+    return [m for m in get_migrations() if m.version not in applied]
+
+
+async def migrate(pool: asyncpg.Pool) -> typing.List[Migration]:
+    """Runs every pending migration in order, each in its own transaction.
+    Returns the migrations that were run.
+
+    An advisory lock makes sure only one process migrates at a time."""
+    logger = logging.getLogger("discord")
+    ran: typing.List[Migration] = []
+
+    async with pool.acquire() as conn:
+        await _ensure_table(conn)
+
+        for migration in get_migrations():
+            async with conn.transaction():
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK_ID
+                )
+
+                # someone else may have run it while we waited for the lock
+                if await conn.fetchval(
+                    "SELECT 1 FROM schema_migrations WHERE version = $1",
+                    migration.version,
+                ):
+                    continue
+
+                await conn.execute(migration.read())
+                await conn.execute(
+                    "INSERT INTO schema_migrations(version, name) VALUES($1, $2)",
+                    migration.version,
+                    migration.name,
+                )
+
+            logger.info(f"Ran migration {migration.version}: {migration.name}.")
+            ran.append(migration)
+
+    return ran
+
+
+def _ensure_sqlite_table(conn: sqlite3.Connection):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+               version INTEGER PRIMARY KEY,
+               name TEXT NOT NULL,
+               applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+           )"""
+    )
+
+
+def get_applied_sqlite(conn: sqlite3.Connection) -> typing.Dict[int, str]:
+    """Gets the versions and names of every migration already run on a sqlite database.
+    The connection should give rows that can be indexed by name."""
+    _ensure_sqlite_table(conn)
+    data = conn.execute("SELECT version, name FROM schema_migrations").fetchall()
+    return {r["version"]: r["name"] for r in data}
+
+
+def _split_sqlite_statements(script: str) -> typing.Iterator[str]:
+    """Splits a script into statements. executescript would do this for us,
+    but it commits before running, which would break the transaction."""
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        # triggers have semicolons in them, so wait until the statement's complete
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \n\t;"):
+                yield statement
+            statement = ""
+
+
+def migrate_sqlite(conn: sqlite3.Connection) -> typing.List[Migration]:
+    """Like migrate, but for a sqlite database. Blocks, so run it in a thread.
+
+    The connection should be in autocommit mode. BEGIN IMMEDIATE takes the write lock
+    right away, which does what the advisory lock does for postgres."""
+    logger = logging.getLogger("discord")
+    ran: typing.List[Migration] = []
+
+    _ensure_sqlite_table(conn)
+
+    for migration in get_migrations(SQLITE_MIGRATIONS_DIR):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # someone else may have run it while we waited for the lock
+            if conn.execute(
+                "SELECT 1 FROM schema_migrations WHERE version = ?",
+                (migration.version,),
+            ).fetchone():
+                conn.execute("ROLLBACK")
+                continue
+
+            for statement in _split_sqlite_statements(migration.read()):
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_migrations(version, name) VALUES(?, ?)",
+                (migration.version, migration.name),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+        logger.info(f"Ran sqlite migration {migration.version}: {migration.name}.")
+        ran.append(migration)
+
+    return ran
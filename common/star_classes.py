@@ -1,15 +1,23 @@
 #!/usr/bin/env python3.8
+import array
 import asyncio
+import bisect
+import collections
+import datetime
 import enum
 import logging
+import random
+import sys
+import time
 import typing
 
-import asyncpg
 import attr
 import discord
 from lru import LRU
 
 import common.classes as cclass
+import common.invalidation as invalidation
+import common.storage as storage
 
 
 class ReactorType(enum.Enum):
@@ -20,6 +28,166 @@ class ReactorType(enum.Enum):
     ALL_REACTORS = 3
 
 
+class StarEventKind(enum.IntEnum):
+    """The kinds of changes written to the star event log."""
+
+    # the entry was (re)made - anything from before it no longer applies
+    CREATE = 1
+    ADD_ORI = 2
+    ADD_VAR = 3
+    # removes from both, same as remove_reactor
+    REMOVE = 4
+    CLEAR_ORI = 5
+    CLEAR_VAR = 6
+    DELETE = 7
+
+
+# (kind, user id if there is one, when it happened as a unix timestamp)
+StarEvent = typing.Tuple[StarEventKind, typing.Optional[int], float]
+
+
+class ReactorSet:
+    """A compact, set-like container of reactor IDs.
+
+    IDs are kept sorted in an unsigned 64-bit array, so each one costs 8 bytes
+    instead of a whole int object plus a set slot. Membership is a binary search,
+    and unions are done by merging the two sorted arrays."""
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids: typing.Iterable[int] = ()):
+        if isinstance(ids, ReactorSet):
+            self._ids = array.array("Q", ids._ids)
+        else:
+            self._ids = array.array("Q", sorted(set(ids)))
+
+    @classmethod
+    def _from_sorted(cls, ids: array.array):
+        reactor_set = cls.__new__(cls)
+        reactor_set._ids = ids
+        return reactor_set
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, reactor_id: int):
+        index = bisect.bisect_left(self._ids, reactor_id)
+        return index < len(self._ids) and self._ids[index] == reactor_id
+
+    def __eq__(self, other):
+        if isinstance(other, ReactorSet):
+            return self._ids == other._ids
+        if isinstance(other, (set, frozenset)):
+            return len(self._ids) == len(other) and all(i in other for i in self._ids)
+        return NotImplemented
+
+    def __or__(self, other: "ReactorSet"):
+        return self.union(other)
+
+    def __repr__(self):
+        return f"ReactorSet({self._ids.tolist()})"
+
+    def add(self, reactor_id: int):
+        index = bisect.bisect_left(self._ids, reactor_id)
+        if index == len(self._ids) or self._ids[index] != reactor_id:
+            self._ids.insert(index, reactor_id)
+
+    def discard(self, reactor_id: int):
+        index = bisect.bisect_left(self._ids, reactor_id)
+        if index < len(self._ids) and self._ids[index] == reactor_id:
+            del self._ids[index]
+
+    def _merge(self, other: "ReactorSet") -> typing.Iterator[int]:
+        """Yields the sorted, distinct IDs of both sets."""
+        ours = self._ids
+        theirs = other._ids
+        i = j = 0
+
+        while i < len(ours) and j < len(theirs):
+            if ours[i] < theirs[j]:
+                yield ours[i]
+                i += 1
+            elif ours[i] > theirs[j]:
+                yield theirs[j]
+                j += 1
+            else:
+                yield ours[i]
+                i += 1
+                j += 1
+
+        yield from ours[i:]
+        yield from theirs[j:]
+
+    def union(self, other: "ReactorSet") -> "ReactorSet":
+        if not other._ids:
+            return ReactorSet(self)
+        if not self._ids:
+            return ReactorSet(other)
+        return ReactorSet._from_sorted(array.array("Q", self._merge(other)))
+
+    def union_count(self, other: "ReactorSet") -> int:
+        """Counts the distinct IDs in both sets without building the union."""
+        if not other._ids:
+            return len(self._ids)
+        if not self._ids:
+            return len(other._ids)
+        return sum(1 for _ in self._merge(other))
+
+    def __getitem__(self, index: int) -> int:
+        return self._ids[index]
+
+    def tolist(self) -> typing.List[int]:
+        return self._ids.tolist()
+
+    def sizeof(self) -> int:
+        """How many bytes this set takes up, including its buffer."""
+        return sys.getsizeof(self) + sys.getsizeof(self._ids)
+
+
+@attr.s(slots=True)
+class ReactorDelta:
+    """The reactors added to and removed from a reactor set since it was last written.
+    """
+
+    added: typing.Set[int] = attr.ib(factory=set)
+    removed: typing.Set[int] = attr.ib(factory=set)
+
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+    def add(self, reactor_id: int):
+        # if it was removed earlier, it's still in the database
+        if reactor_id in self.removed:
+            self.removed.discard(reactor_id)
+        else:
+            self.added.add(reactor_id)
+
+    def remove(self, reactor_id: int):
+        # if it was added earlier, it never made it to the database
+        if reactor_id in self.added:
+            self.added.discard(reactor_id)
+        else:
+            self.removed.add(reactor_id)
+
+
+def _reactors_replaced(instance: "StarboardEntry", attribute, value):
+    # no way of telling what changed in the log, so start the set over
+    now = time.time()
+    if attribute.name == "ori_reactors":
+        clear_kind, add_kind = StarEventKind.CLEAR_ORI, StarEventKind.ADD_ORI
+    else:
+        clear_kind, add_kind = StarEventKind.CLEAR_VAR, StarEventKind.ADD_VAR
+    instance._events.append((clear_kind, None, now))
+    instance._events.extend((add_kind, reactor_id, now) for reactor_id in value)
+
+    instance._reactor_count = None
+    instance.require_full_write()
+    return value
+
+
 @attr.s(slots=True, eq=False)
 class StarboardEntry:
     """A way of representing a starboard entry in an easy way."""
@@ -29,13 +197,32 @@ class StarboardEntry:
     star_var_id: typing.Optional[int] = attr.ib()
     starboard_id: typing.Optional[int] = attr.ib()
     author_id: int = attr.ib()
-    ori_reactors: typing.Set[int] = attr.ib(converter=set)
-    var_reactors: typing.Set[int] = attr.ib(converter=set)
+    ori_reactors: ReactorSet = attr.ib(
+        converter=ReactorSet,
+        on_setattr=attr.setters.pipe(attr.setters.convert, _reactors_replaced),
+    )
+    var_reactors: ReactorSet = attr.ib(
+        converter=ReactorSet,
+        on_setattr=attr.setters.pipe(attr.setters.convert, _reactors_replaced),
+    )
     guild_id: int = attr.ib()
     forced: bool = attr.ib()
     frozen: bool = attr.ib()
     trashed: bool = attr.ib()
     updated: bool = attr.ib(default=False)
+    # distinct count of both reactor sets, reset whenever they change
+    _reactor_count: typing.Optional[int] = attr.ib(default=None, init=False, repr=False)
+    # what changed since the last write, so only that has to be sent
+    # new entries have no row yet, and so need the whole entry written
+    _full_write: bool = attr.ib(default=True, init=False, repr=False)
+    _ori_delta: ReactorDelta = attr.ib(factory=ReactorDelta, init=False, repr=False)
+    _var_delta: ReactorDelta = attr.ib(factory=ReactorDelta, init=False, repr=False)
+    # how many stars of this entry the leaderboards know about
+    _counted_stars: int = attr.ib(default=0, init=False, repr=False)
+    # how much of that hasn't been written yet, and so isn't in starboard_stars
+    _unflushed_stars: int = attr.ib(default=0, init=False, repr=False)
+    # changes not yet written to the event log
+    _events: typing.List[StarEvent] = attr.ib(factory=list, init=False, repr=False)
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.ori_mes_id == other.ori_mes_id
@@ -43,7 +230,7 @@ class StarboardEntry:
     @classmethod
     def from_row(cls, row):
         """Returns an entry from a row."""
-        return cls(
+        entry = cls(
             row["ori_mes_id"],
             row["ori_chan_id"],
             row["star_var_id"],
@@ -56,6 +243,9 @@ class StarboardEntry:
             row["frozen"],
             row["trashed"],
         )
+        entry._full_write = False
+        entry._counted_stars = entry.num_reactors
+        return entry
 
     @classmethod
     def new_entry(
@@ -67,7 +257,7 @@ class StarboardEntry:
     ):
         """Returns a new entry from base data."""
         if reactor_id:
-            return cls(
+            entry = cls(
                 mes.id,
                 mes.channel.id,
                 None,
@@ -82,7 +272,7 @@ class StarboardEntry:
                 updated=True,
             )
         else:
-            return cls(
+            entry = cls(
                 mes.id,
                 mes.channel.id,
                 None,
@@ -97,22 +287,25 @@ class StarboardEntry:
                 updated=True,
             )
 
+        now = time.time()
+        entry._events.append((StarEventKind.CREATE, None, now))
+        if reactor_id:
+            entry._events.append((StarEventKind.ADD_ORI, reactor_id, now))
+        return entry
+
     @property
-    def total_reactors(self) -> typing.Set[int]:
+    def total_reactors(self) -> ReactorSet:
         """Gets the total reactors, a mix of ori and var reactors."""
-        if not isinstance(self.ori_reactors, set):
-            self.ori_reactors = set(self.ori_reactors)
-        if not isinstance(self.var_reactors, set):
-            self.var_reactors = set(self.var_reactors)
-
         return self.ori_reactors | self.var_reactors
 
     @property
     def num_reactors(self) -> int:
         """Gets the number of total reactors."""
-        return len(self.total_reactors)
+        if self._reactor_count is None:
+            self._reactor_count = self.ori_reactors.union_count(self.var_reactors)
+        return self._reactor_count
 
-    def get_reactors_from_type(self, type_of_reactor: ReactorType) -> typing.Set[int]:
+    def get_reactors_from_type(self, type_of_reactor: ReactorType) -> ReactorSet:
         """Gets the reactors for the type specified. Useful if you want the output to vary.
         """
         if type_of_reactor == ReactorType.ORI_REACTORS:
@@ -125,7 +318,7 @@ class StarboardEntry:
             raise AttributeError("Invalid reactor type.")
 
     def set_reactors_of_type(
-        self, type_of_reactor: ReactorType, input: typing.Set[int]
+        self, type_of_reactor: ReactorType, input: typing.Iterable[int]
     ):
         """Sets the reactors for the type specified. Useful if you want the output to vary.
         """
@@ -146,33 +339,103 @@ class StarboardEntry:
         elif type_of_reactor == ReactorType.VAR_REACTORS:
             return reactor_id in self.var_reactors
         elif type_of_reactor == ReactorType.ALL_REACTORS:
-            return reactor_id in self.total_reactors
+            return reactor_id in self.ori_reactors or reactor_id in self.var_reactors
         else:
             raise AttributeError("Invalid reactor type.")
 
     def add_reactor(self, reactor_id: int, type_of_reactor: ReactorType):
         """Adds a reactor to the reactor type specified. Will silently fail if the entry already exists.
         """
-        if reactor_id not in self.total_reactors:
+        if not self.check_reactor(reactor_id):
             if type_of_reactor == ReactorType.ORI_REACTORS:
                 self.ori_reactors.add(reactor_id)
+                self._ori_delta.add(reactor_id)
+                kind = StarEventKind.ADD_ORI
             elif type_of_reactor == ReactorType.VAR_REACTORS:
                 self.var_reactors.add(reactor_id)
+                self._var_delta.add(reactor_id)
+                kind = StarEventKind.ADD_VAR
             else:
                 raise AttributeError("Invalid reactor type.")
 
+            self._events.append((kind, reactor_id, time.time()))
+            self._reactor_count = None
+
     def remove_reactor(self, reactor_id: int):
         """Removes a reactor from an entry. Will silently fail if the entry does not exists.
         """
-        if reactor_id in self.total_reactors:
+        if self.check_reactor(reactor_id):
+            self._events.append((StarEventKind.REMOVE, reactor_id, time.time()))
+
+        if reactor_id in self.ori_reactors:
             self.ori_reactors.discard(reactor_id)
+            self._ori_delta.remove(reactor_id)
+            self._reactor_count = None
+        if reactor_id in self.var_reactors:
             self.var_reactors.discard(reactor_id)
+            self._var_delta.remove(reactor_id)
+            self._reactor_count = None
+
+    def pop_star_change(self) -> int:
+        """Gets how much the entry's star count changed since this was last called.
+        Used to keep the star leaderboards up to date."""
+        change = self.num_reactors - self._counted_stars
+        self._counted_stars = self.num_reactors
+        return change
+
+    def require_full_write(self):
+        """Makes the next write send the whole entry instead of only what changed.
+        Useful after the reactors were replaced or resynced in bulk."""
+        self._full_write = True
+        self._ori_delta = ReactorDelta()
+        self._var_delta = ReactorDelta()
+
+    def pop_reactor_deltas(
+        self,
+    ) -> typing.Optional[typing.Tuple[ReactorDelta, ReactorDelta]]:
+        """Gets the ori and var reactor changes since the last write, resetting them.
+        Returns None if the whole entry needs to be written instead."""
+        if self._full_write:
+            self._full_write = False
+            self._ori_delta = ReactorDelta()
+            self._var_delta = ReactorDelta()
+            return None
+
+        deltas = (self._ori_delta, self._var_delta)
+        self._ori_delta = ReactorDelta()
+        self._var_delta = ReactorDelta()
+        return deltas
+
+    def pop_events(self) -> typing.List[StarEvent]:
+        """Gets the changes made since this was last called, for the event log."""
+        events = self._events
+        self._events = []
+        return events
+
+    def restore_events(self, events: typing.List[StarEvent]):
+        """Puts events that couldn't be written back, before any newer ones."""
+        self._events[:0] = events
+
+    def approx_size(self) -> int:
+        """Roughly how many bytes this entry takes up in memory.
+        Not exact, but good enough to budget a cache with."""
+        return (
+            sys.getsizeof(self)
+            + self.ori_reactors.sizeof()
+            + self.var_reactors.sizeof()
+        )
 
 
 @attr.s(slots=True, eq=False, hash=False)
 class StarboardSQLEntry:
-    query: str = attr.ib()
+    action: str = attr.ib()
     args: typing.Sequence[typing.Any] = attr.ib()
+    # for writes, what to send is only worked out when flushing,
+    # so every change made to the entry until then is sent at once
+    # for deletes, it's the entry deleted, if it was known
+    entry: typing.Optional[StarboardEntry] = attr.ib(default=None)
+    # how many flushes this has failed to be written in
+    attempts: int = attr.ib(default=0)
 
     def __hash__(self) -> int:
         return self.args[0]
@@ -183,45 +446,629 @@ class StarboardSQLEntry:
         return isinstance(other, StarboardSQLEntry) and other.args[0] == self.args[0]
 
 
+@attr.s(slots=True)
+class FlushStats:
+    """Keeps track of how the batched SQL flushes are doing."""
+
+    flushes: int = attr.ib(default=0)
+    rows: int = attr.ib(default=0)
+    last_rows: int = attr.ib(default=0)
+    total_latency: float = attr.ib(default=0.0)
+    last_latency: float = attr.ib(default=0.0)
+    max_latency: float = attr.ib(default=0.0)
+    events: int = attr.ib(default=0)
+    failures: int = attr.ib(default=0)
+    dropped: int = attr.ib(default=0)
+
+    @property
+    def avg_rows(self) -> float:
+        """The average amount of rows written per flush."""
+        return self.rows / self.flushes if self.flushes else 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        """The average time, in seconds, each flush took."""
+        return self.total_latency / self.flushes if self.flushes else 0.0
+
+    def record(self, rows: int, latency: float):
+        self.flushes += 1
+        self.rows += rows
+        self.last_rows = rows
+        self.total_latency += latency
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+
+
+@attr.s(slots=True)
+class LookupStats:
+    """Keeps track of how lookups that miss the cache are handled."""
+
+    db_lookups: int = attr.ib(default=0)
+    coalesced: int = attr.ib(default=0)
+    negative_hits: int = attr.ib(default=0)
+
+    @property
+    def coalesced_ratio(self) -> float:
+        """How many of the cache misses were served by another in-flight lookup."""
+        total = self.db_lookups + self.coalesced
+        return self.coalesced / total if total else 0.0
+
+
+@attr.define(slots=True)
+class StarRankEntry:
+    author_id: int
+    stars: int
+
+
+class StarLeaderboard:
+    """The star totals of every author in a guild, kept sorted.
+
+    Getting the top authors or an author's position is a binary search
+    on the sorted list, no matter how many entries the guild has."""
+
+    __slots__ = ("_stars", "_ranking")
+
+    def __init__(self, totals: typing.Iterable[typing.Tuple[int, int]] = ()):
+        self._stars: typing.Dict[int, int] = {
+            author_id: stars for author_id, stars in totals if stars > 0
+        }
+        # sorted by most stars, then author ID to break ties
+        self._ranking: typing.List[typing.Tuple[int, int]] = sorted(
+            (-stars, author_id) for author_id, stars in self._stars.items()
+        )
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def __iter__(self) -> typing.Iterator[StarRankEntry]:
+        return (StarRankEntry(author_id, -stars) for stars, author_id in self._ranking)
+
+    def update(self, author_id: int, change: int):
+        """Adds the change to the author's star total."""
+        if not change:
+            return
+
+        old_stars = self._stars.get(author_id, 0)
+        new_stars = old_stars + change
+
+        if old_stars > 0:
+            index = bisect.bisect_left(self._ranking, (-old_stars, author_id))
+            del self._ranking[index]
+
+        if new_stars > 0:
+            self._stars[author_id] = new_stars
+            bisect.insort(self._ranking, (-new_stars, author_id))
+        else:
+            self._stars.pop(author_id, None)
+
+    def top(self, amount: int = 10) -> typing.List[StarRankEntry]:
+        return [
+            StarRankEntry(author_id, -stars)
+            for stars, author_id in self._ranking[:amount]
+        ]
+
+    def position(self, author_id: int) -> typing.Optional[typing.Tuple[int, int]]:
+        """Gets the author's position, starting at 1, and their stars.
+        Returns None if the author has no stars."""
+        stars = self._stars.get(author_id)
+        if not stars:
+            return None
+
+        return bisect.bisect_left(self._ranking, (-stars, author_id)) + 1, stars
+
+
+def _starboard_stars(entry: StarboardEntry) -> int:
+    """The stars an entry has for top message purposes - only entries on the starboard count.
+    """
+    return entry.num_reactors if entry.star_var_id else 0
+
+
+class StarboardTopEntries:
+    """The most starred entries of a guild (or an author in a guild), kept sorted.
+
+    Only the top entries, up to capacity, are held. floor is the most stars any
+    entry not held could have, so an entry is only added if it beats that -
+    otherwise something not held might beat it. If floor is 0, every starred
+    entry is held."""
+
+    __slots__ = ("capacity", "floor", "_stars", "_entries", "_ranking")
+
+    def __init__(self, capacity: int, entries: typing.Sequence[StarboardEntry]):
+        self.capacity = capacity
+        self._stars: typing.Dict[int, int] = {}
+        self._entries: typing.Dict[int, StarboardEntry] = {}
+        self._ranking: typing.List[typing.Tuple[int, int]] = []
+
+        for entry in entries:
+            if stars := _starboard_stars(entry):
+                self._stars[entry.ori_mes_id] = stars
+                self._entries[entry.ori_mes_id] = entry
+                self._ranking.append((-stars, entry.ori_mes_id))
+        self._ranking.sort()
+
+        if len(entries) < capacity:
+            # we got everything there is, so nothing can be missing
+            self.floor = 0
+        elif self._ranking:
+            self.floor = -self._ranking[-1][0]
+        else:
+            # everything we got lost its stars since, so we know nothing
+            # this'll be reloaded the next time it's needed
+            self.floor = sys.maxsize
+
+    def __len__(self):
+        return len(self._ranking)
+
+    @property
+    def complete(self) -> bool:
+        """If every starred entry is held."""
+        return self.floor == 0
+
+    def update(self, entry: StarboardEntry):
+        """Updates the entry's place, adding or removing it as needed."""
+        old_stars = self.discard(entry.ori_mes_id)
+        stars = _starboard_stars(entry)
+
+        # an entry we already had can stay at the floor, since nothing else can beat it
+        if stars > self.floor or (old_stars is not None and 0 < stars == self.floor):
+            self._stars[entry.ori_mes_id] = stars
+            self._entries[entry.ori_mes_id] = entry
+            bisect.insort(self._ranking, (-stars, entry.ori_mes_id))
+
+            while len(self._ranking) > self.capacity:
+                evicted_stars, evicted_id = self._ranking.pop()
+                del self._stars[evicted_id]
+                del self._entries[evicted_id]
+                self.floor = max(self.floor, -evicted_stars)
+
+    def discard(self, ori_mes_id: int) -> typing.Optional[int]:
+        """Removes an entry, returning the stars it had if it was held."""
+        stars = self._stars.pop(ori_mes_id, None)
+        if stars is not None:
+            del self._entries[ori_mes_id]
+            index = bisect.bisect_left(self._ranking, (-stars, ori_mes_id))
+            del self._ranking[index]
+        return stars
+
+    def top(self, amount: int) -> typing.List[StarboardEntry]:
+        return [self._entries[ori_mes_id] for _, ori_mes_id in self._ranking[:amount]]
+
+
+@attr.s(slots=True)
+class CacheStats:
+    """Keeps track of how well the entry cache is doing."""
+
+    hits: int = attr.ib(default=0)
+    misses: int = attr.ib(default=0)
+    evictions: int = attr.ib(default=0)
+
+    @property
+    def hit_ratio(self) -> float:
+        """How many lookups were served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class StarboardEntryCache:
+    """An LRU cache of starboard entries bounded by an approximate byte budget
+    instead of an entry count, so entries with lots of reactors cost more.
+
+    Entries are sized when they're set, which is fine since the collection
+    re-sets an entry every time it's upserted."""
+
+    __slots__ = (
+        "_entries",
+        "_sizes",
+        "max_bytes",
+        "resident_bytes",
+        "stats",
+        "_callback",
+    )
+
+    def __init__(
+        self,
+        max_bytes: int,
+        callback: typing.Optional[typing.Callable[[int, StarboardEntry], None]] = None,
+    ):
+        self._entries: collections.OrderedDict[
+            int, StarboardEntry
+        ] = collections.OrderedDict()
+        self._sizes: typing.Dict[int, int] = {}
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self.stats = CacheStats()
+        self._callback = callback
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: int):
+        return key in self._entries
+
+    def __setitem__(self, key: int, entry: StarboardEntry):
+        self.resident_bytes -= self._sizes.get(key, 0)
+
+        size = entry.approx_size()
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self.resident_bytes += size
+
+        self._evict()
+
+    def get(
+        self, key: int, default: typing.Optional[StarboardEntry] = None
+    ) -> typing.Optional[StarboardEntry]:
+        """Gets an entry, marking it as recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def values(self) -> typing.ValuesView[StarboardEntry]:
+        return self._entries.values()
+
+    def pop(
+        self, key: int, default: typing.Optional[StarboardEntry] = None
+    ) -> typing.Optional[StarboardEntry]:
+        """Removes an entry without counting it as an eviction."""
+        self.resident_bytes -= self._sizes.pop(key, 0)
+        return self._entries.pop(key, default)
+
+    def clear(self):
+        """Removes every entry without counting them as evictions."""
+        self._entries.clear()
+        self._sizes.clear()
+        self.resident_bytes = 0
+
+    def resize(self, max_bytes: int):
+        """Changes the byte budget, evicting entries if the cache is now too big."""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        # always keep the newest entry, even if it's over budget by itself
+        while self.resident_bytes > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self.resident_bytes -= self._sizes.pop(key)
+            self.stats.evictions += 1
+
+            if self._callback:
+                self._callback(key, entry)
+
+
+# what a queued up StarboardSQLEntry does
+_WRITE = "write"
+_DELETE = "delete"
+
+_STARBOARD_COLUMNS = frozenset(
+    (
+        "ori_mes_id",
+        "ori_chan_id",
+        "star_var_id",
+        "starboard_id",
+        "author_id",
+        "ori_reactors",
+        "var_reactors",
+        "guild_id",
+        "forced",
+        "frozen",
+        "trashed",
+        "stars",
+    )
+)
+
+
 @attr.s(slots=True, init=False)
 class StarboardEntries:
     """A way of managing starboard entries.
     Sort of like an ORM, but also not fully."""
 
-    _pool: asyncpg.Pool = attr.ib()
-    # note: entry cache isn't really a dict, but for typehinting purposes this works
-    _entry_cache: typing.Dict[int, StarboardEntry] = attr.ib()
+    _backend: storage.StorageBackend = attr.ib()
+    _entry_cache: StarboardEntryCache = attr.ib()
+    # star_var_id -> ori_mes_id, and the reverse so stale var ids can be cleaned up
+    _var_index: typing.Dict[int, int] = attr.ib()
+    _var_of: typing.Dict[int, int] = attr.ib()
+    _inflight: typing.Dict[int, asyncio.Task] = attr.ib()
+    _leaderboards: typing.Dict[int, StarLeaderboard] = attr.ib()
+    _top_entries: typing.Dict[int, StarboardTopEntries] = attr.ib()
+    # (guild_id, author_id) -> top entries, bounded since there are a lot of authors
+    _author_top_entries: typing.Dict[
+        typing.Tuple[int, int], StarboardTopEntries
+    ] = attr.ib()
+    top_entries_size: int = attr.ib()
+    # guild_id -> ori_mes_id of every entry on the starboard, for picking random ones
+    # a ReactorSet is really just a compact sorted set of snowflakes, so it works here
+    _starred_ids: typing.Dict[int, ReactorSet] = attr.ib()
+    _starred_id_loads: typing.Dict[int, asyncio.Task] = attr.ib()
+    # ids known to have no row -> when that was found out
+    _missing_cache: typing.Dict[int, float] = attr.ib()
+    missing_ttl: float = attr.ib()
     _sql_loop_task: asyncio.Task = attr.ib()
     _sql_queries: cclass.SetUpdateAsyncQueue = attr.ib()
+    # the flush being written right now, if any
+    _flushing: typing.Optional[asyncio.Task] = attr.ib()
+    # taken out of the queue, but not written yet
+    _unwritten_batch: typing.Optional[typing.List[StarboardSQLEntry]] = attr.ib()
+    # held while writing, so leaderboards aren't loaded halfway through a write
+    _write_lock: asyncio.Lock = attr.ib()
+    flush_interval: float = attr.ib()
+    max_batch_size: int = attr.ib()
+    max_flush_attempts: int = attr.ib()
+    log_events: bool = attr.ib()
+    # tells other processes what was written, if there are any
+    invalidation_bus: typing.Optional[invalidation.InvalidationBus] = attr.ib()
+    flush_stats: FlushStats = attr.ib()
+    lookup_stats: LookupStats = attr.ib()
 
-    def __init__(self, pool: asyncpg.Pool, cache_size: int = 200):
-        self._pool = pool
-        self._entry_cache = LRU(
-            cache_size
-        )  # the 200 should be raised as the bot grows bigger
+    def __init__(
+        self,
+        backend: storage.StorageBackend,
+        cache_bytes: int = 16 * 1024 * 1024,
+        flush_interval: float = 0.5,
+        max_batch_size: int = 1000,
+        missing_cache_size: int = 5000,
+        missing_ttl: float = 300,
+        top_entries_size: int = 50,
+        author_top_entries_amount: int = 1000,
+        log_events: bool = True,
+        max_flush_attempts: int = 20,
+    ):
+        self._backend = backend
+        self._entry_cache = StarboardEntryCache(cache_bytes, callback=self._on_evict)
+        self._var_index = {}
+        self._var_of = {}
         self._sql_queries = cclass.SetUpdateAsyncQueue()
+        self._flushing = None
+        self._unwritten_batch = None
+        self._write_lock = asyncio.Lock()
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_flush_attempts = max_flush_attempts
+        self.log_events = log_events
+        self.invalidation_bus = None
+        self.flush_stats = FlushStats()
+        self.lookup_stats = LookupStats()
+        self._inflight = {}
+        self._leaderboards = {}
+        self._top_entries = {}
+        self._author_top_entries = LRU(author_top_entries_amount)
+        self.top_entries_size = top_entries_size
+        self._starred_ids = {}
+        self._starred_id_loads = {}
+        self._missing_cache = LRU(missing_cache_size)
+        self.missing_ttl = missing_ttl
 
         loop = asyncio.get_event_loop()
         self._sql_loop_task = loop.create_task(self._sql_loop())
 
     def stop(self):
-        """Stops the SQL task loop."""
+        """Stops the SQL task loop. Anything still queued isn't written - use close
+        for that."""
         self._sql_loop_task.cancel()
 
+    async def close(self):
+        """Stops the SQL task loop, then writes out everything still queued.
+        Should be done before the backend is closed."""
+        self._sql_loop_task.cancel()
+        try:
+            await self._sql_loop_task
+        except asyncio.CancelledError:
+            pass
+
+        # the loop doesn't cancel a flush halfway through, so let it finish
+        if self._flushing:
+            await self._flushing
+
+        while not self._sql_queries.empty():
+            batch = self._drain_batch([])
+            if not await self._flush_batch(batch):
+                # no point in retrying while shutting down
+                self.flush_stats.dropped += self._sql_queries.qsize()
+                logging.getLogger("discord").error(
+                    f"Could not write {self._sql_queries.qsize()} starboard rows"
+                    " before closing."
+                )
+                break
+
+    @property
+    def entry_cache(self) -> StarboardEntryCache:
+        """The entry cache, mostly so its stats and size can be looked at."""
+        return self._entry_cache
+
+    @property
+    def backend(self) -> storage.StorageBackend:
+        """What the entries are stored in."""
+        return self._backend
+
+    @property
+    def statement_stats(self) -> storage.StatementStats:
+        """How the backend does with reusing prepared statements."""
+        return self._backend.statement_stats
+
+    def resize_cache(self, cache_bytes: int):
+        """Changes the byte budget of the entry cache."""
+        self._entry_cache.resize(cache_bytes)
+
     async def _sql_loop(self):
-        """Actually runs SQL updating, hopefully one after another.
+        """Actually runs SQL updating, one batch after another.
 
         Saves speed on adding, deleting, and updating by offloading
-        this step here."""
+        this step here. Everything queued up during a tick is written
+        out at once, so a burst of reactions costs one round trip
+        instead of one per reaction.
+
+        A batch that fails to flush is put back and retried, waiting longer
+        each time it keeps failing so a database that's down isn't hammered."""
+        retry_delay = 0.0
+
         try:
             while True:
-                entry = await self._sql_queries.get()
-                logging.getLogger("discord").debug(f"Running {entry.query}.")
-                await self._pool.execute(entry.query, timeout=60, *entry.args)
-                self._sql_queries.task_done()
+                await asyncio.sleep(self.flush_interval + retry_delay)
+
+                # get waits for something to actually be queued up,
+                # the rest of the batch is drained without awaiting
+                batch = self._drain_batch([await self._sql_queries.get()])
+
+                # shielded so stopping the loop doesn't cut a write off halfway
+                self._flushing = asyncio.create_task(self._flush_batch(batch))
+                if await asyncio.shield(self._flushing):
+                    retry_delay = 0.0
+                else:
+                    retry_delay = min(max(retry_delay * 2, 1.0), 30.0)
         except asyncio.CancelledError:
             pass
 
+    def _drain_batch(
+        self, batch: typing.List[StarboardSQLEntry]
+    ) -> typing.List[StarboardSQLEntry]:
+        """Fills up the batch with whatever's queued, without waiting."""
+        while len(batch) < self.max_batch_size and not self._sql_queries.empty():
+            batch.append(self._sql_queries.get_nowait())
+
+        self._unwritten_batch = batch
+        return batch
+
+    async def _flush_batch(self, batch: typing.List[StarboardSQLEntry]) -> bool:
+        """Flushes the batch, putting it back in the queue if that fails.
+        Returns if the flush went through."""
+        try:
+            await self._flush(batch)
+            return True
+        except Exception:
+            self.flush_stats.failures += 1
+            logging.getLogger("discord").exception(
+                f"Could not flush {len(batch)} starboard rows, retrying them."
+            )
+            self._requeue(batch)
+            return False
+        finally:
+            # it's either written or back in the queue by now
+            if self._unwritten_batch is batch:
+                self._unwritten_batch = None
+            for _ in batch:
+                self._sql_queries.task_done()
+
+    def _requeue(self, batch: typing.List[StarboardSQLEntry]):
+        """Puts a batch that failed to flush back in the queue."""
+        for sql_entry in batch:
+            # anything queued for the same message since is newer, so it wins
+            if sql_entry in self._sql_queries:
+                continue
+
+            sql_entry.attempts += 1
+            if sql_entry.attempts >= self.max_flush_attempts:
+                # something about it is probably broken, and it'd hold everything up
+                self.flush_stats.dropped += 1
+                logging.getLogger("discord").error(
+                    f"Gave up on writing starboard row {sql_entry.args[0]} after"
+                    f" {sql_entry.attempts} tries."
+                )
+                continue
+
+            self._sql_queries.put_nowait(sql_entry)
+
+    async def _flush(self, batch: typing.List[StarboardSQLEntry]):
+        """Writes a batch of queued entries to the database in one transaction.
+        Deletes are merged into one statement, everything else is split into
+        full and delta writes, each sent at once."""
+        start = time.perf_counter()
+
+        full_writes: typing.List[storage.FullWrite] = []
+        delta_writes: typing.List[storage.DeltaWrite] = []
+        delete_ids: typing.List[int] = []
+        event_rows: typing.List[storage.EventRow] = []
+        # so they can be put back if the write fails
+        popped_events: typing.List[
+            typing.Tuple[StarboardEntry, typing.List[StarEvent]]
+        ] = []
+        written_stars: typing.List[typing.Tuple[StarboardEntry, int]] = []
+
+        for entry in batch:
+            if entry.action == _DELETE:
+                delete_ids.append(entry.args[0])
+                if self.log_events:
+                    deleted = entry.entry
+                    event_rows.append(
+                        (
+                            entry.args[0],
+                            deleted.guild_id if deleted else None,
+                            deleted.author_id if deleted else None,
+                            None,
+                            StarEventKind.DELETE,
+                            datetime.datetime.now(datetime.timezone.utc),
+                        )
+                    )
+            elif entry.entry is not None:
+                is_full, args = self._get_write_for_entry(entry.entry)
+                if is_full:
+                    full_writes.append(args)
+                else:
+                    delta_writes.append(args)
+
+                written_stars.append((entry.entry, entry.entry._unflushed_stars))
+
+                events = entry.entry.pop_events()
+                if self.log_events and events:
+                    popped_events.append((entry.entry, events))
+                    event_rows.extend(self._get_event_rows(entry.entry, events))
+
+        try:
+            async with self._write_lock:
+                await self._backend.write_entries(
+                    full_writes, delta_writes, delete_ids, event_rows
+                )
+
+                if self._unwritten_batch is batch:
+                    self._unwritten_batch = None
+                # anything changed while writing is still unflushed
+                for star_entry, stars in written_stars:
+                    star_entry._unflushed_stars -= stars
+                if any(e.action == _DELETE and e.entry is None for e in batch):
+                    # a leaderboard loaded before this would still have those stars
+                    self._leaderboards.clear()
+        except BaseException:
+            # the deltas we took are gone now, so the next write has to be a full one
+            for entry in batch:
+                if entry.action != _DELETE and entry.entry is not None:
+                    entry.entry.require_full_write()
+            for star_entry, events in popped_events:
+                star_entry.restore_events(events)
+            raise
+
+        if self.invalidation_bus:
+            # one message for the whole batch, not one per entry
+            self.invalidation_bus.publish(
+                "starboard",
+                ids={entry.args[0] for entry in batch},
+                guild_ids={
+                    entry.entry.guild_id for entry in batch if entry.entry is not None
+                },
+            )
+
+        latency = time.perf_counter() - start
+        self.flush_stats.events += len(event_rows)
+        self.flush_stats.record(len(batch), latency)
+        logging.getLogger("discord").debug(
+            f"Flushed {len(batch)} starboard rows in {latency * 1000:.2f}ms."
+        )
+
+    def _get_event_rows(
+        self, entry: StarboardEntry, events: typing.List[StarEvent]
+    ) -> typing.Iterator[storage.EventRow]:
+        """Transforms an entry's events into rows for the event log."""
+        for kind, user_id, happened_at in events:
+            yield (
+                entry.ori_mes_id,
+                entry.guild_id,
+                entry.author_id,
+                user_id,
+                kind,
+                datetime.datetime.fromtimestamp(happened_at, datetime.timezone.utc),
+            )
+
     def _get_required_from_entry(self, entry: StarboardEntry):
         """Transforms data into the form needed for databases."""
         return (
@@ -230,145 +1077,623 @@ class StarboardEntries:
             entry.star_var_id,
             entry.starboard_id,
             entry.author_id,
-            list(entry.ori_reactors),
-            list(entry.var_reactors),
+            entry.ori_reactors.tolist(),
+            entry.var_reactors.tolist(),
             entry.guild_id,
             entry.forced,
             entry.frozen,
             entry.trashed,
         )
 
-    def _str_builder_to_insert(
-        self, str_builder: typing.List[str], entry: StarboardEntry
-    ):
-        """Takes data from a string builder list and eventually
-        puts the data needed into the _sql_queries variable."""
-        query = "".join(str_builder)
-        args = self._get_required_from_entry(entry)
-        self._sql_queries.put_nowait(StarboardSQLEntry(query, args))
+    def _get_write_for_entry(
+        self, entry: StarboardEntry
+    ) -> typing.Tuple[bool, typing.Sequence[typing.Any]]:
+        """Gets what's needed to write what changed in the entry, and if it's a full write.
+        New or resynced entries are written fully, everything else only sends
+        the reactors that changed."""
+        deltas = entry.pop_reactor_deltas()
+        if deltas is None:
+            return True, self._get_required_from_entry(entry)
+
+        ori_delta, var_delta = deltas
+        return False, (
+            entry.ori_mes_id,
+            entry.ori_chan_id,
+            entry.star_var_id,
+            entry.starboard_id,
+            entry.author_id,
+            entry.guild_id,
+            entry.forced,
+            entry.frozen,
+            entry.trashed,
+            list(ori_delta.added),
+            list(ori_delta.removed),
+            list(var_delta.added),
+            list(var_delta.removed),
+        )
 
     def _handle_upsert(self, entry: StarboardEntry):
-        """Upserts an entry by using an INSERT with an ON CONFLICT cause.
-        This is a PostgreSQL-specific feature, so that's nice!"""
-        str_builder = [
-            "INSERT INTO starboard(ori_mes_id, ori_chan_id, star_var_id, ",
-            "starboard_id, author_id, ori_reactors, var_reactors, ",
-            "guild_id, forced, frozen, trashed) VALUES($1, $2, $3, $4, ",
-            "$5, $6, $7, $8, $9, $10, $11) ON CONFLICT (ori_mes_id) DO UPDATE ",
-            "SET ori_chan_id = $2, star_var_id = $3, starboard_id = $4, ",
-            "author_id = $5, ori_reactors = $6, var_reactors = $7, guild_id = $8, ",
-            "forced = $9, frozen = $10, trashed = $11",
-        ]
-        self._str_builder_to_insert(str_builder, entry)
+        """Queues up an upsert of the entry. The backend either writes it fully,
+        or only sends the changed reactors if the row already exists."""
+        self._sql_queries.put_nowait(
+            StarboardSQLEntry(_WRITE, (entry.ori_mes_id,), entry=entry)
+        )
 
-    def upsert(self, entry: StarboardEntry):
-        """Either adds or updates an entry in the collection of entries."""
-        temp_dict = {entry.ori_mes_id: entry}
+    def _on_evict(self, ori_mes_id: int, entry: StarboardEntry):
+        """Called by the cache when it evicts an entry. Keeps the var index in sync."""
+        self._unindex_var(ori_mes_id)
+
+    def _index_var(self, entry: StarboardEntry):
+        """Points the entry's star_var_id to its ori_mes_id, dropping any old star_var_id.
+        """
+        old_var_id = self._var_of.get(entry.ori_mes_id)
+        if old_var_id == entry.star_var_id:
+            return
+
+        if old_var_id:
+            self._var_index.pop(old_var_id, None)
+
+        if entry.star_var_id:
+            self._var_index[entry.star_var_id] = entry.ori_mes_id
+            self._var_of[entry.ori_mes_id] = entry.star_var_id
+        else:
+            self._var_of.pop(entry.ori_mes_id, None)
+
+    def _unindex_var(self, ori_mes_id: int):
+        if var_id := self._var_of.pop(ori_mes_id, None):
+            self._var_index.pop(var_id, None)
+
+    def _cache_entry(self, entry: StarboardEntry):
+        """Adds an entry to the cache, keyed by its ori_mes_id."""
+        self._entry_cache[entry.ori_mes_id] = entry
+        self._index_var(entry)
+
+    def _get_cached(self, entry_id: int) -> typing.Optional[StarboardEntry]:
+        """Gets an entry from the cache, either by its ori_mes_id or star_var_id."""
+        entry = self._entry_cache.get(entry_id)
+        if entry is None and (ori_mes_id := self._var_index.get(entry_id)):
+            entry = self._entry_cache.get(ori_mes_id)
+
+            # star_var_id can be changed on the entry before it's upserted again
+            if entry and entry.star_var_id != entry_id:
+                entry = None
+
+        return entry
+
+    def _is_missing(self, entry_id: int) -> bool:
+        """Checks if the ID was recently looked up and found to have no entry."""
+        found_at = self._missing_cache.get(entry_id)
+        if found_at is None:
+            return False
+
+        if time.monotonic() - found_at > self.missing_ttl:
+            self._missing_cache.pop(entry_id, None)
+            return False
+
+        return True
+
+    def _mark_missing(self, entry_id: int):
+        self._missing_cache[entry_id] = time.monotonic()
+
+    def _entry_from_row(self, row: storage.Row) -> typing.Optional[StarboardEntry]:
+        """Gets the entry for a row from the database, caching it if it's new.
+        Anything cached is newer than the row, and so is a delete that hasn't been
+        written yet, in which case there's no entry."""
+        if entry := self._get_cached(row["ori_mes_id"]):
+            return entry
+        if self._is_missing(row["ori_mes_id"]):
+            return None
+
+        entry = StarboardEntry.from_row(row)
+        self._cache_entry(entry)
+        return entry
+
+    def _unmark_missing(self, entry: StarboardEntry):
+        self._missing_cache.pop(entry.ori_mes_id, None)
         if entry.star_var_id:
-            temp_dict[entry.star_var_id] = entry
+            self._missing_cache.pop(entry.star_var_id, None)
+
+    def _update_leaderboard(self, entry: StarboardEntry, change: int):
+        leaderboard = self._leaderboards.get(entry.guild_id)
+        if change and leaderboard is not None:
+            leaderboard.update(entry.author_id, change)
+
+    def _update_top_entries(self, entry: StarboardEntry):
+        if (top_entries := self._top_entries.get(entry.guild_id)) is not None:
+            top_entries.update(entry)
+
+        author_key = (entry.guild_id, entry.author_id)
+        if (top_entries := self._author_top_entries.get(author_key)) is not None:
+            top_entries.update(entry)
 
-        self._entry_cache.update(**temp_dict)  # type: ignore this is valid i promise
+    def _update_starred_ids(self, entry: StarboardEntry):
+        if (starred_ids := self._starred_ids.get(entry.guild_id)) is not None:
+            if entry.star_var_id:
+                starred_ids.add(entry.ori_mes_id)
+            else:
+                starred_ids.discard(entry.ori_mes_id)
+
+    def upsert(self, entry: StarboardEntry):
+        """Either adds or updates an entry in the collection of entries."""
+        change = entry.pop_star_change()
+        entry._unflushed_stars += change
+        self._update_leaderboard(entry, change)
+        self._update_top_entries(entry)
+        self._update_starred_ids(entry)
+        self._unmark_missing(entry)
+        self._cache_entry(entry)
         self._handle_upsert(entry)
 
     def delete(self, entry_id: int):
         """Removes an entry from the collection of entries."""
-        self._entry_cache.pop(entry_id, None)
-        self._sql_queries.put_nowait(
-            StarboardSQLEntry("DELETE FROM starboard WHERE ori_mes_id = $1", [entry_id])
-        )
+        if entry := self._entry_cache.pop(entry_id, None):
+            self._update_leaderboard(entry, -entry._counted_stars)
+
+            if (top_entries := self._top_entries.get(entry.guild_id)) is not None:
+                top_entries.discard(entry_id)
+            author_key = (entry.guild_id, entry.author_id)
+            if (top_entries := self._author_top_entries.get(author_key)) is not None:
+                top_entries.discard(entry_id)
+
+            if (starred_ids := self._starred_ids.get(entry.guild_id)) is not None:
+                starred_ids.discard(entry_id)
+        else:
+            # we don't know what guild or author this was for, so the
+            # leaderboards have to be reloaded to be accurate
+            self._leaderboards.clear()
+            for top_entries in self._top_entries.values():
+                top_entries.discard(entry_id)
+            self._author_top_entries.clear()
+            for starred_ids in self._starred_ids.values():
+                starred_ids.discard(entry_id)
+
+        self._unindex_var(entry_id)
+        # the row is going away, no need to ask the database about it again
+        # this also keeps lookups from caching the row before the delete's written
+        self._mark_missing(entry_id)
+        if entry and entry.star_var_id:
+            self._mark_missing(entry.star_var_id)
+        # the entry's kept around so the event log knows whose it was
+        self._sql_queries.put_nowait(StarboardSQLEntry(_DELETE, [entry_id], entry))
+
+    def invalidate(self, entry_ids: typing.List[int], guild_ids: typing.List[int]):
+        """Drops what's cached for entries another process wrote, along with the
+        leaderboards and such of their guilds. They'll be reloaded when needed.
+
+        Queued writes are left alone - only the process with the guild's shard
+        should be changing its entries anyways."""
+        guilds = set(guild_ids)
+
+        for entry_id in entry_ids:
+            if entry := self._entry_cache.pop(entry_id, None):
+                guilds.add(entry.guild_id)
+            self._unindex_var(entry_id)
+            # the entry may have just been made
+            self._missing_cache.pop(entry_id, None)
+
+            # guild_ids won't have the guilds of deletes we didn't know about
+            for starred_ids in self._starred_ids.values():
+                starred_ids.discard(entry_id)
+
+        for guild_id in guilds:
+            self._leaderboards.pop(guild_id, None)
+            self._top_entries.pop(guild_id, None)
+            self._starred_ids.pop(guild_id, None)
+
+        for author_key in list(self._author_top_entries.keys()):
+            if author_key[0] in guilds:
+                self._author_top_entries.pop(author_key, None)
+
+    def clear_cache(self):
+        """Drops everything cached, for when we can't tell what's stale anymore."""
+        self._entry_cache.clear()
+        self._var_index.clear()
+        self._var_of.clear()
+        self._leaderboards.clear()
+        self._top_entries.clear()
+        self._author_top_entries.clear()
+        self._starred_ids.clear()
+        self._missing_cache.clear()
+
+    def delete_many(self, entry_ids: typing.Iterable[int]):
+        """Removes multiple entries from the collection of entries.
+        They'll be flushed together in one statement."""
+        for entry_id in entry_ids:
+            self.delete(entry_id)
 
     async def get(
         self, entry_id: int, check_for_var: bool = False
     ) -> typing.Optional[StarboardEntry]:
         """Gets an entry from the collection of entries."""
-        entry = None
+        entry = self._get_cached(entry_id)
 
-        if self._entry_cache.has_key(entry_id):  # type: ignore
-            entry = self._entry_cache[entry_id]
+        if entry:
+            self._entry_cache.stats.hits += 1
         else:
-            entry = discord.utils.find(
-                lambda e: e and e.star_var_id == entry_id, self._entry_cache.values()
-            )
+            self._entry_cache.stats.misses += 1
 
-        if not entry:
-            async with self._pool.acquire() as conn:
-                data = await conn.fetchrow(
-                    f"SELECT * FROM starboard WHERE ori_mes_id = {entry_id} OR"
-                    f" star_var_id = {entry_id}"
-                )
-                if data:
-                    entry = StarboardEntry.from_row(data)
-                    self._entry_cache[entry_id] = entry
+            if self._is_missing(entry_id):
+                self.lookup_stats.negative_hits += 1
+                return None
+
+            entry = await self._coalesced_fetch(entry_id)
 
         if entry and check_for_var and not entry.star_var_id:
             return None
 
         return entry
 
-    async def select_query(self, query: str):
-        """Selects the starboard database directly for entries based on the query."""
-        async with self._pool.acquire() as conn:
-            data = await conn.fetch(f"SELECT * FROM starboard WHERE {query}")
+    async def _coalesced_fetch(self, entry_id: int) -> typing.Optional[StarboardEntry]:
+        """Fetches an entry from the database, making sure only one query per ID
+        is ever in-flight. Everyone else asking for the same ID waits on that query.
+        """
+        task = self._inflight.get(entry_id)
 
-            if not data:
-                return None
-            return tuple(StarboardEntry.from_row(row) for row in data)
+        if task:
+            self.lookup_stats.coalesced += 1
+        else:
+            task = asyncio.create_task(self._fetch_entry(entry_id))
+            self._inflight[entry_id] = task
+
+            def _remove_inflight(done_task: asyncio.Task):
+                if self._inflight.get(entry_id) is done_task:
+                    del self._inflight[entry_id]
+
+            task.add_done_callback(_remove_inflight)
+
+        # shielded so one waiter getting cancelled doesn't cancel it for everyone else
+        return await asyncio.shield(task)
+
+    async def _fetch_entry(self, entry_id: int) -> typing.Optional[StarboardEntry]:
+        """Actually fetches an entry from the database and caches it."""
+        self.lookup_stats.db_lookups += 1
+
+        data = await self._backend.fetch_entry(entry_id)
+
+        # the entry may have been upserted while we were waiting on the database,
+        # and that version is newer than what we just got
+        if cached := self._get_cached(entry_id):
+            return cached
 
-    async def raw_query(self, query: str):
-        """Runs the raw query against the pool, assuming the results are starboard entries.
+        # it may have also been deleted while we were waiting
+        entry = self._entry_from_row(data) if data else None
+        if not entry:
+            self._mark_missing(entry_id)
+        return entry
+
+    async def get_many(
+        self, entry_ids: typing.Iterable[int]
+    ) -> typing.Dict[int, StarboardEntry]:
+        """Gets multiple entries from the collection of entries at once.
+
+        Whatever isn't cached is fetched in one query. Returns a mapping of the IDs
+        given to the entries found for them - IDs with no entry are left out.
+        Note that an entry may show up twice if both its ori_mes_id and
+        star_var_id were given."""
+        wanted = set(entry_ids)
+        found: typing.Dict[int, StarboardEntry] = {}
+        to_fetch: typing.List[int] = []
+        inflight: typing.Dict[int, asyncio.Task] = {}
+
+        for entry_id in wanted:
+            if entry := self._get_cached(entry_id):
+                self._entry_cache.stats.hits += 1
+                found[entry_id] = entry
+                continue
+
+            self._entry_cache.stats.misses += 1
+
+            if self._is_missing(entry_id):
+                self.lookup_stats.negative_hits += 1
+            elif task := self._inflight.get(entry_id):
+                self.lookup_stats.coalesced += 1
+                inflight[entry_id] = task
+            else:
+                to_fetch.append(entry_id)
+
+        if to_fetch:
+            self.lookup_stats.db_lookups += 1
+
+            data = await self._backend.fetch_entries(to_fetch)
+
+            for row in data:
+                # like with get, anything upserted or deleted while we waited is newer
+                entry = self._entry_from_row(row)
+                if not entry:
+                    continue
+
+                found[entry.ori_mes_id] = entry
+                if entry.star_var_id:
+                    found[entry.star_var_id] = entry
+
+            for entry_id in to_fetch:
+                if entry_id not in found and not self._get_cached(entry_id):
+                    self._mark_missing(entry_id)
+
+        for entry_id, task in inflight.items():
+            if entry := await asyncio.shield(task):
+                found[entry_id] = entry
+
+        # the query may have found entries for IDs that weren't asked for
+        return {k: v for k, v in found.items() if k in wanted}
+
+    async def query_top_entries(
+        self,
+        guild_id: int,
+        amount: int,
+        author_ids: typing.Optional[typing.Collection[int]] = None,
+    ) -> typing.List[StarboardEntry]:
+        """Gets the most starred entries on the starboard straight from the database.
+        Cached versions of the entries are used when there are any."""
+        data = await self._backend.fetch_top_entries(
+            guild_id, amount, None if author_ids is None else list(author_ids)
+        )
+
+        entries = []
+        for row in data:
+            # anything cached or deleted is newer than what's in the database
+            if entry := self._entry_from_row(row):
+                entries.append(entry)
+
+        return entries
+
+    async def get_top_entries(
+        self, guild_id: int, amount: int, author_id: typing.Optional[int] = None
+    ) -> typing.List[StarboardEntry]:
+        """Gets the most starred entries on the starboard for a guild, or an author in it.
+        Loads them from the database if needed, after which they're kept up to date
+        as entries change. amount can't be more than top_entries_size."""
+        amount = min(amount, self.top_entries_size)
+
+        if author_id is None:
+            top_entries = self._top_entries.get(guild_id)
+        else:
+            top_entries = self._author_top_entries.get((guild_id, author_id))
+
+        # entries may have been removed since this was loaded, leaving too few
+        if top_entries is None or (
+            len(top_entries) < amount and not top_entries.complete
+        ):
+            entries = await self.query_top_entries(
+                guild_id,
+                self.top_entries_size,
+                None if author_id is None else (author_id,),
+            )
+            top_entries = StarboardTopEntries(self.top_entries_size, entries)
+
+            if author_id is None:
+                self._top_entries[guild_id] = top_entries
+            else:
+                self._author_top_entries[(guild_id, author_id)] = top_entries
+
+        return top_entries.top(amount)
+
+    async def get_leaderboard(self, guild_id: int) -> StarLeaderboard:
+        """Gets the star leaderboard for a guild, loading it if needed.
+        It's kept up to date as entries change after that."""
+        if (leaderboard := self._leaderboards.get(guild_id)) is not None:
+            return leaderboard
+
+        # a write going through while loading may or may not make it in
+        async with self._write_lock:
+            # someone else may have loaded it while we waited
+            if (leaderboard := self._leaderboards.get(guild_id)) is not None:
+                return leaderboard
+
+            data = await self._backend.fetch_leaderboard(guild_id)
+            leaderboard = StarLeaderboard((r["author_id"], r["stars"]) for r in data)
+            self._apply_unflushed_stars(guild_id, leaderboard)
+
+        self._leaderboards[guild_id] = leaderboard
+        return leaderboard
+
+    def _apply_unflushed_stars(self, guild_id: int, leaderboard: StarLeaderboard):
+        """Adds the star changes still waiting to be written to a leaderboard
+        loaded from the database, since they're not in there yet."""
+        # what's in the queue is newer than what was taken out of it
+        latest: typing.Dict[int, StarboardSQLEntry] = {
+            e.args[0]: e for e in self._unwritten_batch or ()
+        }
+        latest.update((e.args[0], e) for e in self._sql_queries)
+
+        for sql_entry in latest.values():
+            entry = sql_entry.entry
+            if entry is None or entry.guild_id != guild_id:
+                continue
+
+            if sql_entry.action == _DELETE:
+                # the row's still there with whatever stars were written
+                change = entry._unflushed_stars - entry._counted_stars
+            else:
+                change = entry._unflushed_stars
+            leaderboard.update(entry.author_id, change)
+
+    async def warm_up(
+        self,
+        max_rows: int,
+        days: float = 7,
+        max_bytes: typing.Optional[int] = None,
+        guild_filter: typing.Optional[typing.Callable[[int], bool]] = None,
+    ) -> int:
+        """Loads recent and starred entries into the cache, newest first.
+        Meant to be run on startup so the first reactions after a restart don't all miss.
+
+        Stops after max_rows entries or once the entries loaded take up max_bytes,
+        which defaults to the cache's budget. If guild_filter is given, only entries
+        from guilds it returns True for are loaded, though every row still counts
+        towards max_rows. Returns how many entries were loaded.
         """
-        async with self._pool.acquire() as conn:
-            data = await conn.fetch(query)
+        if max_bytes is None:
+            max_bytes = self._entry_cache.max_bytes
+        # no point loading more than the cache can hold
+        max_bytes = min(max_bytes, self._entry_cache.max_bytes)
 
-            if not data:
-                return None
-            return tuple(StarboardEntry.from_row(row) for row in data)
+        # message IDs are snowflakes, so they tell us when the message was sent
+        since = discord.utils.utcnow() - datetime.timedelta(days=days)
+        min_id = discord.utils.time_snowflake(since)
+
+        loaded = 0
+        loaded_bytes = 0
+
+        rows = self._backend.iter_recent(min_id, max_rows)
+        try:
+            async for row in rows:
+                # anything already cached or deleted is newer than what's in the database
+                if self._get_cached(row["ori_mes_id"]) or self._is_missing(
+                    row["ori_mes_id"]
+                ):
+                    continue
+                if guild_filter and not guild_filter(row["guild_id"]):
+                    continue
+
+                entry = StarboardEntry.from_row(row)
+                loaded_bytes += entry.approx_size()
+                if loaded_bytes > max_bytes:
+                    break
+
+                self._cache_entry(entry)
+                loaded += 1
+        finally:
+            # lets the backend give back whatever it's streaming with right away
+            await rows.aclose()
 
-    async def super_raw_query(self, query: str):
+        return loaded
+
+    async def explain_hot_queries(
+        self, guild_id: int, author_id: int, message_id: int
+    ) -> typing.Dict[str, str]:
+        """Gets the query plans of the queries run most often, using the IDs given
+        as example arguments. Useful to check the indexes are actually being used.
+        """
+        return await self._backend.explain_hot_queries(
+            guild_id, author_id, message_id, self.top_entries_size
+        )
+
+    async def select_query(self, query: str, *args: typing.Any):
+        """Selects the starboard database directly for entries based on the query.
+        Use $1, $2, etc. in the query for the args instead of putting values in it.
+        """
+        data = await self._backend.fetch(
+            f"SELECT * FROM starboard WHERE {query}", *args
+        )
+
+        if not data:
+            return None
+        return tuple(StarboardEntry.from_row(row) for row in data)
+
+    async def raw_query(self, query: str, *args: typing.Any):
+        """Runs the raw query against the backend, assuming the results are starboard entries.
+        """
+        data = await self._backend.fetch(query, *args)
+
+        if not data:
+            return None
+        return tuple(StarboardEntry.from_row(row) for row in data)
+
+    async def super_raw_query(self, query: str, *args: typing.Any):
         """You want a raw query? You'll get one."""
-        async with self._pool.acquire() as conn:
-            return await conn.fetch(query)
+        return await self._backend.fetch(query, *args)
 
     async def query_entries(
-        self, seperator: str = "AND", **conditions: typing.Dict[str, str]
+        self, seperator: str = "AND", **conditions: typing.Any
     ) -> typing.Optional[typing.Tuple[StarboardEntry, ...]]:
         """Queries entries based on conditions provided.
 
         For example, you could do `query_entries(guild_id=143425)` to get
         entries with that guild id."""
-        sql_conditions: list[str] = [
-            f"{key} = {value}" for key, value in conditions.items()
-        ]
+        if seperator.upper() not in ("AND", "OR"):
+            raise ValueError(f"{seperator} is not a valid seperator.")
+
+        sql_conditions: typing.List[str] = []
+        args: typing.List[typing.Any] = []
+
+        for key, value in conditions.items():
+            # column names can't be parameters, so make sure they're real ones
+            if key not in _STARBOARD_COLUMNS:
+                raise ValueError(f"{key} is not a starboard column.")
+
+            args.append(value)
+            sql_conditions.append(f"{key} = ${len(args)}")
+
         combined_statements = f" {seperator} ".join(sql_conditions)
 
-        async with self._pool.acquire() as conn:
-            data = await conn.fetch(
-                f"SELECT * FROM starboard WHERE {combined_statements}"
-            )
+        data = await self._backend.fetch(
+            f"SELECT * FROM starboard WHERE {combined_statements}", *args
+        )
 
-            if not data:
-                return None
-            return tuple(StarboardEntry.from_row(row) for row in data)
-
-    async def get_random(self, guild_id: int) -> typing.Optional[StarboardEntry]:
-        """Gets a random entry from a guild."""
-        # query adapted from
-        # https://github.com/Rapptz/RoboDanny/blob/1fb95d76d1b7685e2e2ff950e11cddfc96efbfec/cogs/stars.py#L1082
-        query = """SELECT *
-                   FROM starboard
-                   WHERE guild_id=$1
-                   AND star_var_id IS NOT NULL
-                   OFFSET FLOOR(RANDOM() * (
-                       SELECT COUNT(*)
-                       FROM starboard
-                       WHERE guild_id=$1
-                       AND star_var_id IS NOT NULL
-                   ))
-                   LIMIT 1
-                """
-
-        async with self._pool.acquire() as conn:
-            data = await conn.fetchrow(query, guild_id)
-            if not data:
+        if not data:
+            return None
+        return tuple(StarboardEntry.from_row(row) for row in data)
+
+    async def _load_starred_ids(self, guild_id: int):
+        starred_ids = ReactorSet(await self._backend.fetch_starred_ids(guild_id))
+
+        # entries cached since are newer than what we just got
+        for entry in self._entry_cache.values():
+            if entry.guild_id == guild_id:
+                if entry.star_var_id:
+                    starred_ids.add(entry.ori_mes_id)
+                else:
+                    starred_ids.discard(entry.ori_mes_id)
+
+        self._starred_ids[guild_id] = starred_ids
+
+    def _start_starred_ids_load(self, guild_id: int):
+        if guild_id in self._starred_id_loads:
+            return
+
+        task = asyncio.create_task(self._load_starred_ids(guild_id))
+        self._starred_id_loads[guild_id] = task
+
+        def _remove_load(_):
+            self._starred_id_loads.pop(guild_id, None)
+
+        task.add_done_callback(_remove_load)
+
+    async def _probe_random(self, guild_id: int) -> typing.Optional[StarboardEntry]:
+        """Gets a random-ish entry by jumping to a random ID and taking the next one.
+        Not perfectly uniform, but only needs an index lookup."""
+        # both the guild ID and message IDs are snowflakes, so every message
+        # in the guild has an ID between the guild's and now's
+        now_id = discord.utils.time_snowflake(discord.utils.utcnow())
+        start_id = random.randint(guild_id, max(guild_id, now_id))
+
+        data = await self._backend.probe_random(guild_id, start_id)
+        if not data:
+            # wrap around to the start
+            data = await self._backend.probe_random(guild_id, 0)
+
+        if not data:
+            return None
+
+        if entry := self._get_cached(data["ori_mes_id"]):
+            return entry
+        return StarboardEntry.from_row(data)
+
+    async def get_random(
+        self, guild_id: int, attempts: int = 3
+    ) -> typing.Optional[StarboardEntry]:
+        """Gets a random entry on the starboard from a guild.
+
+        Picks from the guild's starred IDs in memory, loading those in the
+        background the first time - until then, the database is probed instead.
+        """
+        starred_ids = self._starred_ids.get(guild_id)
+        if starred_ids is None:
+            self._start_starred_ids_load(guild_id)
+            return await self._probe_random(guild_id)
+
+        for _ in range(attempts):
+            if not starred_ids:
                 return None
-            return StarboardEntry.from_row(data)
+
+            ori_mes_id = starred_ids[random.randrange(len(starred_ids))]
+            entry = await self.get(ori_mes_id)
+
+            if entry and entry.star_var_id:
+                return entry
+
+            # this shouldn't be here anymore
+            starred_ids.discard(ori_mes_id)
+
+        return await self._probe_random(guild_id)
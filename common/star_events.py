@@ -0,0 +1,226 @@
+#!/usr/bin/env python3.8
+"""Replays the star event log to rebuild starboard state without touching Discord.
+
+The log is every star add, remove and clear the bot has written since the last
+compaction, on top of a snapshot of every entry's reactors. Compacting folds the
+oldest events into the snapshot, so the log doesn't grow forever.
+
+Entries that were around before the log was, or while it was turned off,
+are only known from the snapshot. If the log was off for a while, reseed the
+snapshot from the starboard as it is, or those entries will be left out.
+
+Rebuilding overwrites what's in the database, so stop the bot first.
+Run it like so:
+    python -m common.star_events rebuild|leaderboard|compact|reseed"""
+import argparse
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+import attr
+
+import common.star_classes as star_classes
+import common.storage as storage
+
+
+@attr.s(slots=True)
+class ReplayedEntry:
+    """What the log knows about an entry - who it belongs to, and its reactors."""
+
+    guild_id: int = attr.ib()
+    author_id: int = attr.ib()
+    ori_reactors: typing.Set[int] = attr.ib(factory=set)
+    var_reactors: typing.Set[int] = attr.ib(factory=set)
+    # if this started from the snapshot or its creation, and not partway through
+    complete: bool = attr.ib(default=True)
+
+    @classmethod
+    def from_row(cls, row: storage.Row):
+        return cls(
+            row["guild_id"],
+            row["author_id"],
+            set(row["ori_reactors"]),
+            set(row["var_reactors"]),
+        )
+
+    @property
+    def stars(self) -> int:
+        # same as starboard_stars counts them
+        return len(self.ori_reactors) + len(self.var_reactors)
+
+    def to_snapshot_row(self, ori_mes_id: int) -> storage.SnapshotRow:
+        return (
+            ori_mes_id,
+            self.guild_id,
+            self.author_id,
+            sorted(self.ori_reactors),
+            sorted(self.var_reactors),
+        )
+
+
+def apply_event(entries: typing.Dict[int, ReplayedEntry], event: storage.Row):
+    """Applies one event from the log to the entries."""
+    ori_mes_id = event["ori_mes_id"]
+    kind = event["kind"]
+
+    if kind == star_classes.StarEventKind.DELETE:
+        entries.pop(ori_mes_id, None)
+        return
+
+    entry = entries.get(ori_mes_id)
+    if kind == star_classes.StarEventKind.CREATE or entry is None:
+        # every other kind has these, so an entry can always be made
+        entry = ReplayedEntry(
+            event["guild_id"],
+            event["author_id"],
+            complete=kind == star_classes.StarEventKind.CREATE,
+        )
+        entries[ori_mes_id] = entry
+
+    if kind == star_classes.StarEventKind.ADD_ORI:
+        entry.ori_reactors.add(event["user_id"])
+    elif kind == star_classes.StarEventKind.ADD_VAR:
+        entry.var_reactors.add(event["user_id"])
+    elif kind == star_classes.StarEventKind.REMOVE:
+        entry.ori_reactors.discard(event["user_id"])
+        entry.var_reactors.discard(event["user_id"])
+    elif kind == star_classes.StarEventKind.CLEAR_ORI:
+        entry.ori_reactors.clear()
+    elif kind == star_classes.StarEventKind.CLEAR_VAR:
+        entry.var_reactors.clear()
+
+
+def fold(
+    snapshot: typing.List[storage.Row], events: typing.List[storage.Row]
+) -> typing.Tuple[typing.List[storage.SnapshotRow], typing.List[int]]:
+    """Applies events to the snapshot rows of the entries they're for.
+    Returns the new snapshot rows and the IDs of entries that were deleted.
+
+    Incomplete entries are left out, since the snapshot would make them look whole.
+    """
+    entries = {row["ori_mes_id"]: ReplayedEntry.from_row(row) for row in snapshot}
+    touched = {event["ori_mes_id"] for event in events}
+
+    for event in events:
+        apply_event(entries, event)
+
+    rows = [
+        entries[i].to_snapshot_row(i)
+        for i in touched
+        if i in entries and entries[i].complete
+    ]
+    deleted_ids = [i for i in touched if i not in entries]
+    return rows, deleted_ids
+
+
+async def replay(
+    backend: storage.StorageBackend,
+) -> typing.Tuple[typing.Dict[int, ReplayedEntry], int]:
+    """Rebuilds every entry from the snapshot and the events after it.
+    Returns the entries and the ID of the last event applied."""
+    last_id = await backend.fetch_snapshot_event_id()
+
+    entries: typing.Dict[int, ReplayedEntry] = {}
+    async for row in backend.iter_snapshot():
+        entries[row["ori_mes_id"]] = ReplayedEntry.from_row(row)
+
+    async for event in backend.iter_events(last_id):
+        apply_event(entries, event)
+        last_id = event["id"]
+
+    return entries, last_id
+
+
+def leaderboard_totals(
+    entries: typing.Dict[int, ReplayedEntry]
+) -> typing.List[typing.Tuple[int, int, int]]:
+    """Adds up the (guild_id, author_id, stars) of every author with stars,
+    going off of complete entries."""
+    totals: typing.Counter[typing.Tuple[int, int]] = collections.Counter()
+    for entry in entries.values():
+        if entry.complete:
+            totals[(entry.guild_id, entry.author_id)] += entry.stars
+
+    return [
+        (guild_id, author_id, stars)
+        for (guild_id, author_id), stars in totals.items()
+        if stars > 0
+    ]
+
+
+async def rebuild_starboard(backend: storage.StorageBackend) -> int:
+    """Sets the reactors of every starboard row the log fully knows about
+    to what it says they are. The star totals follow along through their triggers.
+    Returns how many rows changed."""
+    entries, _ = await replay(backend)
+    return await backend.write_replayed_reactors(
+        [
+            (ori_mes_id, sorted(entry.ori_reactors), sorted(entry.var_reactors))
+            for ori_mes_id, entry in entries.items()
+            if entry.complete
+        ]
+    )
+
+
+async def rebuild_leaderboard(backend: storage.StorageBackend) -> int:
+    """Replaces every star total with what the log adds up to.
+    Returns how many authors have stars."""
+    entries, _ = await replay(backend)
+    totals = leaderboard_totals(entries)
+    await backend.write_leaderboard(totals)
+    return len(totals)
+
+
+async def compact(backend: storage.StorageBackend, max_events: int = 100000) -> int:
+    """Folds the oldest events, up to max_events, into the snapshot.
+    Safe to run with the bot up. Returns how many events were folded."""
+    return await backend.compact_events(fold, max_events)
+
+
+async def reseed(backend: storage.StorageBackend):
+    """Starts the snapshot over from the starboard as it is, dropping the log.
+    Safe to run with the bot up."""
+    await backend.reseed_snapshot()
+
+
+async def _main(action: str, max_events: int):
+    logger = logging.getLogger("star_events")
+    backend = await storage.connect_from_env()
+
+    try:
+        start = time.perf_counter()
+
+        if action == "rebuild":
+            changed = await rebuild_starboard(backend)
+            logger.info(f"Rebuilt {changed} starboard rows from the event log.")
+        elif action == "leaderboard":
+            authors = await rebuild_leaderboard(backend)
+            logger.info(f"Rebuilt the star totals of {authors} authors.")
+        elif action == "compact":
+            folded = await compact(backend, max_events)
+            logger.info(f"Folded {folded} events into the snapshot.")
+        else:
+            await reseed(backend)
+            logger.info("Reseeded the snapshot from the starboard.")
+
+        logger.info(f"Took {time.perf_counter() - start:.2f}s.")
+    finally:
+        await backend.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "action", choices=("rebuild", "leaderboard", "compact", "reseed")
+    )
+    parser.add_argument("--max-events", type=int, default=100000)
+    args = parser.parse_args()
+
+    asyncio.run(_main(args.action, args.max_events))
@@ -33,6 +33,23 @@ def cant_display(embed: discord.Embed, attachments: list, index=0):
 
 
 async def base_generate(
+    bot: utils.SeraphimBase,
+    mes: discord.Message,
+    no_attachments: bool = False,
+    fresh: bool = False,
+):
+    # generates core of star messages, reusing the last one made if the message
+    # hasn't changed since. fresh skips that, for picking up new avatars and names
+    key = star_utils.EmbedRenderCache.key_for(mes, no_attachments)
+    if not fresh and (send_embed := bot.star_embeds.get(key)):
+        return send_embed
+
+    send_embed = await _render(bot, mes, no_attachments)
+    bot.star_embeds.add(key, send_embed)
+    return send_embed
+
+
+async def _render(
     bot: utils.SeraphimBase, mes: discord.Message, no_attachments: bool = False
 ):
     # sourcery no-metrics
@@ -238,9 +255,11 @@ async def base_generate(
         raise ValueError(f"Embed was too big to process for {mes.jump_url}!")
 
 
-async def star_generate(bot: utils.SeraphimBase, mes: discord.Message):
+async def star_generate(
+    bot: utils.SeraphimBase, mes: discord.Message, fresh: bool = False
+):
     # base generate but with more fields
-    send_embed = await base_generate(bot, mes)
+    send_embed = await base_generate(bot, mes, fresh=fresh)
     send_embed.add_field(name="Original", value=f"[Jump]({mes.jump_url})", inline=True)
     send_embed.set_footer(text=f"ID: {mes.id}")
 
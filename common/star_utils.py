@@ -1,7 +1,18 @@
 #!/usr/bin/env python3.8
+import asyncio
+import collections
+import contextlib
+import copy
+import datetime
+import heapq
+import time
+import typing
+
+import attr
 import discord
-from discord.ext import commands
+from lru import LRU
 
+import common.classes as cclass
 import common.star_classes as star_classes
 import common.utils as utils
 
@@ -14,6 +25,18 @@ def get_reactor_type(mes_id: int, starboard_entry: star_classes.StarboardEntry):
     )
 
 
+@contextlib.asynccontextmanager
+async def entry_lock(bot: utils.SeraphimBase, mes_id: int):
+    # holds the lock of the entry the message belongs to, be it the original or
+    # the starboard message - messages without an entry yet use their own id,
+    # which will be the ori_mes_id of any entry made for them
+    starboard_entry = await bot.starboard.get(mes_id)
+    key = starboard_entry.ori_mes_id if starboard_entry else mes_id
+
+    async with bot.star_locks(key):
+        yield
+
+
 def clear_stars(
     bot: utils.SeraphimBase, starboard_entry: star_classes.StarboardEntry, mes_id: int
 ):
@@ -95,16 +118,14 @@ async def modify_stars(
         )
         bot.starboard.upsert(starboard_entry)
 
-        await sync_prev_reactors(bot, author_id, starboard_entry, remove=False)
+        # stars from before the bot knew about the message get picked up later
+        bot.star_reconciler.mark(starboard_entry, remove=False)
 
     author_id = starboard_entry.author_id
 
     if not starboard_entry.updated:
-        # TODO: make it sync both reactors instead of only doing one
-        type_of = get_reactor_type(mes.id, starboard_entry)
-        await sync_prev_reactors(bot, author_id, starboard_entry)
-
-        starboard_entry = await bot.starboard.get(starboard_entry.ori_mes_id)
+        # syncing with discord takes a lot of requests, so it's done in the background
+        bot.star_reconciler.mark(starboard_entry)
         starboard_entry.updated = True
 
     if author_id != reactor_id:
@@ -132,84 +153,6 @@ async def modify_stars(
             pass
 
 
-async def sync_prev_reactors(
-    bot: commands.Bot,
-    author_id,
-    starboard_entry: star_classes.StarboardEntry,
-    remove=True,
-):
-    # syncs reactors stored in db with actual reactors on Discord
-
-    async def sync_reactors(
-        bot: utils.SeraphimBase,
-        mes: discord.Message,
-        starboard_entry: star_classes.StarboardEntry,
-        type_of: star_classes.ReactorType,
-        remove: bool,
-    ):
-        reactions = mes.reactions
-        for reaction in reactions:
-            if str(reaction) != "⭐":
-                continue
-
-            users = await reaction.users().flatten()
-            user_ids = [u.id for u in users if u.id != author_id and not u.bot]
-
-            add_ids = [
-                i
-                for i in user_ids
-                if i not in starboard_entry.get_reactors_from_type(type_of)
-            ]
-            for add_id in add_ids:
-                starboard_entry.add_reactor(add_id, type_of)
-
-            if remove:
-                remove_ids = [
-                    i
-                    for i in starboard_entry.get_reactors_from_type(type_of)
-                    if i not in user_ids
-                ]
-                for remove_id in remove_ids:
-                    starboard_entry.remove_reactor(remove_id)
-
-            bot.starboard.upsert(starboard_entry)
-
-    ori_mes = None
-    star_mes = None
-
-    guild = bot.get_guild(starboard_entry.guild_id)
-    if not guild:
-        return starboard_entry
-
-    ori_mes_chan = guild.get_channel_or_thread(starboard_entry.ori_chan_id)
-    try:
-        ori_mes = await ori_mes_chan.fetch_message(starboard_entry.ori_mes_id)
-        await sync_reactors(
-            bot,
-            ori_mes,
-            starboard_entry,
-            star_classes.ReactorType.ORI_REACTORS,
-            remove,
-        )
-    except:
-        pass
-
-    starboard_chan = guild.get_channel_or_thread(starboard_entry.starboard_id)
-    try:
-        star_mes = await starboard_chan.fetch_message(starboard_entry.star_var_id)
-        await sync_reactors(
-            bot,
-            star_mes,
-            starboard_entry,
-            star_classes.ReactorType.VAR_REACTORS,
-            remove,
-        )
-    except:
-        pass
-
-    return starboard_entry
-
-
 async def star_entry_refresh(
     bot: utils.SeraphimBase, starboard_entry: star_classes.StarboardEntry, guild_id: int
 ):
@@ -223,39 +166,47 @@ async def star_entry_refresh(
     )  # TODO: ignore cases where bot can't access/use channel
     unique_stars = starboard_entry.num_reactors
 
-    try:
-        star_var_mes = await star_var_chan.fetch_message(starboard_entry.star_var_id)
-    except discord.HTTPException as e:
-        # if exception: most likely this is because starboard channel has moved, so this is a fix
-        if not isinstance(e, (discord.NotFound, discord.Forbidden)):
-            raise e
-
-        ori_chan = guild.get_channel_or_thread(starboard_entry.ori_chan_id)
-        try:
-            ori_mes = await ori_chan.fetch_message(starboard_entry.ori_mes_id)
-        except discord.HTTPException:
-            return
-        except AttributeError:
-            return
-
-        import common.star_mes_handler  # very dirty import, i know
-
-        star_var_mes = await common.star_mes_handler.send(bot, ori_mes)
-
-    ori_starred = star_var_mes.embeds[0]
-
     if (
         unique_stars >= bot.config.getattr(guild_id, "star_limit")
         or starboard_entry.forced
     ):
+        # only the content changes, and discord leaves the embed alone if it isn't
+        # given, so there's no need to fetch the message first
         new_content = generate_content_str(starboard_entry)
-        await star_var_mes.edit(content=new_content, embed=ori_starred)
+        missing = not star_var_chan
+
+        if star_var_chan:
+            try:
+                await bot.star_edits.edit(
+                    star_var_chan.id,
+                    starboard_entry.star_var_id,
+                    EDIT_COUNT,
+                    content=new_content,
+                )
+            except discord.HTTPException as e:
+                if not isinstance(e, (discord.NotFound, discord.Forbidden)):
+                    raise e
+                missing = True
+
+        if missing:
+            # most likely this is because starboard channel has moved, so this is a fix
+            ori_chan = guild.get_channel_or_thread(starboard_entry.ori_chan_id)
+            try:
+                ori_mes = await ori_chan.fetch_message(starboard_entry.ori_mes_id)
+            except discord.HTTPException:
+                return
+            except AttributeError:
+                return
+
+            import common.star_mes_handler  # very dirty import, i know
+
+            await common.star_mes_handler.send(bot, ori_mes)
     else:
+        star_var_mes_id = starboard_entry.star_var_id
         starboard_entry.star_var_id = None
         starboard_entry.starboard_id = None
         bot.starboard.upsert(starboard_entry)
 
-        await star_var_mes.delete()
         bot.star_queue.remove_from_copy(
             (
                 starboard_entry.ori_chan_id,
@@ -264,6 +215,740 @@ async def star_entry_refresh(
             )
         )
 
+        if star_var_chan:
+            bot.star_edits.discard(star_var_chan.id, star_var_mes_id)
+            try:
+                await star_var_chan.get_partial_message(star_var_mes_id).delete()
+            except discord.HTTPException as e:
+                if not isinstance(e, (discord.NotFound, discord.Forbidden)):
+                    raise e
+
+
+@attr.s(slots=True)
+class RefreshStats:
+    """Keeps track of how many refreshes were asked for, and how many actually happened.
+    """
+
+    requested: int = attr.ib(default=0)
+    refreshes: int = attr.ib(default=0)
+    immediate: int = attr.ib(default=0)
+
+    @property
+    def coalesced_ratio(self) -> float:
+        """How many refreshes asked for were folded into another one."""
+        if not self.requested:
+            return 0.0
+        return (self.requested - self.refreshes) / self.requested
+
+
+class StarRefreshScheduler:
+    """Debounces refreshes of starboard messages, per entry.
+
+    Every star would otherwise be a fetch and an edit, all fighting over the same
+    rate limit. Instead, every refresh asked for within the window is collapsed into
+    one, using whatever the entry looks like by the end of it."""
+
+    def __init__(self, bot: utils.SeraphimBase, window: float = 2.0):
+        self.bot = bot
+        self.window = window
+        self.stats = RefreshStats()
+        # ori_mes_id -> the task waiting out the window for that entry
+        self._pending: typing.Dict[int, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _under_limit(self, entry: star_classes.StarboardEntry) -> bool:
+        return not entry.forced and entry.num_reactors < self.bot.config.getattr(
+            entry.guild_id, "star_limit"
+        )
+
+    async def schedule(self, entry: star_classes.StarboardEntry):
+        """Asks for the entry's starboard message to be refreshed.
+        Returns right away, unless the entry crossed the star limit.
+        The entry's lock should already be held."""
+        self.stats.requested += 1
+
+        # anything on the starboard was at the limit last refresh, so being under it
+        # now means it crossed it - that removes the message, which shouldn't wait
+        # going back over is handled by the star queue, which doesn't wait either
+        if self._under_limit(entry):
+            self.stats.immediate += 1
+            await self.flush(entry.ori_mes_id)
+        elif entry.ori_mes_id not in self._pending:
+            self._pending[entry.ori_mes_id] = asyncio.create_task(
+                self._refresh_later(entry.ori_mes_id)
+            )
+
+    async def _refresh_later(self, ori_mes_id: int):
+        await asyncio.sleep(self.window)
+
+        if self._pending.get(ori_mes_id) is asyncio.current_task():
+            del self._pending[ori_mes_id]
+
+        try:
+            async with self.bot.star_locks(ori_mes_id):
+                await self._refresh(ori_mes_id)
+        except Exception as e:
+            await utils.error_handle(self.bot, e)
+
+    async def flush(self, ori_mes_id: int):
+        """Refreshes the entry's starboard message now,
+        dropping any refresh that was waiting to happen.
+        The entry's lock should already be held."""
+        if task := self._pending.pop(ori_mes_id, None):
+            task.cancel()
+
+        await self._refresh(ori_mes_id)
+
+    async def _refresh(self, ori_mes_id: int):
+        # the entry may have been changed or taken off the starboard since
+        entry = await self.bot.starboard.get(ori_mes_id)
+        if not entry or not entry.star_var_id:
+            return
+
+        self.stats.refreshes += 1
+        await star_entry_refresh(self.bot, entry, entry.guild_id)
+
+    def stop(self):
+        """Drops every refresh that's waiting to happen."""
+        for task in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+
+
+@attr.s(slots=True)
+class ReconcileStats:
+    """Keeps track of what the reactor reconciler has been up to."""
+
+    marked: int = attr.ib(default=0)
+    reconciled: int = attr.ib(default=0)
+    requests: int = attr.ib(default=0)
+    added: int = attr.ib(default=0)
+    removed: int = attr.ib(default=0)
+
+
+class ReactorReconciler:
+    """Syncs the reactors of entries with who's actually starred them on Discord,
+    in the background.
+
+    Getting every reactor takes a fetch per message and a request per 100 reactors,
+    which is way too slow to do while handling a reaction. Instead, entries are marked
+    and picked up by workers, going round-robin through the guilds with marked entries.
+    Every guild has its own budget of requests, so one guild with a lot of old entries
+    can't hog them all."""
+
+    def __init__(
+        self,
+        bot: utils.SeraphimBase,
+        workers: int = 2,
+        budget: int = 30,
+        per: float = 60,
+    ):
+        self.bot = bot
+        self.budget = budget
+        self.per = per
+        self.stats = ReconcileStats()
+        # guild_id -> ori_mes_id -> if reactors not on discord should be removed
+        self._pending: typing.Dict[int, typing.Dict[int, bool]] = {}
+        self._guild_order: typing.Deque[int] = collections.deque()
+        self._buckets: typing.Dict[int, cclass.TokenBucket] = LRU(1000)
+        self._running: typing.Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    def __len__(self):
+        return sum(len(p) for p in self._pending.values())
+
+    def mark(self, entry: star_classes.StarboardEntry, remove: bool = True):
+        """Marks an entry to be reconciled. If remove is False, reactors that
+        aren't on Discord anymore are kept."""
+        if entry.frozen or entry.trashed:
+            return
+
+        self.stats.marked += 1
+
+        pending = self._pending.get(entry.guild_id)
+        if pending is None:
+            pending = self._pending[entry.guild_id] = {}
+            self._guild_order.append(entry.guild_id)
+
+        pending[entry.ori_mes_id] = pending.get(entry.ori_mes_id, False) or remove
+        self._wakeup.set()
+
+    def _bucket(self, guild_id: int) -> cclass.TokenBucket:
+        bucket = self._buckets.get(guild_id)
+        if bucket is None:
+            bucket = cclass.TokenBucket(self.budget / self.per, self.budget)
+            self._buckets[guild_id] = bucket
+        return bucket
+
+    def _next_job(self) -> typing.Union[typing.Tuple[int, int, bool], float, None]:
+        """Gets the next entry to reconcile, going round-robin through the guilds.
+        Guilds out of budget are skipped - if they all are, returns how long to wait.
+        """
+        wait = None
+
+        for _ in range(len(self._guild_order)):
+            guild_id = self._guild_order.popleft()
+            pending = self._pending[guild_id]
+
+            if (delay := self._bucket(guild_id).delay()) > 0:
+                self._guild_order.append(guild_id)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            ori_mes_id, remove = next(iter(pending.items()))
+            del pending[ori_mes_id]
+
+            if pending:
+                self._guild_order.append(guild_id)
+            else:
+                del self._pending[guild_id]
+
+            return guild_id, ori_mes_id, remove
+
+        return wait
+
+    async def _worker(self):
+        while True:
+            job = self._next_job()
+
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if isinstance(job, float):
+                await asyncio.sleep(job)
+                continue
+
+            guild_id, ori_mes_id, remove = job
+            # being reconciled already, which will catch whatever this was for
+            if ori_mes_id in self._running:
+                continue
+
+            self._running.add(ori_mes_id)
+            try:
+                await self._reconcile(guild_id, ori_mes_id, remove)
+            except Exception as e:
+                await utils.error_handle(self.bot, e)
+            finally:
+                self._running.discard(ori_mes_id)
+
+    async def _fetch_reactor_ids(
+        self,
+        mes: discord.Message,
+        author_id: int,
+        bucket: cclass.TokenBucket,
+    ) -> typing.Set[int]:
+        reaction = discord.utils.find(lambda r: str(r) == "⭐", mes.reactions)
+        if not reaction:
+            return set()
+
+        reactor_ids: typing.Set[int] = set()
+        after = None
+
+        # a page at a time, so the budget is checked before every request
+        while True:
+            await bucket.acquire()
+            self.stats.requests += 1
+
+            users = [u async for u in reaction.users(limit=100, after=after)]
+            reactor_ids.update(u.id for u in users if u.id != author_id and not u.bot)
+
+            if len(users) < 100:
+                return reactor_ids
+            after = users[-1]
+
+    async def _reconcile(self, guild_id: int, ori_mes_id: int, remove: bool):
+        starboard_entry = await self.bot.starboard.get(ori_mes_id)
+        guild = self.bot.get_guild(guild_id)
+        if not starboard_entry or not guild:
+            return
+
+        bucket = self._bucket(guild_id)
+        # reactor type -> (reactors before fetching, reactors on discord)
+        found: typing.Dict[
+            star_classes.ReactorType,
+            typing.Tuple[star_classes.ReactorSet, typing.Set[int]],
+        ] = {}
+
+        for type_of, chan_id, mes_id in (
+            (
+                star_classes.ReactorType.ORI_REACTORS,
+                starboard_entry.ori_chan_id,
+                starboard_entry.ori_mes_id,
+            ),
+            (
+                star_classes.ReactorType.VAR_REACTORS,
+                starboard_entry.starboard_id,
+                starboard_entry.star_var_id,
+            ),
+        ):
+            chan = guild.get_channel_or_thread(chan_id) if mes_id else None
+            if not chan:
+                continue
+
+            before = star_classes.ReactorSet(
+                starboard_entry.get_reactors_from_type(type_of)
+            )
+
+            try:
+                await bucket.acquire()
+                self.stats.requests += 1
+                mes = await chan.fetch_message(mes_id)
+
+                found[type_of] = (
+                    before,
+                    await self._fetch_reactor_ids(
+                        mes, starboard_entry.author_id, bucket
+                    ),
+                )
+            except discord.HTTPException:
+                continue
+
+        if not found:
+            return
+
+        async with self.bot.star_locks(ori_mes_id):
+            # reactions handled while fetching are newer than what we got,
+            # so only what changed between before and discord is applied
+            starboard_entry = await self.bot.starboard.get(ori_mes_id)
+            if not starboard_entry or starboard_entry.frozen or starboard_entry.trashed:
+                return
+
+            old_stars = starboard_entry.num_reactors
+            changed = False
+
+            for type_of, (before, reactor_ids) in found.items():
+                for reactor_id in reactor_ids:
+                    if reactor_id not in before and not starboard_entry.check_reactor(
+                        reactor_id
+                    ):
+                        starboard_entry.add_reactor(reactor_id, type_of)
+                        self.stats.added += 1
+                        changed = True
+
+                if remove:
+                    current = starboard_entry.get_reactors_from_type(type_of)
+                    for reactor_id in before:
+                        if reactor_id not in reactor_ids and reactor_id in current:
+                            starboard_entry.remove_reactor(reactor_id)
+                            self.stats.removed += 1
+                            changed = True
+
+            self.stats.reconciled += 1
+            starboard_entry.updated = True
+            if not changed:
+                return
+
+            # a resync can touch a lot of reactors, so just write everything
+            starboard_entry.require_full_write()
+            self.bot.starboard.upsert(starboard_entry)
+
+            if starboard_entry.num_reactors == old_stars:
+                return
+
+            if starboard_entry.star_var_id:
+                await self.bot.star_refresher.schedule(starboard_entry)
+            elif starboard_entry.num_reactors >= self.bot.config.getattr(
+                guild_id, "star_limit"
+            ):
+                self.bot.star_queue.put_nowait(
+                    (
+                        starboard_entry.ori_chan_id,
+                        starboard_entry.ori_mes_id,
+                        starboard_entry.guild_id,
+                    )
+                )
+
+    def stop(self):
+        """Stops the workers."""
+        for task in self._tasks:
+            task.cancel()
+
+
+@attr.s(slots=True)
+class StarQueueStats:
+    """Keeps track of how long entries wait in the star queue."""
+
+    processed: int = attr.ib(default=0)
+    deferred: int = attr.ib(default=0)
+    total_wait: float = attr.ib(default=0.0)
+    max_wait: float = attr.ib(default=0.0)
+    last_wait: float = attr.ib(default=0.0)
+
+    @property
+    def avg_wait(self) -> float:
+        if not self.processed:
+            return 0.0
+        return self.total_wait / self.processed
+
+    def record(self, wait: float):
+        self.processed += 1
+        self.total_wait += wait
+        self.last_wait = wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+StarQueueItem = typing.Tuple[int, int, int]
+
+
+class StarQueueWorkers:
+    """Works through the star queue with multiple workers at once.
+
+    The queue itself goes round-robin through guilds, so one busy guild can't
+    hold everyone else up. On top of that, only channel_cap entries are sent to
+    the same starboard channel at once - extras are set aside and picked up by
+    whoever's working on that channel, which keeps the rest of the workers free
+    for other guilds instead of waiting on one rate limit."""
+
+    def __init__(self, bot: utils.SeraphimBase, workers: int = 4, channel_cap: int = 1):
+        self.bot = bot
+        self.workers = workers
+        self.channel_cap = channel_cap
+        self.stats = StarQueueStats()
+        self._process: typing.Optional[
+            typing.Callable[[StarQueueItem], typing.Awaitable[None]]
+        ] = None
+        # starboard channel id -> how many entries are being sent to it right now
+        self._active: typing.Counter[int] = collections.Counter()
+        self._deferred: typing.Dict[int, typing.Deque[StarQueueItem]] = {}
+        self._tasks: typing.List[asyncio.Task] = []
+
+    @property
+    def deferred(self) -> int:
+        return sum(len(d) for d in self._deferred.values())
+
+    def start(self, process: typing.Callable[[StarQueueItem], typing.Awaitable[None]]):
+        """Starts the workers, which run process on every entry queued up."""
+        self.stop()
+        self._process = process
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _run(self, item: StarQueueItem):
+        self.stats.record(self.bot.star_queue.queued_for(item))
+        try:
+            await self._process(item)
+        except Exception as e:
+            await utils.error_handle(self.bot, e)
+        finally:
+            self.bot.star_queue.task_done()
+
+    async def _worker(self):
+        while True:
+            item = await self.bot.star_queue.get()
+            channel_id = self.bot.config.getattr(item[2], "starboard_id")
+
+            if self._active[channel_id] >= self.channel_cap:
+                self.stats.deferred += 1
+                self._deferred.setdefault(channel_id, collections.deque()).append(item)
+                continue
+
+            self._active[channel_id] += 1
+            try:
+                await self._run(item)
+
+                # keep the slot for this channel while it still has entries waiting
+                while deferred := self._deferred.get(channel_id):
+                    next_item = deferred.popleft()
+                    if not deferred:
+                        del self._deferred[channel_id]
+                    await self._run(next_item)
+            finally:
+                self._active[channel_id] -= 1
+                if not self._active[channel_id]:
+                    del self._active[channel_id]
+
+
+class StarMessageCache:
+    """Keeps messages the starboard has needed around for a while,
+    so every reaction on a message doesn't have to fetch it again.
+
+    Messages are only kept for ttl seconds, since reactions are the only thing
+    that's kept up to date on them here."""
+
+    def __init__(self, bot: utils.SeraphimBase, max_size: int = 2000, ttl: float = 300):
+        self.bot = bot
+        self.ttl = ttl
+        self.stats = star_classes.CacheStats()
+        # message id -> (message, when it was cached)
+        self._messages: typing.Dict[int, typing.Tuple[discord.Message, float]] = LRU(
+            max_size
+        )
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, mes: discord.Message):
+        self._messages[mes.id] = (mes, time.monotonic())
+
+    def discard(self, message_id: int):
+        self._messages.pop(message_id, None)
+
+    def get(self, message_id: int) -> typing.Optional[discord.Message]:
+        """Gets a message if it's cached here."""
+        if cached := self._messages.get(message_id):
+            mes, cached_at = cached
+            if time.monotonic() - cached_at < self.ttl:
+                return mes
+            del self._messages[message_id]
+
+        return None
+
+    async def fetch(
+        self, channel: discord.abc.Messageable, message_id: int
+    ) -> discord.Message:
+        """Gets a message from the cache, only fetching it if it isn't there."""
+        if mes := self.get(message_id):
+            self.stats.hits += 1
+            return mes
+
+        self.stats.misses += 1
+        mes = await channel.fetch_message(message_id)
+        self.add(mes)
+        return mes
+
+    def update_from_edit(self, payload: discord.RawMessageUpdateEvent):
+        """Drops an edited message, so it gets fetched again.
+        The edit payload's cached_message is from before the edit, so it's no use."""
+        self.discard(payload.message_id)
+
+
+# edit priorities - lower goes first
+EDIT_COUNT = 0  # star count updates, which people are actually waiting on
+EDIT_EMBED = 1  # remade embeds, like from edits or avatar refreshes
+
+
+@attr.s(slots=True)
+class EditStats:
+    """Keeps track of what happened to the starboard edits asked for."""
+
+    requested: int = attr.ib(default=0)
+    sent: int = attr.ib(default=0)
+    superseded: int = attr.ib(default=0)
+    deferred: int = attr.ib(default=0)
+    dropped: int = attr.ib(default=0)
+
+
+@attr.s(slots=True)
+class PendingEdit:
+    priority: int = attr.ib()
+    seq: int = attr.ib()
+    fields: typing.Dict[str, typing.Any] = attr.ib()
+    future: asyncio.Future = attr.ib()
+    deferred: bool = attr.ib(default=False)
+
+
+class StarEditScheduler:
+    """Sends out starboard message edits, one message at a time per channel.
+
+    Edits waiting on the same message are merged, with newer fields replacing
+    older ones, so only the newest version actually gets sent.
+    discord.py doesn't tell us how much of a route's rate limit is left, so each
+    channel's budget is tracked here with a token bucket that matches
+    Discord's message edit limit. Low priority edits leave reserve tokens
+    in it for count updates, and wait if they'd eat into them."""
+
+    def __init__(
+        self,
+        bot: utils.SeraphimBase,
+        rate: float = 5,
+        per: float = 5,
+        reserve: int = 2,
+    ):
+        self.bot = bot
+        self.rate = rate
+        self.per = per
+        self.reserve = reserve
+        self.stats = EditStats()
+        # (channel id, message id) -> edit waiting to be sent
+        self._pending: typing.Dict[typing.Tuple[int, int], PendingEdit] = {}
+        # (priority, seq, key) - entries that are stale are skipped over when popped
+        self._heap: typing.List[typing.Tuple[int, int, typing.Tuple[int, int]]] = []
+        self._seq = 0
+        self._buckets: typing.Dict[int, cclass.TokenBucket] = LRU(1000)
+        self._sending: typing.Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _push(self, key: typing.Tuple[int, int], pending: PendingEdit):
+        self._seq += 1
+        pending.seq = self._seq
+        heapq.heappush(self._heap, (pending.priority, pending.seq, key))
+        self._wakeup.set()
+
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._dispatcher())
+
+    def edit(
+        self, channel_id: int, message_id: int, priority: int = EDIT_COUNT, **fields
+    ) -> "asyncio.Future[typing.Optional[discord.Message]]":
+        """Queues an edit, taking the same arguments as PartialMessage.edit.
+        The returned future gets the edited message, or None if the edit was dropped.
+        """
+        self.stats.requested += 1
+        key = (channel_id, message_id)
+
+        if pending := self._pending.get(key):
+            self.stats.superseded += 1
+            pending.fields.update(fields)
+            if priority < pending.priority:
+                pending.priority = priority
+                self._push(key, pending)
+            return pending.future
+
+        pending = PendingEdit(
+            priority, 0, fields, asyncio.get_running_loop().create_future()
+        )
+        self._pending[key] = pending
+        self._push(key, pending)
+        return pending.future
+
+    def discard(self, channel_id: int, message_id: int):
+        """Drops the edit waiting for a message, say because it's been deleted."""
+        if pending := self._pending.pop((channel_id, message_id), None):
+            self.stats.dropped += 1
+            if not pending.future.done():
+                pending.future.set_result(None)
+
+    def _bucket(self, channel_id: int) -> cclass.TokenBucket:
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = cclass.TokenBucket(self.rate / self.per, self.rate)
+            self._buckets[channel_id] = bucket
+        return bucket
+
+    def _dispatch_ready(self) -> typing.Optional[float]:
+        """Sends off every edit that can go right now.
+        Returns how long until another could, if that's down to the budget."""
+        held: typing.List[typing.Tuple[int, int, typing.Tuple[int, int]]] = []
+        wait: typing.Optional[float] = None
+
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            priority, seq, key = item
+
+            pending = self._pending.get(key)
+            if not pending or pending.seq != seq:  # sent, dropped, or re-pushed
+                continue
+
+            # one edit per channel at a time, so newer edits never overtake older ones
+            if key[0] in self._sending:
+                held.append(item)
+                continue
+
+            bucket = self._bucket(key[0])
+            delay = bucket.delay()
+            if not delay and priority > EDIT_COUNT:
+                if bucket.tokens < 1 + self.reserve:
+                    delay = (1 + self.reserve - bucket.tokens) / bucket.rate
+                    if not pending.deferred:
+                        pending.deferred = True
+                        self.stats.deferred += 1
+
+            if delay:
+                held.append(item)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            bucket.tokens -= 1
+            del self._pending[key]
+            self._sending.add(key[0])
+            asyncio.create_task(self._send(key, pending))
+
+        for item in held:
+            heapq.heappush(self._heap, item)
+
+        return wait
+
+    async def _dispatcher(self):
+        while self._pending:
+            self._wakeup.clear()
+            wait = self._dispatch_ready()
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, key: typing.Tuple[int, int], pending: PendingEdit):
+        try:
+            mes = await (
+                self.bot.get_partial_messageable(key[0])
+                .get_partial_message(key[1])
+                .edit(**pending.fields)
+            )
+        except Exception as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+        else:
+            self.stats.sent += 1
+            if not pending.future.done():
+                pending.future.set_result(mes)
+        finally:
+            self._sending.discard(key[0])
+            self._wakeup.set()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+        for key in tuple(self._pending):
+            self.discard(*key)
+        self._heap.clear()
+
+
+EmbedRenderKey = typing.Tuple[int, datetime.datetime, bool]
+
+
+class EmbedRenderCache:
+    """Keeps the embeds generated for messages, so an unchanged message doesn't
+    have to go through the whole generator (and its requests) again.
+
+    Keys have when the message was last edited in them, so edits get
+    a new key without anything needing to be cleared. Renders are still only kept
+    for ttl seconds, since avatars and names can change under them."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 600):
+        self.ttl = ttl
+        self.stats = star_classes.CacheStats()
+        # key -> (embed dict, when it was cached)
+        self._renders: typing.Dict[
+            EmbedRenderKey, typing.Tuple[typing.Dict[str, typing.Any], float]
+        ] = LRU(max_size)
+
+    def __len__(self):
+        return len(self._renders)
+
+    @staticmethod
+    def key_for(mes: discord.Message, no_attachments: bool) -> EmbedRenderKey:
+        return (mes.id, mes.edited_at or mes.created_at, no_attachments)
+
+    def get(self, key: EmbedRenderKey) -> typing.Optional[discord.Embed]:
+        if cached := self._renders.get(key):
+            data, cached_at = cached
+            if time.monotonic() - cached_at < self.ttl:
+                self.stats.hits += 1
+                # callers like changing what they get, so give them their own copy
+                return discord.Embed.from_dict(copy.deepcopy(data))
+            del self._renders[key]
+
+        self.stats.misses += 1
+        return None
+
+    def add(self, key: EmbedRenderKey, embed: discord.Embed):
+        self._renders[key] = (copy.deepcopy(embed.to_dict()), time.monotonic())
+
 
 async def fetch_needed(
     bot: utils.SeraphimBase, payload: discord.RawReactionActionEvent
@@ -271,24 +956,22 @@ async def fetch_needed(
     # fetches info from payload
     guild = bot.get_guild(payload.guild_id)
     channel = guild.get_channel_or_thread(payload.channel_id)
-    mes = await channel.fetch_message(payload.message_id)
+    mes = await bot.star_messages.fetch(channel, payload.message_id)
 
     if payload.event_type == "REACTION_ADD":
         user = payload.member
     else:
-        # sadly, we have to be a bit wasteful here
+        # not given for removals, but with the members intent it's almost always cached
         user = guild.get_member(payload.user_id)
 
         if user is None:  # rare, but it's happened
-            try:
-                user = await guild.fetch_member(payload.user_id)
-            except discord.HTTPException:
-                # realisitcally, this shouldn't happen much
-                # we prefer a member over a user, but sometimes you gotta make due with what you have
-                user = bot.get_user(
-                    payload.user_id
-                )  # unlikely to produce much of a result
-                if user is None:
+            # we prefer a member over a user, but we only need the id and if it is a bot
+            user = bot.get_user(payload.user_id)
+
+            if user is None:
+                try:
+                    user = await guild.fetch_member(payload.user_id)
+                except discord.HTTPException:
                     # last resort
                     # if this fails, will be silently ignored
                     user = await bot.fetch_user(payload.user_id)
@@ -0,0 +1,1043 @@
+#!/usr/bin/env python3.8
+import abc
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import os
+import re
+import sqlite3
+import typing
+
+import asyncpg
+import attr
+import orjson
+from lru import LRU
+
+import common.migrations as migrations
+
+# a full write is every column of an entry, in the order the starboard table has them
+# a delta write is the same, minus the reactor arrays, plus what was added to and
+# removed from both - see StarboardEntries._get_write_for_entry
+Row = typing.Mapping[str, typing.Any]
+FullWrite = typing.Sequence[typing.Any]
+DeltaWrite = typing.Sequence[typing.Any]
+# the columns of starboard_events, minus the id
+EventRow = typing.Tuple[
+    int,
+    typing.Optional[int],
+    typing.Optional[int],
+    typing.Optional[int],
+    int,
+    datetime.datetime,
+]
+# ori_mes_id, guild_id, author_id, ori_reactors, var_reactors
+SnapshotRow = typing.Tuple[int, int, int, typing.List[int], typing.List[int]]
+# ori_mes_id, ori_reactors, var_reactors
+ReactorsRow = typing.Tuple[int, typing.List[int], typing.List[int]]
+# gets the snapshot rows of the entries in the events and the events,
+# and returns the new snapshot rows and the ori_mes_id of entries that are gone
+SnapshotFold = typing.Callable[
+    [typing.List[Row], typing.List[Row]],
+    typing.Tuple[typing.List[SnapshotRow], typing.List[int]],
+]
+
+_EVENT_COLUMNS = (
+    "ori_mes_id",
+    "guild_id",
+    "author_id",
+    "user_id",
+    "kind",
+    "created_at",
+)
+
+
+@attr.s(slots=True)
+class StatementStats:
+    """Keeps track of how often queries reuse a statement prepared on their connection.
+
+    Both asyncpg and sqlite3 prepare every query the first time a connection sees it,
+    and cache the statement for that connection after. Since every query here has
+    the same text no matter the arguments, everything after that is a hit."""
+
+    executions: int = attr.ib(default=0)
+    prepares: int = attr.ib(default=0)
+
+    @property
+    def hit_ratio(self) -> float:
+        """How many executions skipped parsing and planning."""
+        if not self.executions:
+            return 0.0
+        return (self.executions - self.prepares) / self.executions
+
+
+class StorageBackend(abc.ABC):
+    """What the starboard and guild configs are stored in.
+
+    Rows returned only have to support getting columns by name,
+    with reactors as lists of ints and configs as dicts."""
+
+    name: str
+    statement_stats: StatementStats
+
+    @abc.abstractmethod
+    async def fetch_entry(self, entry_id: int) -> typing.Optional[Row]:
+        """Gets the starboard row with the ID as either its ori_mes_id or star_var_id.
+        """
+
+    @abc.abstractmethod
+    async def fetch_entries(self, entry_ids: typing.List[int]) -> typing.List[Row]:
+        """Gets every starboard row with any of the IDs as either message ID."""
+
+    @abc.abstractmethod
+    async def write_entries(
+        self,
+        full_writes: typing.List[FullWrite],
+        delta_writes: typing.List[DeltaWrite],
+        delete_ids: typing.List[int],
+        events: typing.List[EventRow],
+    ):
+        """Writes a batch of starboard changes and their events in one transaction."""
+
+    @abc.abstractmethod
+    async def fetch_top_entries(
+        self,
+        guild_id: int,
+        amount: int,
+        author_ids: typing.Optional[typing.List[int]] = None,
+    ) -> typing.List[Row]:
+        """Gets the most starred rows on the starboard for a guild, or some authors in it.
+        """
+
+    @abc.abstractmethod
+    async def fetch_leaderboard(self, guild_id: int) -> typing.List[Row]:
+        """Gets the author_id and stars of everyone with stars in a guild."""
+
+    @abc.abstractmethod
+    async def fetch_starred_ids(self, guild_id: int) -> typing.List[int]:
+        """Gets the ori_mes_id of every entry on a guild's starboard."""
+
+    @abc.abstractmethod
+    async def probe_random(self, guild_id: int, start_id: int) -> typing.Optional[Row]:
+        """Gets the first row on a guild's starboard with an ori_mes_id
+        at or after start_id."""
+
+    @abc.abstractmethod
+    def iter_recent(
+        self, min_id: int, max_rows: int
+    ) -> typing.AsyncGenerator[Row, None]:
+        """Goes through rows for messages after min_id or on the starboard, newest first.
+        """
+
+    @abc.abstractmethod
+    async def fetch_snapshot_event_id(self) -> int:
+        """Gets the ID of the last event already in the event log's snapshot."""
+
+    @abc.abstractmethod
+    def iter_snapshot(self) -> typing.AsyncGenerator[Row, None]:
+        """Goes through every row of the event log's snapshot."""
+
+    @abc.abstractmethod
+    def iter_events(self, after_id: int) -> typing.AsyncGenerator[Row, None]:
+        """Goes through the event log after the ID given, oldest first."""
+
+    @abc.abstractmethod
+    async def compact_events(self, fold: SnapshotFold, max_events: int) -> int:
+        """Folds up to max_events events not yet in the snapshot into it, then deletes
+        them, all in one transaction. Returns how many events were folded."""
+
+    @abc.abstractmethod
+    async def reseed_snapshot(self):
+        """Replaces the snapshot with the starboard's reactors as they are,
+        and deletes every event, all in one transaction."""
+
+    @abc.abstractmethod
+    async def write_replayed_reactors(self, rows: typing.List[ReactorsRow]) -> int:
+        """Sets the reactors of the starboard rows that exist to the ones given.
+        Returns how many rows changed."""
+
+    @abc.abstractmethod
+    async def write_leaderboard(self, totals: typing.List[typing.Tuple[int, int, int]]):
+        """Replaces every (guild_id, author_id, stars) star total."""
+
+    @abc.abstractmethod
+    async def explain_hot_queries(
+        self, guild_id: int, author_id: int, message_id: int, top_entries_size: int
+    ) -> typing.Dict[str, str]:
+        """Gets the query plans of the queries run most often."""
+
+    @abc.abstractmethod
+    async def fetch(self, query: str, *args: typing.Any) -> typing.List[Row]:
+        """Runs a raw query. Use $1, $2, etc. in the query for the args."""
+
+    @abc.abstractmethod
+    async def fetch_configs(
+        self, guild_ids: typing.Optional[typing.List[int]] = None
+    ) -> typing.List[Row]:
+        """Gets the guild_id and config of every guild, or only of the guilds given."""
+
+    @abc.abstractmethod
+    async def write_configs(
+        self,
+        insert_configs: typing.List[typing.Tuple[int, dict]],
+        update_configs: typing.List[typing.Tuple[int, dict]],
+    ):
+        """Writes new and changed guild configs in one transaction."""
+
+    @abc.abstractmethod
+    async def migrate(self) -> typing.List[migrations.Migration]:
+        """Runs every pending migration. Returns the migrations that were run."""
+
+    @abc.abstractmethod
+    async def get_applied_migrations(self) -> typing.Dict[int, str]:
+        """Gets the versions and names of every migration already run."""
+
+    @abc.abstractmethod
+    def get_migrations(self) -> typing.List[migrations.Migration]:
+        """Gets every migration for this backend."""
+
+    @abc.abstractmethod
+    async def close(self):
+        """Closes whatever connections the backend has."""
+
+
+_PG_UPSERT_QUERY = "".join(
+    (
+        "INSERT INTO starboard(ori_mes_id, ori_chan_id, star_var_id, ",
+        "starboard_id, author_id, ori_reactors, var_reactors, ",
+        "guild_id, forced, frozen, trashed) VALUES($1, $2, $3, $4, ",
+        "$5, $6, $7, $8, $9, $10, $11) ON CONFLICT (ori_mes_id) DO UPDATE ",
+        "SET ori_chan_id = $2, star_var_id = $3, starboard_id = $4, ",
+        "author_id = $5, ori_reactors = $6, var_reactors = $7, guild_id = $8, ",
+        "forced = $9, frozen = $10, trashed = $11",
+    )
+)
+# only sends the reactors that were added or removed, not the whole arrays
+_PG_DELTA_UPDATE_QUERY = "".join(
+    (
+        "UPDATE starboard SET ori_chan_id = $2, star_var_id = $3, ",
+        "starboard_id = $4, author_id = $5, guild_id = $6, forced = $7, ",
+        "frozen = $8, trashed = $9, ",
+        "ori_reactors = ARRAY(SELECT unnest(ori_reactors || $10::bigint[]) ",
+        "EXCEPT SELECT unnest($11::bigint[])), ",
+        "var_reactors = ARRAY(SELECT unnest(var_reactors || $12::bigint[]) ",
+        "EXCEPT SELECT unnest($13::bigint[])) ",
+        "WHERE ori_mes_id = $1",
+    )
+)
+_PG_BULK_DELETE_QUERY = "DELETE FROM starboard WHERE ori_mes_id = ANY($1::bigint[])"
+
+# the indexes these need are made in migrations/
+_PG_LOOKUP_QUERY = "SELECT * FROM starboard WHERE ori_mes_id = $1 OR star_var_id = $1"
+_PG_LOOKUP_MANY_QUERY = (
+    "SELECT * FROM starboard WHERE ori_mes_id = ANY($1::bigint[]) OR star_var_id ="
+    " ANY($1::bigint[])"
+)
+_PG_TOP_ENTRIES_QUERY = (
+    "SELECT * FROM starboard WHERE guild_id = $1 AND star_var_id IS NOT NULL AND stars"
+    " > 0 ORDER BY stars DESC LIMIT $2"
+)
+_PG_AUTHORS_TOP_ENTRIES_QUERY = (
+    "SELECT * FROM starboard WHERE guild_id = $1 AND author_id = ANY($3::bigint[]) AND"
+    " star_var_id IS NOT NULL AND stars > 0 ORDER BY stars DESC LIMIT $2"
+)
+_PG_LEADERBOARD_QUERY = (
+    "SELECT author_id, stars FROM starboard_stars WHERE guild_id = $1 AND stars > 0"
+)
+_PG_STARRED_IDS_QUERY = (
+    "SELECT ori_mes_id FROM starboard WHERE guild_id = $1 AND star_var_id IS NOT NULL"
+)
+_PG_RANDOM_PROBE_QUERY = (
+    "SELECT * FROM starboard WHERE guild_id = $1 AND star_var_id IS NOT NULL AND"
+    " ori_mes_id >= $2 ORDER BY ori_mes_id LIMIT 1"
+)
+_PG_WARM_UP_QUERY = (
+    "SELECT * FROM starboard WHERE ori_mes_id >= $1 OR star_var_id IS NOT NULL ORDER"
+    " BY ori_mes_id DESC LIMIT $2"
+)
+
+# the event log, see migrations/0005_star_event_log.sql
+_PG_SNAPSHOT_EVENT_ID_QUERY = "SELECT last_event_id FROM starboard_snapshot_info"
+_PG_SNAPSHOT_QUERY = "SELECT * FROM starboard_snapshot"
+_PG_SNAPSHOT_ROWS_QUERY = (
+    "SELECT * FROM starboard_snapshot WHERE ori_mes_id = ANY($1::bigint[])"
+)
+_PG_SNAPSHOT_UPSERT_QUERY = "".join(
+    (
+        "INSERT INTO starboard_snapshot(ori_mes_id, guild_id, author_id, ",
+        "ori_reactors, var_reactors) VALUES($1, $2, $3, $4, $5) ",
+        "ON CONFLICT (ori_mes_id) DO UPDATE SET guild_id = $2, author_id = $3, ",
+        "ori_reactors = $4, var_reactors = $5",
+    )
+)
+_PG_SNAPSHOT_DELETE_QUERY = (
+    "DELETE FROM starboard_snapshot WHERE ori_mes_id = ANY($1::bigint[])"
+)
+_PG_SNAPSHOT_INFO_UPDATE_QUERY = (
+    "UPDATE starboard_snapshot_info SET last_event_id = $1, compacted_at = now()"
+)
+_PG_EVENTS_QUERY = "SELECT * FROM starboard_events WHERE id > $1 ORDER BY id"
+_PG_EVENTS_LIMIT_QUERY = (
+    "SELECT * FROM starboard_events WHERE id > $1 ORDER BY id LIMIT $2"
+)
+_PG_EVENTS_DELETE_QUERY = "DELETE FROM starboard_events WHERE id <= $1"
+_PG_SNAPSHOT_RESEED_QUERY = (
+    "INSERT INTO starboard_snapshot(ori_mes_id, guild_id, author_id, ori_reactors,"
+    " var_reactors) SELECT ori_mes_id, guild_id, author_id, ori_reactors,"
+    " var_reactors FROM starboard"
+)
+# keeps ids going up, even with every event gone
+_PG_LAST_EVENT_ID_QUERY = (
+    "SELECT COALESCE(MAX(id), (SELECT last_event_id FROM starboard_snapshot_info))"
+    " FROM starboard_events"
+)
+# reactor arrays are really sets, so their order doesn't count as a change
+_PG_APPLY_REPLAY_QUERY = "".join(
+    (
+        "UPDATE starboard s SET ori_reactors = r.ori_reactors, ",
+        "var_reactors = r.var_reactors FROM starboard_replay r ",
+        "WHERE s.ori_mes_id = r.ori_mes_id AND NOT (",
+        "s.ori_reactors @> r.ori_reactors AND s.ori_reactors <@ r.ori_reactors ",
+        "AND s.var_reactors @> r.var_reactors AND s.var_reactors <@ r.var_reactors)",
+    )
+)
+
+
+class PostgresBackend(StorageBackend):
+    """Stores everything in PostgreSQL through an asyncpg pool.
+    The pool should decode jsonb as dicts."""
+
+    name = "postgres"
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self.statement_stats = StatementStats()
+        # backend pid -> queries that connection has already prepared
+        self._prepared_on: typing.Dict[int, typing.Set[str]] = LRU(64)
+
+    def _track_statement(self, conn: asyncpg.Connection, query: str):
+        """Records if the query was already prepared on this connection."""
+        pid = conn.get_server_pid()
+        prepared = self._prepared_on.get(pid)
+        if prepared is None:
+            prepared = set()
+            self._prepared_on[pid] = prepared
+
+        self.statement_stats.executions += 1
+        if query not in prepared:
+            self.statement_stats.prepares += 1
+            prepared.add(query)
+
+    async def _run(
+        self,
+        conn: asyncpg.Connection,
+        method: str,
+        query: str,
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ):
+        """Runs the query through the connection method given, keeping track of
+        how it does with the statement cache."""
+        self._track_statement(conn, query)
+        return await getattr(conn, method)(query, *args, **kwargs)
+
+    async def _fetch(self, method: str, query: str, *args: typing.Any):
+        async with self.pool.acquire() as conn:
+            return await self._run(conn, method, query, *args)
+
+    async def fetch_entry(self, entry_id: int):
+        return await self._fetch("fetchrow", _PG_LOOKUP_QUERY, entry_id)
+
+    async def fetch_entries(self, entry_ids: typing.List[int]):
+        return await self._fetch("fetch", _PG_LOOKUP_MANY_QUERY, entry_ids)
+
+    async def write_entries(
+        self,
+        full_writes: typing.List[FullWrite],
+        delta_writes: typing.List[DeltaWrite],
+        delete_ids: typing.List[int],
+        events: typing.List[EventRow],
+    ):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if full_writes:
+                    await self._run(
+                        conn, "executemany", _PG_UPSERT_QUERY, full_writes, timeout=60
+                    )
+                if delta_writes:
+                    await self._run(
+                        conn,
+                        "executemany",
+                        _PG_DELTA_UPDATE_QUERY,
+                        delta_writes,
+                        timeout=60,
+                    )
+                if delete_ids:
+                    await self._run(
+                        conn, "execute", _PG_BULK_DELETE_QUERY, delete_ids, timeout=60
+                    )
+                if events:
+                    # COPY is a lot cheaper than inserts for piles of small rows
+                    await conn.copy_records_to_table(
+                        "starboard_events",
+                        records=events,
+                        columns=_EVENT_COLUMNS,
+                        timeout=60,
+                    )
+
+    async def fetch_top_entries(
+        self,
+        guild_id: int,
+        amount: int,
+        author_ids: typing.Optional[typing.List[int]] = None,
+    ):
+        if author_ids is None:
+            return await self._fetch("fetch", _PG_TOP_ENTRIES_QUERY, guild_id, amount)
+        return await self._fetch(
+            "fetch", _PG_AUTHORS_TOP_ENTRIES_QUERY, guild_id, amount, author_ids
+        )
+
+    async def fetch_leaderboard(self, guild_id: int):
+        return await self._fetch("fetch", _PG_LEADERBOARD_QUERY, guild_id)
+
+    async def fetch_starred_ids(self, guild_id: int):
+        data = await self._fetch("fetch", _PG_STARRED_IDS_QUERY, guild_id)
+        return [r["ori_mes_id"] for r in data]
+
+    async def probe_random(self, guild_id: int, start_id: int):
+        return await self._fetch("fetchrow", _PG_RANDOM_PROBE_QUERY, guild_id, start_id)
+
+    async def iter_recent(self, min_id: int, max_rows: int):
+        async with self.pool.acquire() as conn:
+            # cursors need a transaction to stream in
+            async with conn.transaction():
+                self._track_statement(conn, _PG_WARM_UP_QUERY)
+                async for row in conn.cursor(
+                    _PG_WARM_UP_QUERY,
+                    min_id,
+                    max_rows,
+                    prefetch=min(max_rows, 500),
+                ):
+                    yield row
+
+    async def fetch_snapshot_event_id(self):
+        return await self._fetch("fetchval", _PG_SNAPSHOT_EVENT_ID_QUERY)
+
+    async def _iter_query(self, query: str, *args: typing.Any):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                self._track_statement(conn, query)
+                async for row in conn.cursor(query, *args, prefetch=5000):
+                    yield row
+
+    async def iter_snapshot(self):
+        async for row in self._iter_query(_PG_SNAPSHOT_QUERY):
+            yield row
+
+    async def iter_events(self, after_id: int):
+        async for row in self._iter_query(_PG_EVENTS_QUERY, after_id):
+            yield row
+
+    async def compact_events(self, fold: SnapshotFold, max_events: int):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # waits for any events still being written, and holds off new ones
+                # until this is done, so no event can slip in under the new last id
+                await conn.execute("LOCK TABLE starboard_events IN EXCLUSIVE MODE")
+
+                last_id = await conn.fetchval(_PG_SNAPSHOT_EVENT_ID_QUERY)
+                events = await conn.fetch(_PG_EVENTS_LIMIT_QUERY, last_id, max_events)
+                if not events:
+                    return 0
+
+                snapshot = await conn.fetch(
+                    _PG_SNAPSHOT_ROWS_QUERY, list({e["ori_mes_id"] for e in events})
+                )
+                rows, deleted_ids = fold(snapshot, events)
+
+                if rows:
+                    await conn.executemany(_PG_SNAPSHOT_UPSERT_QUERY, rows)
+                if deleted_ids:
+                    await conn.execute(_PG_SNAPSHOT_DELETE_QUERY, deleted_ids)
+
+                await conn.execute(_PG_EVENTS_DELETE_QUERY, events[-1]["id"])
+                await conn.execute(_PG_SNAPSHOT_INFO_UPDATE_QUERY, events[-1]["id"])
+
+        return len(events)
+
+    async def reseed_snapshot(self):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # what's written after this will be newer than the starboard we copy
+                # flushes write to starboard, then the events, so lock in that order
+                await conn.execute("LOCK TABLE starboard IN SHARE MODE")
+                await conn.execute("LOCK TABLE starboard_events IN EXCLUSIVE MODE")
+
+                last_id = await conn.fetchval(_PG_LAST_EVENT_ID_QUERY)
+                await conn.execute("TRUNCATE starboard_snapshot")
+                await conn.execute(_PG_SNAPSHOT_RESEED_QUERY)
+                await conn.execute(_PG_EVENTS_DELETE_QUERY, last_id)
+                await conn.execute(_PG_SNAPSHOT_INFO_UPDATE_QUERY, last_id)
+
+    async def write_replayed_reactors(self, rows: typing.List[ReactorsRow]):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "CREATE TEMPORARY TABLE starboard_replay (ori_mes_id BIGINT"
+                    " PRIMARY KEY, ori_reactors BIGINT[] NOT NULL, var_reactors"
+                    " BIGINT[] NOT NULL) ON COMMIT DROP"
+                )
+                await conn.copy_records_to_table("starboard_replay", records=rows)
+                status = await conn.execute(_PG_APPLY_REPLAY_QUERY)
+
+        # the status is UPDATE and the amount of rows
+        return int(status.split()[-1])
+
+    async def write_leaderboard(self, totals: typing.List[typing.Tuple[int, int, int]]):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("TRUNCATE starboard_stars")
+                await conn.copy_records_to_table(
+                    "starboard_stars",
+                    records=totals,
+                    columns=("guild_id", "author_id", "stars"),
+                )
+
+    async def explain_hot_queries(
+        self, guild_id: int, author_id: int, message_id: int, top_entries_size: int
+    ):
+        hot_queries = {
+            "Lookup": (_PG_LOOKUP_QUERY, (message_id,)),
+            "Bulk Lookup": (_PG_LOOKUP_MANY_QUERY, ([message_id],)),
+            "Top Entries": (_PG_TOP_ENTRIES_QUERY, (guild_id, top_entries_size)),
+            "Author Top Entries": (
+                _PG_AUTHORS_TOP_ENTRIES_QUERY,
+                (guild_id, top_entries_size, [author_id]),
+            ),
+            "Leaderboard": (_PG_LEADERBOARD_QUERY, (guild_id,)),
+            "Starred IDs": (_PG_STARRED_IDS_QUERY, (guild_id,)),
+            "Random Probe": (_PG_RANDOM_PROBE_QUERY, (guild_id, message_id)),
+        }
+
+        plans: typing.Dict[str, str] = {}
+        async with self.pool.acquire() as conn:
+            for name, (query, args) in hot_queries.items():
+                data = await conn.fetch(f"EXPLAIN {query}", *args)
+                plans[name] = "\n".join(r[0] for r in data)
+
+        return plans
+
+    async def fetch(self, query: str, *args: typing.Any):
+        return await self._fetch("fetch", query, *args)
+
+    async def fetch_configs(self, guild_ids: typing.Optional[typing.List[int]] = None):
+        async with self.pool.acquire() as conn:
+            if guild_ids is None:
+                return await conn.fetch("SELECT * FROM seraphim_config")
+            return await conn.fetch(
+                "SELECT * FROM seraphim_config WHERE guild_id = ANY($1::bigint[])",
+                guild_ids,
+            )
+
+    async def write_configs(
+        self,
+        insert_configs: typing.List[typing.Tuple[int, dict]],
+        update_configs: typing.List[typing.Tuple[int, dict]],
+    ):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if insert_configs:
+                    await conn.executemany(
+                        "INSERT INTO seraphim_config(guild_id, config) VALUES($1, $2)",
+                        args=insert_configs,
+                    )
+                if update_configs:
+                    await conn.executemany(
+                        "UPDATE seraphim_config SET config = $2 WHERE guild_id = $1",
+                        args=update_configs,
+                    )
+
+    async def migrate(self):
+        return await migrations.migrate(self.pool)
+
+    async def get_applied_migrations(self):
+        return await migrations.get_applied(self.pool)
+
+    def get_migrations(self):
+        return migrations.get_migrations()
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.pool.close(), timeout=10)
+        except asyncio.TimeoutError:
+            self.pool.terminate()
+
+
+# sqlite has no arrays, so reactors are stored as json arrays of ints instead
+# and json_each stands in for unnest and ANY
+_SQLITE_UPSERT_QUERY = "".join(
+    (
+        "INSERT INTO starboard(ori_mes_id, ori_chan_id, star_var_id, ",
+        "starboard_id, author_id, ori_reactors, var_reactors, ",
+        "guild_id, forced, frozen, trashed) VALUES(?1, ?2, ?3, ?4, ",
+        "?5, ?6, ?7, ?8, ?9, ?10, ?11) ON CONFLICT (ori_mes_id) DO UPDATE ",
+        "SET ori_chan_id = ?2, star_var_id = ?3, starboard_id = ?4, ",
+        "author_id = ?5, ori_reactors = ?6, var_reactors = ?7, guild_id = ?8, ",
+        "forced = ?9, frozen = ?10, trashed = ?11",
+    )
+)
+_SQLITE_DELTA_UPDATE_QUERY = "".join(
+    (
+        "UPDATE starboard SET ori_chan_id = ?2, star_var_id = ?3, ",
+        "starboard_id = ?4, author_id = ?5, guild_id = ?6, forced = ?7, ",
+        "frozen = ?8, trashed = ?9, ",
+        "ori_reactors = (SELECT json_group_array(value) FROM (",
+        "SELECT value FROM json_each(starboard.ori_reactors) UNION ",
+        "SELECT value FROM json_each(?10) EXCEPT SELECT value FROM json_each(?11))), ",
+        "var_reactors = (SELECT json_group_array(value) FROM (",
+        "SELECT value FROM json_each(starboard.var_reactors) UNION ",
+        "SELECT value FROM json_each(?12) EXCEPT SELECT value FROM json_each(?13))) ",
+        "WHERE ori_mes_id = ?1",
+    )
+)
+_SQLITE_BULK_DELETE_QUERY = (
+    "DELETE FROM starboard WHERE ori_mes_id IN (SELECT value FROM json_each(?1))"
+)
+
+# the indexes these need are made in migrations/sqlite/
+_SQLITE_LOOKUP_QUERY = (
+    "SELECT * FROM starboard WHERE ori_mes_id = ?1 OR star_var_id = ?1"
+)
+_SQLITE_LOOKUP_MANY_QUERY = (
+    "SELECT * FROM starboard WHERE ori_mes_id IN (SELECT value FROM json_each(?1)) OR"
+    " star_var_id IN (SELECT value FROM json_each(?1))"
+)
+_SQLITE_TOP_ENTRIES_QUERY = (
+    "SELECT * FROM starboard WHERE guild_id = ?1 AND star_var_id IS NOT NULL AND stars"
+    " > 0 ORDER BY stars DESC LIMIT ?2"
+)
+_SQLITE_AUTHORS_TOP_ENTRIES_QUERY = (
+    "SELECT * FROM starboard WHERE guild_id = ?1 AND author_id IN (SELECT value FROM"
+    " json_each(?3)) AND star_var_id IS NOT NULL AND stars > 0 ORDER BY stars DESC"
+    " LIMIT ?2"
+)
+_SQLITE_LEADERBOARD_QUERY = (
+    "SELECT author_id, stars FROM starboard_stars WHERE guild_id = ?1 AND stars > 0"
+)
+_SQLITE_STARRED_IDS_QUERY = (
+    "SELECT ori_mes_id FROM starboard WHERE guild_id = ?1 AND star_var_id IS NOT NULL"
+)
+_SQLITE_RANDOM_PROBE_QUERY = (
+    "SELECT * FROM starboard WHERE guild_id = ?1 AND star_var_id IS NOT NULL AND"
+    " ori_mes_id >= ?2 ORDER BY ori_mes_id LIMIT 1"
+)
+_SQLITE_WARM_UP_QUERY = (
+    "SELECT * FROM starboard WHERE ori_mes_id >= ?1 OR star_var_id IS NOT NULL ORDER"
+    " BY ori_mes_id DESC LIMIT ?2"
+)
+
+_SQLITE_EVENT_INSERT_QUERY = (
+    "INSERT INTO starboard_events(ori_mes_id, guild_id, author_id, user_id, kind,"
+    " created_at) VALUES(?1, ?2, ?3, ?4, ?5, ?6)"
+)
+_SQLITE_SNAPSHOT_EVENT_ID_QUERY = "SELECT last_event_id FROM starboard_snapshot_info"
+_SQLITE_SNAPSHOT_QUERY = "SELECT * FROM starboard_snapshot"
+_SQLITE_SNAPSHOT_ROWS_QUERY = (
+    "SELECT * FROM starboard_snapshot WHERE ori_mes_id IN (SELECT value FROM"
+    " json_each(?1))"
+)
+_SQLITE_SNAPSHOT_UPSERT_QUERY = "".join(
+    (
+        "INSERT INTO starboard_snapshot(ori_mes_id, guild_id, author_id, ",
+        "ori_reactors, var_reactors) VALUES(?1, ?2, ?3, ?4, ?5) ",
+        "ON CONFLICT (ori_mes_id) DO UPDATE SET guild_id = ?2, author_id = ?3, ",
+        "ori_reactors = ?4, var_reactors = ?5",
+    )
+)
+_SQLITE_SNAPSHOT_DELETE_QUERY = (
+    "DELETE FROM starboard_snapshot WHERE ori_mes_id IN (SELECT value FROM"
+    " json_each(?1))"
+)
+_SQLITE_SNAPSHOT_INFO_UPDATE_QUERY = (
+    "UPDATE starboard_snapshot_info SET last_event_id = ?1, compacted_at ="
+    " CURRENT_TIMESTAMP"
+)
+_SQLITE_EVENTS_QUERY = "SELECT * FROM starboard_events WHERE id > ?1 ORDER BY id"
+_SQLITE_EVENTS_LIMIT_QUERY = (
+    "SELECT * FROM starboard_events WHERE id > ?1 ORDER BY id LIMIT ?2"
+)
+_SQLITE_EVENTS_DELETE_QUERY = "DELETE FROM starboard_events WHERE id <= ?1"
+_SQLITE_SNAPSHOT_RESEED_QUERY = (
+    "INSERT INTO starboard_snapshot(ori_mes_id, guild_id, author_id, ori_reactors,"
+    " var_reactors) SELECT ori_mes_id, guild_id, author_id, ori_reactors,"
+    " var_reactors FROM starboard"
+)
+_SQLITE_LAST_EVENT_ID_QUERY = (
+    "SELECT COALESCE(MAX(id), (SELECT last_event_id FROM starboard_snapshot_info))"
+    " AS last_event_id FROM starboard_events"
+)
+_SQLITE_APPLY_REPLAY_QUERY = (
+    "UPDATE starboard SET ori_reactors = ?2, var_reactors = ?3 WHERE ori_mes_id = ?1"
+    " AND (ori_reactors != ?2 OR var_reactors != ?3)"
+)
+
+_JSON_COLUMNS = frozenset(("ori_reactors", "var_reactors", "config"))
+_BOOL_COLUMNS = frozenset(("forced", "frozen", "trashed"))
+_PG_PARAM = re.compile(r"\$(\d+)")
+
+
+def _sqlite_row(cursor: sqlite3.Cursor, row: tuple) -> typing.Dict[str, typing.Any]:
+    """Turns a sqlite row into a dict that looks like what asyncpg would give."""
+    data = {}
+    for column, value in zip(cursor.description, row):
+        name = column[0]
+        if name in _JSON_COLUMNS and isinstance(value, str):
+            value = orjson.loads(value)
+        elif name in _BOOL_COLUMNS and value is not None:
+            value = bool(value)
+        data[name] = value
+    return data
+
+
+def _sqlite_arg(arg: typing.Any):
+    if isinstance(arg, datetime.datetime):
+        return arg.isoformat()
+    # the json functions don't take blobs, which is what orjson's bytes would be
+    if isinstance(arg, (set, frozenset)):
+        arg = list(arg)
+    if isinstance(arg, (list, tuple, dict)):
+        return orjson.dumps(arg).decode()
+    return arg
+
+
+def _sqlite_args(args: typing.Iterable[typing.Any]) -> typing.Tuple[typing.Any, ...]:
+    return tuple(_sqlite_arg(a) for a in args)
+
+
+class SqliteBackend(StorageBackend):
+    """Stores everything in an embedded SQLite database, in WAL mode.
+    Meant for small deployments and running things locally without a server.
+
+    sqlite3 blocks, so everything is run on one thread made just for the database.
+    That also means only one thing touches the connection at a time."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.statement_stats = StatementStats()
+        self._prepared: typing.Set[str] = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite"
+        )
+        self._conn: typing.Optional[sqlite3.Connection] = None
+
+    @classmethod
+    async def connect(cls, path: str):
+        """Makes a backend and opens its database, creating the file if needed."""
+        backend = cls(path)
+        await backend._call(backend._connect)
+        return backend
+
+    def _connect(self):
+        # autocommit, transactions are started explicitly
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+        conn.row_factory = _sqlite_row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # safe with WAL, and a lot faster than FULL
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._conn = conn
+
+    async def _call(self, func: typing.Callable, *args: typing.Any):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+
+    def _execute(self, query: str, args: typing.Sequence[typing.Any] = ()):
+        self.statement_stats.executions += 1
+        if query not in self._prepared:
+            self.statement_stats.prepares += 1
+            self._prepared.add(query)
+
+        return self._conn.execute(query, _sqlite_args(args))
+
+    def _executemany(self, query: str, args: typing.Iterable[typing.Sequence]):
+        self.statement_stats.executions += 1
+        if query not in self._prepared:
+            self.statement_stats.prepares += 1
+            self._prepared.add(query)
+
+        return self._conn.executemany(query, (_sqlite_args(a) for a in args))
+
+    def _fetchall(self, query: str, *args: typing.Any):
+        return self._execute(query, args).fetchall()
+
+    def _fetchone(self, query: str, *args: typing.Any):
+        return self._execute(query, args).fetchone()
+
+    def _transaction(self, func: typing.Callable, *args: typing.Any):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(*args)
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
+            return result
+
+    async def fetch_entry(self, entry_id: int):
+        return await self._call(self._fetchone, _SQLITE_LOOKUP_QUERY, entry_id)
+
+    async def fetch_entries(self, entry_ids: typing.List[int]):
+        return await self._call(self._fetchall, _SQLITE_LOOKUP_MANY_QUERY, entry_ids)
+
+    def _write_entries(
+        self,
+        full_writes: typing.List[FullWrite],
+        delta_writes: typing.List[DeltaWrite],
+        delete_ids: typing.List[int],
+        events: typing.List[EventRow],
+    ):
+        if full_writes:
+            self._executemany(_SQLITE_UPSERT_QUERY, full_writes)
+        if delta_writes:
+            self._executemany(_SQLITE_DELTA_UPDATE_QUERY, delta_writes)
+        if delete_ids:
+            self._execute(_SQLITE_BULK_DELETE_QUERY, (delete_ids,))
+        if events:
+            # no COPY here, but one executemany in a transaction is about as good
+            self._executemany(_SQLITE_EVENT_INSERT_QUERY, events)
+
+    async def write_entries(
+        self,
+        full_writes: typing.List[FullWrite],
+        delta_writes: typing.List[DeltaWrite],
+        delete_ids: typing.List[int],
+        events: typing.List[EventRow],
+    ):
+        await self._call(
+            self._transaction,
+            self._write_entries,
+            full_writes,
+            delta_writes,
+            delete_ids,
+            events,
+        )
+
+    async def fetch_top_entries(
+        self,
+        guild_id: int,
+        amount: int,
+        author_ids: typing.Optional[typing.List[int]] = None,
+    ):
+        if author_ids is None:
+            return await self._call(
+                self._fetchall, _SQLITE_TOP_ENTRIES_QUERY, guild_id, amount
+            )
+        return await self._call(
+            self._fetchall,
+            _SQLITE_AUTHORS_TOP_ENTRIES_QUERY,
+            guild_id,
+            amount,
+            author_ids,
+        )
+
+    async def fetch_leaderboard(self, guild_id: int):
+        return await self._call(self._fetchall, _SQLITE_LEADERBOARD_QUERY, guild_id)
+
+    async def fetch_starred_ids(self, guild_id: int):
+        data = await self._call(self._fetchall, _SQLITE_STARRED_IDS_QUERY, guild_id)
+        return [r["ori_mes_id"] for r in data]
+
+    async def probe_random(self, guild_id: int, start_id: int):
+        return await self._call(
+            self._fetchone, _SQLITE_RANDOM_PROBE_QUERY, guild_id, start_id
+        )
+
+    async def _iter_query(self, query: str, args: typing.Sequence[typing.Any] = ()):
+        cursor: sqlite3.Cursor = await self._call(self._execute, query, args)
+        try:
+            while rows := await self._call(cursor.fetchmany, 500):
+                for row in rows:
+                    yield row
+        finally:
+            await self._call(cursor.close)
+
+    async def iter_recent(self, min_id: int, max_rows: int):
+        async for row in self._iter_query(_SQLITE_WARM_UP_QUERY, (min_id, max_rows)):
+            yield row
+
+    async def fetch_snapshot_event_id(self):
+        row = await self._call(self._fetchone, _SQLITE_SNAPSHOT_EVENT_ID_QUERY)
+        return row["last_event_id"]
+
+    async def iter_snapshot(self):
+        async for row in self._iter_query(_SQLITE_SNAPSHOT_QUERY):
+            yield row
+
+    async def iter_events(self, after_id: int):
+        async for row in self._iter_query(_SQLITE_EVENTS_QUERY, (after_id,)):
+            yield row
+
+    def _compact_events(self, fold: SnapshotFold, max_events: int) -> int:
+        # BEGIN IMMEDIATE already keeps every other writer out
+        last_id = self._fetchone(_SQLITE_SNAPSHOT_EVENT_ID_QUERY)["last_event_id"]
+        events = self._fetchall(_SQLITE_EVENTS_LIMIT_QUERY, last_id, max_events)
+        if not events:
+            return 0
+
+        snapshot = self._fetchall(
+            _SQLITE_SNAPSHOT_ROWS_QUERY, list({e["ori_mes_id"] for e in events})
+        )
+        rows, deleted_ids = fold(snapshot, events)
+
+        if rows:
+            self._executemany(_SQLITE_SNAPSHOT_UPSERT_QUERY, rows)
+        if deleted_ids:
+            self._execute(_SQLITE_SNAPSHOT_DELETE_QUERY, (deleted_ids,))
+
+        self._execute(_SQLITE_EVENTS_DELETE_QUERY, (events[-1]["id"],))
+        self._execute(_SQLITE_SNAPSHOT_INFO_UPDATE_QUERY, (events[-1]["id"],))
+        return len(events)
+
+    async def compact_events(self, fold: SnapshotFold, max_events: int):
+        return await self._call(
+            self._transaction, self._compact_events, fold, max_events
+        )
+
+    def _reseed_snapshot(self):
+        last_id = self._fetchone(_SQLITE_LAST_EVENT_ID_QUERY)["last_event_id"]
+        self._execute("DELETE FROM starboard_snapshot")
+        self._execute(_SQLITE_SNAPSHOT_RESEED_QUERY)
+        self._execute(_SQLITE_EVENTS_DELETE_QUERY, (last_id,))
+        self._execute(_SQLITE_SNAPSHOT_INFO_UPDATE_QUERY, (last_id,))
+
+    async def reseed_snapshot(self):
+        await self._call(self._transaction, self._reseed_snapshot)
+
+    def _write_replayed_reactors(self, rows: typing.List[ReactorsRow]) -> int:
+        # rowcount leaves out what the star total triggers change
+        return self._executemany(_SQLITE_APPLY_REPLAY_QUERY, rows).rowcount
+
+    async def write_replayed_reactors(self, rows: typing.List[ReactorsRow]):
+        return await self._call(self._transaction, self._write_replayed_reactors, rows)
+
+    def _write_leaderboard(self, totals: typing.List[typing.Tuple[int, int, int]]):
+        self._execute("DELETE FROM starboard_stars")
+        self._executemany(
+            "INSERT INTO starboard_stars(guild_id, author_id, stars)"
+            " VALUES(?1, ?2, ?3)",
+            totals,
+        )
+
+    async def write_leaderboard(self, totals: typing.List[typing.Tuple[int, int, int]]):
+        await self._call(self._transaction, self._write_leaderboard, totals)
+
+    def _explain(self, hot_queries: typing.Dict[str, typing.Tuple[str, tuple]]):
+        plans: typing.Dict[str, str] = {}
+        for name, (query, args) in hot_queries.items():
+            cursor = self._conn.execute(
+                f"EXPLAIN QUERY PLAN {query}", _sqlite_args(args)
+            )
+            plans[name] = "\n".join(r["detail"] for r in cursor.fetchall())
+        return plans
+
+    async def explain_hot_queries(
+        self, guild_id: int, author_id: int, message_id: int, top_entries_size: int
+    ):
+        hot_queries = {
+            "Lookup": (_SQLITE_LOOKUP_QUERY, (message_id,)),
+            "Bulk Lookup": (_SQLITE_LOOKUP_MANY_QUERY, ([message_id],)),
+            "Top Entries": (_SQLITE_TOP_ENTRIES_QUERY, (guild_id, top_entries_size)),
+            "Author Top Entries": (
+                _SQLITE_AUTHORS_TOP_ENTRIES_QUERY,
+                (guild_id, top_entries_size, [author_id]),
+            ),
+            "Leaderboard": (_SQLITE_LEADERBOARD_QUERY, (guild_id,)),
+            "Starred IDs": (_SQLITE_STARRED_IDS_QUERY, (guild_id,)),
+            "Random Probe": (_SQLITE_RANDOM_PROBE_QUERY, (guild_id, message_id)),
+        }
+        return await self._call(self._explain, hot_queries)
+
+    async def fetch(self, query: str, *args: typing.Any):
+        # $1 is a named parameter in sqlite, ?1 is the numbered one
+        return await self._call(self._fetchall, _PG_PARAM.sub(r"?\1", query), *args)
+
+    async def fetch_configs(self, guild_ids: typing.Optional[typing.List[int]] = None):
+        if guild_ids is None:
+            return await self._call(self._fetchall, "SELECT * FROM seraphim_config")
+        return await self._call(
+            self._fetchall,
+            "SELECT * FROM seraphim_config WHERE guild_id IN"
+            " (SELECT value FROM json_each(?1))",
+            guild_ids,
+        )
+
+    def _write_configs(
+        self,
+        insert_configs: typing.List[typing.Tuple[int, dict]],
+        update_configs: typing.List[typing.Tuple[int, dict]],
+    ):
+        if insert_configs:
+            self._executemany(
+                "INSERT INTO seraphim_config(guild_id, config) VALUES(?1, ?2)",
+                insert_configs,
+            )
+        if update_configs:
+            self._executemany(
+                "UPDATE seraphim_config SET config = ?2 WHERE guild_id = ?1",
+                update_configs,
+            )
+
+    async def write_configs(
+        self,
+        insert_configs: typing.List[typing.Tuple[int, dict]],
+        update_configs: typing.List[typing.Tuple[int, dict]],
+    ):
+        await self._call(
+            self._transaction, self._write_configs, insert_configs, update_configs
+        )
+
+    async def migrate(self):
+        return await self._call(migrations.migrate_sqlite, self._conn)
+
+    async def get_applied_migrations(self):
+        return await self._call(migrations.get_applied_sqlite, self._conn)
+
+    def get_migrations(self):
+        return migrations.get_migrations(migrations.SQLITE_MIGRATIONS_DIR)
+
+    async def close(self):
+        if self._conn:
+            await self._call(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+async def add_json_codec(conn: asyncpg.Connection):
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda obj: orjson.dumps(obj).decode(),
+        decoder=orjson.loads,
+        schema="pg_catalog",
+    )
+
+
+async def connect_from_env() -> StorageBackend:
+    """Makes the backend the environment asks for, through STORAGE_BACKEND
+    and either SQLITE_PATH or DB_URL."""
+    # sqlite needs no server, which is nice for small bots and testing
+    if os.environ.get("STORAGE_BACKEND", "postgres").lower() == "sqlite":
+        return await SqliteBackend.connect(os.environ.get("SQLITE_PATH", "seraphim.db"))
+
+    pool = await asyncpg.create_pool(
+        os.environ.get("DB_URL"),
+        min_size=2,
+        max_size=10,
+        # connections keep their prepared statements, so don't drop them too soon
+        max_inactive_connection_lifetime=300,
+        init=add_json_codec,
+    )
+    return PostgresBackend(pool)
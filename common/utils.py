@@ -447,19 +447,53 @@ class NotEnoughPerms(commands.CheckFailure):
     pass
 
 
+class ShardedBotMixin:
+    """Shard-aware versions of is_primary and owns_guild, for a bot that's
+    an AutoShardedBot. Goes before the bot's other classes."""
+
+    shard_ids: typing.Optional[typing.List[int]]
+    shard_count: int
+
+    @property
+    def own_shard_ids(self) -> typing.Collection[int]:
+        # without SHARD_IDS, discord.py runs every shard and leaves shard_ids as None
+        if self.shard_ids is None:
+            return range(self.shard_count)
+        return self.shard_ids
+
+    @property
+    def is_primary(self) -> bool:
+        # the process with shard 0 does the work that only needs doing once
+        return 0 in self.own_shard_ids
+
+    def owns_guild(self, guild_id: int) -> bool:
+        # how discord decides which shard gets a guild
+        return (guild_id >> 22) % self.shard_count in self.own_shard_ids
+
+
 if typing.TYPE_CHECKING:
     # avoids circular imports this way
 
     import asyncpg
     import common.star_classes as star_classes
+    import common.star_utils as star_utils
     import common.classes as custom_classes
     import common.configs as config
+    import common.invalidation as invalidation
+    import common.storage as storage
 
     class SeraphimBase(commands.Bot):
         # this should technically be in custom classes
         # but this is used in a lot of places for typehinting
         config: config.GuildConfigManager
-        star_queue: custom_classes.SetNoReaddAsyncQueue
+        star_queue: custom_classes.FairSetNoReaddAsyncQueue[star_utils.StarQueueItem]
+        star_workers: star_utils.StarQueueWorkers
+        star_refresher: star_utils.StarRefreshScheduler
+        star_reconciler: star_utils.ReactorReconciler
+        star_edits: star_utils.StarEditScheduler
+        star_locks: custom_classes.KeyedLock
+        star_messages: star_utils.StarMessageCache
+        star_embeds: star_utils.EmbedRenderCache
         snipes: typing.Dict[
             typing.Literal["deletes", "edits"],
             typing.Dict[int, typing.List[custom_classes.SnipedMessage]],
@@ -471,9 +505,18 @@ if typing.TYPE_CHECKING:
         added_db_info: bool
         death_messages: typing.Tuple[str, ...]
         pool: asyncpg.Pool
+        storage: storage.StorageBackend
         starboard: star_classes.StarboardEntries
+        invalidation: typing.Optional[invalidation.InvalidationBus]
         owner: discord.User
 
+        @property
+        def is_primary(self) -> bool:
+            ...
+
+        def owns_guild(self, guild_id: int) -> bool:
+            ...
+
     class SeraContextBase(commands.Context):
         bot: SeraphimBase
 
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3.8
+"""Runs the bot over multiple processes, each with its own contiguous range of
+shards, and restarts any process that crashes.
+
+Everything a process keeps in memory - snipes, role rollbacks, the star queue and
+every cache - is only about the guilds on its shards, so processes never need each
+other's. What is shared, like the starboard and guild configs, lives in storage.
+Use postgres for that, since it also lets processes tell each other when something
+they may have cached changed. sqlite works, but caches can go stale, and every
+write from every process waits on the same lock.
+
+Environment vars: SHARD_COUNT (defaults to what discord recommends) and
+PROCESS_COUNT (defaults to the amount of cores), plus everything main.py uses.
+Run it like so:
+    python launcher.py"""
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+import typing
+
+import aiohttp
+from dotenv import load_dotenv
+
+MAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+# shards identify one at a time, around 5 seconds apart
+IDENTIFY_DELAY = 5
+# if a process ran for this long before crashing, it was probably fine
+STABLE_AFTER = 60
+MAX_RESTART_DELAY = 300
+
+logger = logging.getLogger("launcher")
+
+
+async def get_recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+
+    return data["shards"]
+
+
+def split_shards(shard_count: int, process_count: int) -> typing.List[range]:
+    """Splits the shards into contiguous ranges, one per process, as evenly as
+    possible. There are never more ranges than shards."""
+    process_count = max(min(process_count, shard_count), 1)
+    per_process, extra = divmod(shard_count, process_count)
+
+    ranges: typing.List[range] = []
+    start = 0
+    for i in range(process_count):
+        end = start + per_process + (1 if i < extra else 0)
+        ranges.append(range(start, end))
+        start = end
+
+    return ranges
+
+
+async def _sleep_unless(event: asyncio.Event, delay: float):
+    # like asyncio.sleep, but wakes up early if the event is set
+    try:
+        await asyncio.wait_for(event.wait(), timeout=delay)
+    except asyncio.TimeoutError:
+        pass
+
+
+class Worker:
+    """A bot process running a range of shards."""
+
+    def __init__(self, shard_ids: range, shard_count: int):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process: typing.Optional[asyncio.subprocess.Process] = None
+
+    @property
+    def name(self):
+        return f"shards {self.shard_ids[0]}-{self.shard_ids[-1]}"
+
+    async def _start(self):
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_IDS=",".join(str(i) for i in self.shard_ids),
+        )
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, MAIN_FILE, env=env
+        )
+        logger.info(f"Started {self.name} as process {self.process.pid}.")
+
+    async def run(self, stopping: asyncio.Event):
+        """Runs the process until stopping is set, restarting it whenever it exits.
+        Restarts back off, so a process that crashes right away doesn't spin."""
+        delay = 1
+
+        while not stopping.is_set():
+            started_at = time.monotonic()
+            await self._start()
+            if stopping.is_set():
+                # stopping happened while it was starting up, so it was missed
+                self.terminate()
+            code = await self.process.wait()
+
+            if stopping.is_set():
+                break
+
+            if time.monotonic() - started_at > STABLE_AFTER:
+                delay = 1
+
+            logger.warning(
+                f"{self.name} exited with code {code}, restarting in {delay}s."
+            )
+            await _sleep_unless(stopping, delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    def terminate(self):
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+
+
+async def main():
+    if os.environ.get("SHARD_COUNT"):
+        shard_count = int(os.environ["SHARD_COUNT"])
+    else:
+        shard_count = await get_recommended_shards(os.environ["MAIN_TOKEN"])
+    process_count = int(os.environ.get("PROCESS_COUNT", os.cpu_count() or 1))
+
+    workers = [
+        Worker(shard_ids, shard_count)
+        for shard_ids in split_shards(shard_count, process_count)
+    ]
+    logger.info(f"Running {shard_count} shards over {len(workers)} processes.")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            # windows doesn't have these
+            pass
+
+    tasks: typing.List[asyncio.Task] = []
+    for worker in workers:
+        tasks.append(asyncio.create_task(worker.run(stopping)))
+
+        # give the last process's shards time to identify before starting the next
+        await _sleep_unless(stopping, IDENTIFY_DELAY * len(worker.shard_ids))
+        if stopping.is_set():
+            break
+
+    await stopping.wait()
+    logger.info("Stopping every process.")
+
+    for worker in workers:
+        worker.terminate()
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(message)s")
+    asyncio.run(main())
@@ -2,11 +2,10 @@
 import asyncio
 import logging
 import os
+import time
 
 import aiohttp
-import asyncpg
 import discord
-import orjson
 import websockets.exceptions
 from discord.ext import commands
 from discord.ext.commands.bot import _default as bot_default
@@ -14,7 +13,10 @@ from dotenv import load_dotenv
 
 import common.classes as custom_classes
 import common.configs as configs
+import common.invalidation as invalidation
 import common.star_classes as star_classes
+import common.star_utils as star_utils
+import common.storage as storage
 import common.utils as utils
 
 load_dotenv()
@@ -89,6 +91,18 @@ async def on_interaction_error(
     await utils.error_handle(interaction.client, error, interaction)
 
 
+def shard_options() -> dict:
+    """Gets the shards this process runs from SHARD_COUNT and SHARD_IDS, which
+    launcher.py sets. Without them, this process runs every shard."""
+    if not os.environ.get("SHARD_COUNT"):
+        return {}
+
+    options = {"shard_count": int(os.environ["SHARD_COUNT"])}
+    if shard_ids := os.environ.get("SHARD_IDS"):
+        options["shard_ids"] = [int(i) for i in shard_ids.split(",")]
+    return options
+
+
 class SeraphimBot(utils.SeraphimBase):
     def __init__(
         self, command_prefix, help_command=bot_default, description=None, **options
@@ -101,9 +115,51 @@ class SeraphimBot(utils.SeraphimBase):
         )
         self._checks.append(global_checks)
 
+    # without sharding, this process is the only one, so everything's on it
+    @property
+    def is_primary(self) -> bool:
+        return True
+
+    def owns_guild(self, guild_id: int) -> bool:
+        return True
+
     async def setup_hook(self):
-        bot.star_queue = custom_classes.SetNoReaddAsyncQueue()
+        # round-robin through guilds, so one can't hold up the rest
+        bot.star_queue = custom_classes.FairSetNoReaddAsyncQueue(key=lambda e: e[2])
+        bot.star_workers = star_utils.StarQueueWorkers(
+            bot,
+            workers=int(os.environ.get("STARBOARD_QUEUE_WORKERS", 4)),
+            channel_cap=int(os.environ.get("STARBOARD_CHANNEL_CAP", 1)),
+        )
+        bot.star_locks = custom_classes.KeyedLock()
+        bot.star_messages = star_utils.StarMessageCache(
+            bot,
+            max_size=int(os.environ.get("STARBOARD_MESSAGE_CACHE_SIZE", 2000)),
+            ttl=float(os.environ.get("STARBOARD_MESSAGE_TTL", 300)),
+        )
+        bot.star_embeds = star_utils.EmbedRenderCache(
+            max_size=int(os.environ.get("STARBOARD_EMBED_CACHE_SIZE", 1000)),
+            ttl=float(os.environ.get("STARBOARD_EMBED_TTL", 600)),
+        )
+        bot.star_refresher = star_utils.StarRefreshScheduler(
+            bot, window=float(os.environ.get("STARBOARD_REFRESH_WINDOW", 2))
+        )
+        bot.star_edits = star_utils.StarEditScheduler(
+            bot,
+            # discord's message edit limit, per channel
+            rate=int(os.environ.get("STARBOARD_EDIT_RATE", 5)),
+            per=float(os.environ.get("STARBOARD_EDIT_PER", 5)),
+            reserve=int(os.environ.get("STARBOARD_EDIT_RESERVE", 2)),
+        )
+        bot.star_reconciler = star_utils.ReactorReconciler(
+            bot,
+            workers=int(os.environ.get("STARBOARD_RECONCILE_WORKERS", 2)),
+            # requests per guild per minute
+            budget=int(os.environ.get("STARBOARD_RECONCILE_BUDGET", 30)),
+        )
 
+        # everything above and below is per-process, and only about the guilds on
+        # this process's shards. the starboard and configs are shared through storage
         bot.snipes = {"deletes": {}, "edits": {}}
         bot.role_rolebacks = {}
 
@@ -129,26 +185,54 @@ class SeraphimBot(utils.SeraphimBase):
                 )
                 bot.death_messages = death_messages
 
-        if not hasattr(bot, "pool"):
+        if not hasattr(bot, "storage"):
+            bot.storage = await storage.connect_from_env()
+            if isinstance(bot.storage, storage.PostgresBackend):
+                bot.pool = bot.storage.pool
+
+            if os.environ.get("RUN_MIGRATIONS", "true").lower() == "true":
+                await bot.storage.migrate()
+
+            bot.starboard = star_classes.StarboardEntries(
+                bot.storage,
+                cache_bytes=int(
+                    float(os.environ.get("STARBOARD_CACHE_MIB", 16)) * 1048576
+                ),
+                flush_interval=float(os.environ.get("STARBOARD_FLUSH_INTERVAL", 0.5)),
+                max_batch_size=int(os.environ.get("STARBOARD_FLUSH_BATCH_SIZE", 1000)),
+                max_flush_attempts=int(os.environ.get("STARBOARD_FLUSH_ATTEMPTS", 20)),
+                missing_ttl=float(os.environ.get("STARBOARD_MISSING_TTL", 300)),
+                log_events=os.environ.get("STARBOARD_EVENT_LOG", "true").lower()
+                == "true",
+            )
 
-            async def add_json_converter(conn):
-                await conn.set_type_codec(
-                    "jsonb",
-                    encoder=discord.utils._to_json,
-                    decoder=orjson.loads,
-                    schema="pg_catalog",
+            bot.invalidation = None
+            # only postgres can tell other processes what changed
+            if (
+                isinstance(bot.storage, storage.PostgresBackend)
+                and os.environ.get("CACHE_INVALIDATION", "true").lower() == "true"
+            ):
+                bot.invalidation = invalidation.InvalidationBus(bot.storage.pool)
+                bot.invalidation.subscribe(
+                    "starboard", bot.starboard.invalidate, bot.starboard.clear_cache
                 )
+                bot.starboard.invalidation_bus = bot.invalidation
 
-            db_url = os.environ.get("DB_URL")
-            bot.pool = await asyncpg.create_pool(
-                db_url,
-                min_size=2,
-                max_size=10,
-                max_inactive_connection_lifetime=3,
-                init=add_json_converter,
-            )
+            if warmup_rows := int(os.environ.get("STARBOARD_WARMUP_ROWS", 0)):
+                warmup_mib = os.environ.get("STARBOARD_WARMUP_MIB")
+                start = time.perf_counter()
+
+                loaded = await bot.starboard.warm_up(
+                    warmup_rows,
+                    days=float(os.environ.get("STARBOARD_WARMUP_DAYS", 7)),
+                    max_bytes=int(float(warmup_mib) * 1048576) if warmup_mib else None,
+                    guild_filter=bot.owns_guild,
+                )
 
-            bot.starboard = star_classes.StarboardEntries(bot.pool)
+                logger.info(
+                    f"Warmed up the starboard cache with {loaded} entries in"
+                    f" {time.perf_counter() - start:.2f}s."
+                )
 
         application = await bot.application_info()
         bot.owner = application.owner
@@ -177,10 +261,15 @@ class SeraphimBot(utils.SeraphimBase):
         time_format = discord.utils.format_dt(utcnow)
 
         connect_msg = (
-            f"Logged in at {time_format}!"
+            f"Logged in at {time_format}"
             if self.init_load == True
-            else f"Reconnected at {time_format}!"
+            else f"Reconnected at {time_format}"
         )
+        if isinstance(self, utils.ShardedBotMixin):
+            # lets us tell apart the processes launcher.py runs
+            shard_ids = self.own_shard_ids
+            connect_msg += f" (shards {min(shard_ids)}-{max(shard_ids)})"
+        connect_msg += "!"
 
         while not hasattr(self, "owner"):
             await asyncio.sleep(0.1)
@@ -225,15 +314,26 @@ class SeraphimBot(utils.SeraphimBase):
         return ctx
 
     async def close(self):
-        try:
-            await asyncio.wait_for(self.pool.close(), timeout=10)
-        except asyncio.TimeoutError:
-            self.pool.terminate()
+        self.star_refresher.stop()
+        self.star_reconciler.stop()
+        self.star_workers.stop()
+        self.star_edits.stop()
+
+        # writes out whatever's still queued, so it has to go before the storage
+        await self.starboard.close()
+        # the bus holds onto a connection, which closing waits on
+        if self.invalidation:
+            self.invalidation.stop()
+        await self.storage.close()
 
-        self.starboard.stop()
         return await super().close()
 
 
+class ShardedSeraphimBot(utils.ShardedBotMixin, SeraphimBot, commands.AutoShardedBot):
+    """The bot, running the shards SHARD_COUNT and SHARD_IDS give it.
+    A plain bot is lighter, so this is only used when sharding is asked for."""
+
+
 """Suggesting the importance of which intents we use, let's break them down.
 We need guilds as we need to know when the bot joins and leaves guilds for setup stuff. That's... mostly it.
 We need members for their roles and nicknames. Yes, this stuff isn't provided normally.
@@ -253,8 +353,11 @@ intents = discord.Intents(
 
 mentions = discord.AllowedMentions.all()
 
-bot = SeraphimBot(
+bot_options = shard_options()
+bot_class = ShardedSeraphimBot if bot_options else SeraphimBot
+bot = bot_class(
     command_prefix=seraphim_prefixes,
+    **bot_options,
     chunk_guilds_at_startup=True,
     allowed_mentions=mentions,
     intents=intents,
@@ -0,0 +1,21 @@
+-- the tables the bot has always used, for new deployments
+-- existing ones will already have these, so nothing happens there
+
+CREATE TABLE IF NOT EXISTS seraphim_config (
+    guild_id BIGINT PRIMARY KEY,
+    config JSONB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS starboard (
+    ori_mes_id BIGINT PRIMARY KEY,
+    ori_chan_id BIGINT NOT NULL,
+    star_var_id BIGINT,
+    starboard_id BIGINT,
+    author_id BIGINT NOT NULL,
+    ori_reactors BIGINT[] NOT NULL DEFAULT '{}',
+    var_reactors BIGINT[] NOT NULL DEFAULT '{}',
+    guild_id BIGINT NOT NULL,
+    forced BOOLEAN NOT NULL DEFAULT FALSE,
+    frozen BOOLEAN NOT NULL DEFAULT FALSE,
+    trashed BOOLEAN NOT NULL DEFAULT FALSE
+);
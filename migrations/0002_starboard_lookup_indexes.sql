@@ -0,0 +1,7 @@
+-- entries are looked up by either message, and filtered by guild and author a lot
+
+CREATE INDEX IF NOT EXISTS starboard_star_var_id_idx
+ON starboard (star_var_id) WHERE star_var_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS starboard_guild_author_idx
+ON starboard (guild_id, author_id);
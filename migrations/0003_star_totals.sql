@@ -0,0 +1,43 @@
+-- keeps starboard_stars, the star total of every author in every guild, up to date
+-- on every write to starboard, so leaderboards never have to add up the whole table
+
+CREATE TABLE IF NOT EXISTS starboard_stars (
+    guild_id BIGINT NOT NULL,
+    author_id BIGINT NOT NULL,
+    stars BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, author_id)
+);
+
+CREATE OR REPLACE FUNCTION starboard_stars_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE starboard_stars
+        SET stars = stars - cardinality(OLD.ori_reactors || OLD.var_reactors)
+        WHERE guild_id = OLD.guild_id AND author_id = OLD.author_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO starboard_stars(guild_id, author_id, stars)
+        VALUES (
+            NEW.guild_id,
+            NEW.author_id,
+            cardinality(NEW.ori_reactors || NEW.var_reactors)
+        )
+        ON CONFLICT (guild_id, author_id)
+        DO UPDATE SET stars = starboard_stars.stars + EXCLUDED.stars;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS starboard_stars_trigger ON starboard;
+CREATE TRIGGER starboard_stars_trigger
+AFTER INSERT OR UPDATE OR DELETE ON starboard
+FOR EACH ROW EXECUTE FUNCTION starboard_stars_update();
+
+-- rebuilt from scratch, since older versions of the bot may have filled this in already
+TRUNCATE starboard_stars;
+INSERT INTO starboard_stars(guild_id, author_id, stars)
+SELECT guild_id, author_id, SUM(cardinality(ori_reactors || var_reactors))
+FROM starboard GROUP BY guild_id, author_id;
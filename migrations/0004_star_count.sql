@@ -0,0 +1,15 @@
+-- a stored star count, indexed so the top messages can be found without sorting
+-- every entry in the guild
+
+ALTER TABLE starboard ADD COLUMN IF NOT EXISTS stars INTEGER
+GENERATED ALWAYS AS (cardinality(ori_reactors || var_reactors)) STORED;
+
+CREATE INDEX IF NOT EXISTS starboard_guild_stars_idx
+ON starboard (guild_id, stars DESC) WHERE star_var_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS starboard_author_stars_idx
+ON starboard (guild_id, author_id, stars DESC) WHERE star_var_id IS NOT NULL;
+
+-- used to pick random entries on the starboard
+CREATE INDEX IF NOT EXISTS starboard_guild_starred_idx
+ON starboard (guild_id, ori_mes_id) WHERE star_var_id IS NOT NULL;
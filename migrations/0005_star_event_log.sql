@@ -0,0 +1,38 @@
+-- an append-only log of every star change, which the starboard can be rebuilt from
+-- see common/star_events.py for what the kinds are and how they're replayed
+
+CREATE TABLE IF NOT EXISTS starboard_events (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    ori_mes_id BIGINT NOT NULL,
+    -- only missing for deletes of entries the bot didn't have on hand
+    guild_id BIGINT,
+    author_id BIGINT,
+    user_id BIGINT,
+    kind SMALLINT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- the reactors of every entry as of the last compaction, which replays start from
+CREATE TABLE IF NOT EXISTS starboard_snapshot (
+    ori_mes_id BIGINT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    author_id BIGINT NOT NULL,
+    ori_reactors BIGINT[] NOT NULL DEFAULT '{}',
+    var_reactors BIGINT[] NOT NULL DEFAULT '{}'
+);
+
+-- only ever one row, with the last event already in the snapshot
+CREATE TABLE IF NOT EXISTS starboard_snapshot_info (
+    only_row BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (only_row),
+    last_event_id BIGINT NOT NULL,
+    compacted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- there are no events for what's already there, so it's where the snapshot starts
+INSERT INTO starboard_snapshot(
+    ori_mes_id, guild_id, author_id, ori_reactors, var_reactors
+)
+SELECT ori_mes_id, guild_id, author_id, ori_reactors, var_reactors FROM starboard
+ON CONFLICT DO NOTHING;
+
+INSERT INTO starboard_snapshot_info(last_event_id) VALUES (0) ON CONFLICT DO NOTHING;
@@ -0,0 +1,76 @@
+-- everything the postgres migrations make, in one go
+-- reactors are json arrays of ints, and configs json objects, both stored as text
+
+CREATE TABLE IF NOT EXISTS seraphim_config (
+    guild_id INTEGER PRIMARY KEY,
+    config TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS starboard (
+    ori_mes_id INTEGER PRIMARY KEY,
+    ori_chan_id INTEGER NOT NULL,
+    star_var_id INTEGER,
+    starboard_id INTEGER,
+    author_id INTEGER NOT NULL,
+    ori_reactors TEXT NOT NULL DEFAULT '[]',
+    var_reactors TEXT NOT NULL DEFAULT '[]',
+    guild_id INTEGER NOT NULL,
+    forced INTEGER NOT NULL DEFAULT 0,
+    frozen INTEGER NOT NULL DEFAULT 0,
+    trashed INTEGER NOT NULL DEFAULT 0,
+    stars INTEGER GENERATED ALWAYS AS (
+        json_array_length(ori_reactors) + json_array_length(var_reactors)
+    ) STORED
+);
+
+CREATE INDEX IF NOT EXISTS starboard_star_var_id_idx
+ON starboard (star_var_id) WHERE star_var_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS starboard_guild_author_idx
+ON starboard (guild_id, author_id);
+
+CREATE INDEX IF NOT EXISTS starboard_guild_stars_idx
+ON starboard (guild_id, stars DESC) WHERE star_var_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS starboard_author_stars_idx
+ON starboard (guild_id, author_id, stars DESC) WHERE star_var_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS starboard_guild_starred_idx
+ON starboard (guild_id, ori_mes_id) WHERE star_var_id IS NOT NULL;
+
+-- the star total of every author in every guild, kept up to date by triggers
+CREATE TABLE IF NOT EXISTS starboard_stars (
+    guild_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    stars INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, author_id)
+);
+
+-- sqlite triggers can only handle one kind of change each
+CREATE TRIGGER IF NOT EXISTS starboard_stars_insert
+AFTER INSERT ON starboard
+BEGIN
+    INSERT INTO starboard_stars(guild_id, author_id, stars)
+    VALUES (NEW.guild_id, NEW.author_id, NEW.stars)
+    ON CONFLICT (guild_id, author_id)
+    DO UPDATE SET stars = stars + excluded.stars;
+END;
+
+CREATE TRIGGER IF NOT EXISTS starboard_stars_update
+AFTER UPDATE ON starboard
+BEGIN
+    UPDATE starboard_stars SET stars = stars - OLD.stars
+    WHERE guild_id = OLD.guild_id AND author_id = OLD.author_id;
+
+    INSERT INTO starboard_stars(guild_id, author_id, stars)
+    VALUES (NEW.guild_id, NEW.author_id, NEW.stars)
+    ON CONFLICT (guild_id, author_id)
+    DO UPDATE SET stars = stars + excluded.stars;
+END;
+
+CREATE TRIGGER IF NOT EXISTS starboard_stars_delete
+AFTER DELETE ON starboard
+BEGIN
+    UPDATE starboard_stars SET stars = stars - OLD.stars
+    WHERE guild_id = OLD.guild_id AND author_id = OLD.author_id;
+END;
@@ -0,0 +1,33 @@
+-- the same event log and snapshot as the postgres migration
+
+-- AUTOINCREMENT, since ids can't be reused once compaction deletes old events
+CREATE TABLE IF NOT EXISTS starboard_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ori_mes_id INTEGER NOT NULL,
+    guild_id INTEGER,
+    author_id INTEGER,
+    user_id INTEGER,
+    kind INTEGER NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS starboard_snapshot (
+    ori_mes_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    ori_reactors TEXT NOT NULL DEFAULT '[]',
+    var_reactors TEXT NOT NULL DEFAULT '[]'
+);
+
+CREATE TABLE IF NOT EXISTS starboard_snapshot_info (
+    only_row INTEGER PRIMARY KEY DEFAULT 1 CHECK (only_row = 1),
+    last_event_id INTEGER NOT NULL,
+    compacted_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO starboard_snapshot(
+    ori_mes_id, guild_id, author_id, ori_reactors, var_reactors
+)
+SELECT ori_mes_id, guild_id, author_id, ori_reactors, var_reactors FROM starboard;
+
+INSERT OR IGNORE INTO starboard_snapshot_info(last_event_id) VALUES (0);
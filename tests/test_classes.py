@@ -0,0 +1,131 @@
+import asyncio
+import gc
+
+import common.classes as custom_classes
+
+
+def test_keyed_lock_serializes_same_key():
+    async def run():
+        lock = custom_classes.KeyedLock()
+        order = []
+
+        async def hold(key, name):
+            async with lock(key):
+                order.append(f"{name} in")
+                await asyncio.sleep(0.01)
+                order.append(f"{name} out")
+
+        await asyncio.gather(hold(1, "a"), hold(1, "b"))
+        assert order == ["a in", "a out", "b in", "b out"]
+        assert lock.stats.acquisitions == 2
+        assert lock.stats.contended == 1
+        assert lock.stats.max_wait > 0
+
+    asyncio.run(run())
+
+
+def test_keyed_lock_runs_different_keys_together():
+    async def run():
+        lock = custom_classes.KeyedLock()
+        both_in = asyncio.Event()
+        inside = 0
+
+        async def hold(key):
+            nonlocal inside
+            async with lock(key):
+                inside += 1
+                if inside == 2:
+                    both_in.set()
+                await asyncio.wait_for(both_in.wait(), 1)
+
+        await asyncio.gather(hold(1), hold(2))
+        assert lock.stats.contended == 0
+
+    asyncio.run(run())
+
+
+def test_keyed_lock_drops_idle_locks():
+    async def run():
+        lock = custom_classes.KeyedLock()
+
+        async with lock(1):
+            assert lock.locked(1)
+            assert len(lock) == 1
+
+        gc.collect()
+        assert not lock.locked(1)
+        assert len(lock) == 0
+
+    asyncio.run(run())
+
+
+def test_token_bucket_starts_full():
+    bucket = custom_classes.TokenBucket(rate=1, capacity=3)
+    for _ in range(3):
+        assert bucket.delay() == 0
+        bucket.tokens -= 1
+
+    # a token a second, and there's none left
+    assert 0.9 < bucket.delay() <= 1
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = custom_classes.TokenBucket(rate=2, capacity=2)
+    bucket.tokens = 0
+    bucket._updated -= 0.5
+    assert bucket.delay() == 0
+    assert 0.9 < bucket.tokens < 1.1
+
+    bucket._updated -= 10
+    bucket.delay()
+    assert bucket.tokens == 2
+
+
+def test_token_bucket_acquire_waits():
+    async def run():
+        bucket = custom_classes.TokenBucket(rate=50, capacity=1)
+        await bucket.acquire()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await bucket.acquire()
+        assert loop.time() - start >= 0.015
+        assert bucket.tokens < 1
+
+    asyncio.run(run())
+
+
+def test_fair_queue_round_robins_groups():
+    queue = custom_classes.FairSetNoReaddAsyncQueue(key=lambda i: i[0])
+    for item in (("a", 1), ("a", 2), ("a", 3), ("b", 1), ("c", 1), ("b", 2)):
+        queue.put_nowait(item)
+
+    got = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert got == [("a", 1), ("b", 1), ("c", 1), ("a", 2), ("b", 2), ("a", 3)]
+
+
+def test_fair_queue_does_not_readd():
+    queue = custom_classes.FairSetNoReaddAsyncQueue(key=lambda i: i % 2)
+    queue.put_nowait(1)
+    queue.put_nowait(1)
+    assert queue.qsize() == 1
+
+    queue.get_nowait()
+    queue.put_nowait(1)
+    assert queue.empty()
+
+    # once it's forgotten, it can be added again
+    queue.remove_from_copy(1)
+    queue.put_nowait(1)
+    assert queue.qsize() == 1
+
+
+def test_fair_queue_queued_for():
+    queue = custom_classes.FairSetNoReaddAsyncQueue(key=lambda i: i)
+    queue.put_nowait(1)
+    queue._queued_at[1] -= 5
+
+    item = queue.get_nowait()
+    assert 5 <= queue.queued_for(item) < 6
+    # only works once
+    assert queue.queued_for(item) == 0
@@ -0,0 +1,89 @@
+import asyncio
+import types
+
+import cogs.starboard.clear_events as clear_events
+import common.classes as custom_classes
+import common.star_classes as star_classes
+from tests.test_star_classes import FlakyBackend
+
+
+class FakeStarMessage:
+    def __init__(self, deleted, message_id):
+        self.deleted = deleted
+        self.id = message_id
+
+    async def delete(self):
+        self.deleted.append(self.id)
+
+
+class FakeBot:
+    """Just enough of a bot for deleting starboard entries."""
+
+    def __init__(self, starboard):
+        self.starboard = starboard
+        self.star_locks = custom_classes.KeyedLock()
+        self.star_messages = types.SimpleNamespace(discard=lambda message_id: None)
+        self.star_queue = types.SimpleNamespace(remove_from_copy=lambda item: None)
+        self.config = types.SimpleNamespace(getattr=lambda guild_id, name: True)
+        self.discarded_edits = []
+        self.star_edits = types.SimpleNamespace(
+            discard=lambda *key: self.discarded_edits.append(key)
+        )
+        self.deleted_star_messages = []
+
+    def get_partial_messageable(self, channel_id):
+        bot = self
+
+        class Channel:
+            async def fetch_message(self, message_id):
+                return FakeStarMessage(bot.deleted_star_messages, message_id)
+
+        return Channel()
+
+
+def _entry(ori_mes_id, star_var_id):
+    return star_classes.StarboardEntry(
+        ori_mes_id,
+        1,
+        star_var_id,
+        5 if star_var_id else None,
+        9,
+        {1},
+        set(),
+        7,
+        False,
+        False,
+        False,
+    )
+
+
+def test_bulk_delete_removes_entries_at_once():
+    async def run():
+        backend = FlakyBackend()
+        starboard = star_classes.StarboardEntries(
+            backend, flush_interval=60, log_events=False
+        )
+
+        for entry in (_entry(100, 200), _entry(101, 201), _entry(102, None)):
+            starboard.upsert(entry)
+
+        bot = FakeBot(starboard)
+        cog = clear_events.ClearEvents(bot)
+        payload = types.SimpleNamespace(message_ids={100, 201, 102}, guild_id=7)
+        await cog.on_raw_bulk_message_delete(payload)
+
+        # entries whose original went are removed in one go, along with their
+        # starboard messages
+        assert bot.deleted_star_messages == [200]
+        assert await starboard.get(100) is None
+        # an entry that only lost its starboard message is kept
+        kept = await starboard.get(101)
+        assert kept.star_var_id is None
+        assert sorted(bot.discarded_edits) == [(5, 200), (5, 201)]
+
+        await starboard.close()
+        ((full_writes, _, delete_ids),) = backend.written
+        assert sorted(delete_ids) == [100, 102]
+        assert [w[0] for w in full_writes] == [101]
+
+    asyncio.run(run())
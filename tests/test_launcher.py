@@ -0,0 +1,24 @@
+import launcher
+
+
+def test_split_shards_evenly():
+    assert launcher.split_shards(10, 3) == [range(0, 4), range(4, 7), range(7, 10)]
+    assert launcher.split_shards(8, 4) == [
+        range(0, 2),
+        range(2, 4),
+        range(4, 6),
+        range(6, 8),
+    ]
+
+
+def test_split_shards_covers_every_shard_once():
+    for shard_count in range(1, 30):
+        for process_count in range(1, 12):
+            ranges = launcher.split_shards(shard_count, process_count)
+            assert [i for r in ranges for i in r] == list(range(shard_count))
+            assert all(ranges)
+
+
+def test_split_shards_never_more_processes_than_shards():
+    assert launcher.split_shards(5, 8) == [range(i, i + 1) for i in range(5)]
+    assert launcher.split_shards(3, 0) == [range(0, 3)]
@@ -0,0 +1,413 @@
+import asyncio
+
+import common.star_classes as star_classes
+import common.storage as storage
+
+
+def _entry(ori_mes_id=100, ori_reactors=(1, 2), var_reactors=(3,), guild_id=7):
+    return star_classes.StarboardEntry(
+        ori_mes_id,
+        1,
+        None,
+        None,
+        9,
+        set(ori_reactors),
+        set(var_reactors),
+        guild_id,
+        False,
+        False,
+        False,
+    )
+
+
+class FlakyBackend:
+    """Takes writes, failing the first few."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.written = []
+
+    async def write_entries(self, full_writes, delta_writes, delete_ids, events):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database went away")
+        self.written.append((full_writes, delta_writes, delete_ids))
+
+
+async def _wait_for(check, timeout=2):
+    async def wait():
+        while not check():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+def test_failed_flush_keeps_loop_and_rows():
+    async def run():
+        backend = FlakyBackend(failures=1)
+        entries = star_classes.StarboardEntries(
+            backend, flush_interval=0.01, log_events=False
+        )
+        entries.upsert(_entry())
+
+        await _wait_for(lambda: entries.flush_stats.failures == 1)
+        assert not entries._sql_loop_task.done()
+
+        await entries.close()
+        ((full_writes, _, _),) = backend.written
+        # the deltas were lost with the failed write, so it's sent in full
+        assert [w[0] for w in full_writes] == [100]
+
+    asyncio.run(run())
+
+
+def test_requeue_keeps_newer_queued_action():
+    async def run():
+        backend = FlakyBackend(failures=1)
+        entries = star_classes.StarboardEntries(
+            backend, flush_interval=0.01, log_events=False
+        )
+        entries.upsert(_entry())
+        await _wait_for(lambda: entries.flush_stats.failures == 1)
+
+        # the failed write was put back, and the delete replaces it
+        entries.delete(100)
+        await entries.close()
+        assert backend.written == [([], [], [100])]
+
+    asyncio.run(run())
+
+
+def test_gives_up_after_max_attempts():
+    async def run():
+        backend = FlakyBackend(failures=100)
+        entries = star_classes.StarboardEntries(
+            backend, flush_interval=0.01, log_events=False, max_flush_attempts=1
+        )
+        entries.upsert(_entry())
+
+        await _wait_for(lambda: entries.flush_stats.dropped == 1)
+        await entries.close()
+        assert not backend.written
+
+    asyncio.run(run())
+
+
+def test_close_writes_out_queue():
+    async def run():
+        backend = FlakyBackend()
+        entries = star_classes.StarboardEntries(
+            backend, flush_interval=60, log_events=False
+        )
+        entries.upsert(_entry(100))
+        entries.upsert(_entry(200))
+        entries.delete(300)
+
+        await entries.close()
+        ((full_writes, _, delete_ids),) = backend.written
+        assert sorted(w[0] for w in full_writes) == [100, 200]
+        assert delete_ids == [300]
+
+    asyncio.run(run())
+
+
+def test_reactor_set_is_sorted_and_distinct():
+    reactors = star_classes.ReactorSet([5, 1, 3, 1, 5])
+    assert reactors.tolist() == [1, 3, 5]
+    assert len(reactors) == 3
+    assert 3 in reactors and 2 not in reactors and 6 not in reactors
+
+
+def test_reactor_set_add_and_discard():
+    reactors = star_classes.ReactorSet([2, 4])
+    reactors.add(3)
+    reactors.add(3)
+    reactors.add(1)
+    reactors.add(5)
+    assert reactors.tolist() == [1, 2, 3, 4, 5]
+
+    reactors.discard(3)
+    reactors.discard(10)
+    assert reactors.tolist() == [1, 2, 4, 5]
+
+
+def test_reactor_set_union():
+    ours = star_classes.ReactorSet([1, 3, 5, 7])
+    theirs = star_classes.ReactorSet([2, 3, 8])
+    empty = star_classes.ReactorSet()
+
+    assert (ours | theirs).tolist() == [1, 2, 3, 5, 7, 8]
+    assert ours.union_count(theirs) == 6
+    assert (ours | empty) == ours and (empty | theirs) == theirs
+    assert ours.union_count(empty) == 4 and empty.union_count(theirs) == 3
+
+    # unions are copies, not the same buffer
+    union = ours | empty
+    union.add(100)
+    assert 100 not in ours
+
+
+def test_reactor_set_compares_to_sets():
+    assert star_classes.ReactorSet([1, 2]) == {1, 2}
+    assert star_classes.ReactorSet([1, 2]) != {1, 3}
+    assert star_classes.ReactorSet([1, 2]) != {1, 2, 3}
+    assert star_classes.ReactorSet(star_classes.ReactorSet([4])) == {4}
+
+
+def test_reactor_set_holds_snowflakes():
+    snowflake = 2**63 + 12345
+    reactors = star_classes.ReactorSet([snowflake, 1])
+    assert reactors.tolist() == [1, snowflake]
+    assert snowflake in reactors
+
+
+def test_reactor_delta_cancels_out():
+    delta = star_classes.ReactorDelta()
+    delta.add(1)
+    delta.remove(1)
+    assert not delta
+
+    # removing something already written, then adding it back, changes nothing
+    delta.remove(2)
+    delta.add(2)
+    assert not delta
+
+    delta.add(3)
+    delta.remove(4)
+    assert delta.added == {3} and delta.removed == {4}
+
+
+def _row(entry):
+    return {
+        "ori_mes_id": entry.ori_mes_id,
+        "ori_chan_id": entry.ori_chan_id,
+        "star_var_id": entry.star_var_id,
+        "starboard_id": entry.starboard_id,
+        "author_id": entry.author_id,
+        "ori_reactors": entry.ori_reactors.tolist(),
+        "var_reactors": entry.var_reactors.tolist(),
+        "guild_id": entry.guild_id,
+        "forced": entry.forced,
+        "frozen": entry.frozen,
+        "trashed": entry.trashed,
+    }
+
+
+def test_entry_deltas():
+    # new entries have no row, so they're written in full
+    assert _entry().pop_reactor_deltas() is None
+
+    entry = star_classes.StarboardEntry.from_row(_row(_entry()))
+    entry.add_reactor(4, star_classes.ReactorType.ORI_REACTORS)
+    entry.add_reactor(5, star_classes.ReactorType.VAR_REACTORS)
+    # already reacted on the other message, so this does nothing
+    entry.add_reactor(3, star_classes.ReactorType.ORI_REACTORS)
+    entry.remove_reactor(1)
+    entry.remove_reactor(3)
+
+    ori_delta, var_delta = entry.pop_reactor_deltas()
+    assert ori_delta.added == {4} and ori_delta.removed == {1}
+    assert var_delta.added == {5} and var_delta.removed == {3}
+
+    ori_delta, var_delta = entry.pop_reactor_deltas()
+    assert not ori_delta and not var_delta
+
+
+def test_replacing_reactors_needs_full_write():
+    entry = star_classes.StarboardEntry.from_row(_row(_entry()))
+    entry.add_reactor(4, star_classes.ReactorType.ORI_REACTORS)
+    entry.ori_reactors = {8, 9}
+
+    assert entry.pop_reactor_deltas() is None
+    assert entry.ori_reactors == {8, 9}
+    assert entry.num_reactors == 3
+
+
+def test_leaderboard_ranking():
+    leaderboard = star_classes.StarLeaderboard([(1, 5), (2, 10), (3, 5), (4, 0)])
+    assert [(e.author_id, e.stars) for e in leaderboard] == [(2, 10), (1, 5), (3, 5)]
+    assert leaderboard.position(2) == (1, 10)
+    # ties go to the lower author ID
+    assert leaderboard.position(3) == (3, 5)
+    assert leaderboard.position(4) is None
+
+    leaderboard.update(3, 6)
+    assert leaderboard.position(3) == (1, 11)
+    assert [e.author_id for e in leaderboard.top(2)] == [3, 2]
+
+    leaderboard.update(2, -10)
+    assert leaderboard.position(2) is None
+    assert len(leaderboard) == 2
+
+    leaderboard.update(5, 1)
+    assert leaderboard.position(5) == (3, 1)
+
+
+def test_leaderboard_counts_unflushed_stars(tmp_path):
+    async def run():
+        backend = await storage.SqliteBackend.connect(str(tmp_path / "sb.db"))
+        await backend.migrate()
+        entries = star_classes.StarboardEntries(backend, flush_interval=60)
+
+        try:
+            entries.upsert(_entry(100, ori_reactors=(1,), var_reactors=()))
+            # loaded before the entry is written, so the database doesn't have it
+            leaderboard = await entries.get_leaderboard(7)
+            assert leaderboard.position(9) == (1, 1)
+
+            entries.delete(100)
+            entries.upsert(_entry(200, ori_reactors=(1, 2), var_reactors=()))
+            await entries.close()
+
+            assert leaderboard.position(9) == (1, 2)
+            data = await backend.fetch_leaderboard(7)
+            assert [(r["author_id"], r["stars"]) for r in data] == [(9, 2)]
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def test_leaderboard_counts_queued_deletes(tmp_path):
+    async def run():
+        backend = await storage.SqliteBackend.connect(str(tmp_path / "sb.db"))
+        await backend.migrate()
+        entries = star_classes.StarboardEntries(backend, flush_interval=60)
+
+        try:
+            entries.upsert(_entry(100, ori_reactors=(1, 2), var_reactors=()))
+            await entries.close()
+
+            entries = star_classes.StarboardEntries(backend, flush_interval=60)
+            entry = await entries.get(100)
+            entry.add_reactor(3, star_classes.ReactorType.ORI_REACTORS)
+            entries.upsert(entry)
+            entries.delete(100)
+
+            # the row's still there with 2 stars, but it's about to go away
+            leaderboard = await entries.get_leaderboard(7)
+            assert leaderboard.position(9) is None
+            await entries.close()
+            assert not await backend.fetch_leaderboard(7)
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def _starred(ori_mes_id, stars):
+    entry = _entry(ori_mes_id, ori_reactors=range(1, stars + 1), var_reactors=())
+    entry.star_var_id = ori_mes_id + 1
+    return entry
+
+
+def test_top_entries_with_everything_loaded():
+    top_entries = star_classes.StarboardTopEntries(
+        3, [_starred(10, 2), _starred(20, 5)]
+    )
+    assert top_entries.complete
+    assert [e.ori_mes_id for e in top_entries.top(3)] == [20, 10]
+
+    top_entries.update(_starred(30, 1))
+    top_entries.update(_starred(40, 3))
+    # over capacity, so the lowest goes and the floor goes up with it
+    assert [e.ori_mes_id for e in top_entries.top(5)] == [20, 40, 10]
+    assert top_entries.floor == 1 and not top_entries.complete
+
+
+def test_top_entries_respects_floor():
+    top_entries = star_classes.StarboardTopEntries(
+        2, [_starred(10, 5), _starred(20, 3)]
+    )
+    assert top_entries.floor == 3
+
+    # something not held could have 3 stars too, so this can't be trusted
+    top_entries.update(_starred(30, 3))
+    assert [e.ori_mes_id for e in top_entries.top(5)] == [10, 20]
+
+    # but an entry already held can stay at the floor
+    top_entries.update(_starred(20, 3))
+    assert len(top_entries) == 2
+
+    top_entries.update(_starred(30, 4))
+    assert [e.ori_mes_id for e in top_entries.top(5)] == [10, 30]
+
+
+def test_top_entries_drops_unstarred():
+    top_entries = star_classes.StarboardTopEntries(5, [_starred(10, 2)])
+    unstarred = _starred(10, 2)
+    unstarred.star_var_id = None
+    top_entries.update(unstarred)
+    assert not top_entries.top(5)
+
+    assert top_entries.discard(10) is None
+    top_entries.update(_starred(20, 1))
+    assert top_entries.discard(20) == 1
+
+
+class GatedBackend(FlakyBackend):
+    """Has one row, and holds lookups until the gate opens."""
+
+    def __init__(self, row):
+        super().__init__()
+        self.row = row
+        self.gate = asyncio.Event()
+        self.lookups = 0
+
+    async def fetch_entry(self, entry_id):
+        self.lookups += 1
+        await self.gate.wait()
+        if entry_id in (self.row["ori_mes_id"], self.row["star_var_id"]):
+            return self.row
+        return None
+
+
+def _starred_entry():
+    entry = _entry()
+    entry.star_var_id = 200
+    entry.starboard_id = 5
+    return entry
+
+
+def test_deleted_entry_not_found_by_var_id():
+    async def run():
+        backend = GatedBackend(_row(_starred_entry()))
+        backend.gate.set()
+        entries = star_classes.StarboardEntries(
+            backend, flush_interval=60, log_events=False
+        )
+
+        assert await entries.get(200)
+        entries.delete(100)
+
+        # the delete isn't written yet, but the database isn't asked
+        assert await entries.get(200) is None
+        assert backend.lookups == 1
+        entries.stop()
+
+    asyncio.run(run())
+
+
+def test_fetch_racing_delete_is_not_cached():
+    async def run():
+        backend = GatedBackend(_row(_starred_entry()))
+        entries = star_classes.StarboardEntries(
+            backend, flush_interval=60, log_events=False
+        )
+
+        by_ori = asyncio.create_task(entries.get(100))
+        by_var = asyncio.create_task(entries.get(200))
+        await _wait_for(lambda: backend.lookups == 2)
+
+        # deleted while the database still has the row
+        entries.delete(100)
+        backend.gate.set()
+
+        assert await by_ori is None
+        assert await by_var is None
+        assert entries._get_cached(100) is None
+        assert await entries.get(200) is None
+        assert backend.lookups == 2
+        entries.stop()
+
+    asyncio.run(run())
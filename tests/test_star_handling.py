@@ -0,0 +1,74 @@
+import asyncio
+import types
+
+import cogs.starboard.star_handling as star_handling
+import common.star_utils as star_utils
+
+
+class FakeChannel:
+    def __init__(self, messages):
+        self.id = 5
+        self.messages = messages
+        self.fetches = 0
+
+    async def fetch_message(self, message_id):
+        self.fetches += 1
+        return self.messages[message_id]
+
+
+class FakeBot:
+    """Just enough of a bot for on_raw_message_edit."""
+
+    def __init__(self, channel):
+        self.star_messages = star_utils.StarMessageCache(self)
+        self.config = types.SimpleNamespace(getattr=lambda guild_id, name: True)
+        self.starboard = types.SimpleNamespace(get=self._get_entry)
+        self.star_edits = types.SimpleNamespace(edit=self._edit)
+        self.guild = types.SimpleNamespace(
+            id=7, get_channel_or_thread=lambda channel_id: channel
+        )
+        self.edits = []
+
+    def get_guild(self, guild_id):
+        return self.guild
+
+    async def _get_entry(self, message_id, check_for_var=False):
+        return types.SimpleNamespace(star_var_id=20, starboard_id=5)
+
+    async def _edit(self, channel_id, message_id, priority, **fields):
+        self.edits.append((message_id, fields))
+
+
+def _message(content):
+    return types.SimpleNamespace(id=10, content=content)
+
+
+def test_edit_uses_edited_message(monkeypatch):
+    async def star_generate(bot, mes):
+        return mes.content
+
+    monkeypatch.setattr(star_handling.star_mes, "star_generate", star_generate)
+
+    async def run():
+        old, new = _message("before"), _message("after")
+        channel = FakeChannel({10: new})
+        bot = FakeBot(channel)
+        bot.star_messages.add(old)
+
+        # discord.py's cached_message is a copy from before the edit
+        payload = types.SimpleNamespace(
+            message_id=10,
+            channel_id=1,
+            guild_id=7,
+            cached_message=old,
+            data={"content": "after"},
+        )
+        cog = types.SimpleNamespace(bot=bot)
+        await star_handling.Star.on_raw_message_edit(cog, payload)
+
+        assert bot.edits == [(20, {"embed": "after"})]
+        # the edited version is what reactions see from now on
+        assert bot.star_messages.get(10) is new
+        assert channel.fetches == 1
+
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+import asyncio
+
+import common.star_utils as star_utils
+
+
+class FakeBot:
+    """Records the edits sent, by (channel id, message id)."""
+
+    def __init__(self):
+        self.edits = []
+
+    def get_partial_messageable(self, channel_id):
+        bot = self
+
+        class Channel:
+            def get_partial_message(self, message_id):
+                class Message:
+                    async def edit(self, **fields):
+                        bot.edits.append((channel_id, message_id, fields))
+                        return (message_id, fields)
+
+                return Message()
+
+        return Channel()
+
+
+def test_edits_to_same_message_are_merged():
+    async def run():
+        bot = FakeBot()
+        scheduler = star_utils.StarEditScheduler(bot)
+
+        first = scheduler.edit(1, 10, content="1 star")
+        second = scheduler.edit(1, 10, content="2 stars", embed="embed")
+        assert first is second
+
+        mes = await asyncio.wait_for(first, 1)
+        assert mes == (10, {"content": "2 stars", "embed": "embed"})
+        assert bot.edits == [(1, 10, {"content": "2 stars", "embed": "embed"})]
+        assert scheduler.stats.requested == 2
+        assert scheduler.stats.superseded == 1
+        assert scheduler.stats.sent == 1
+
+    asyncio.run(run())
+
+
+def test_superseding_raises_priority():
+    async def run():
+        bot = FakeBot()
+        # no tokens at all, so nothing goes until the test says so
+        scheduler = star_utils.StarEditScheduler(bot, rate=1, per=0.05, reserve=0)
+        scheduler._bucket(1).tokens = 0
+
+        scheduler.edit(1, 10, priority=star_utils.EDIT_EMBED, embed="embed")
+        scheduler.edit(1, 11, priority=star_utils.EDIT_EMBED, embed="embed")
+        last = scheduler.edit(1, 11, content="3 stars")
+
+        await asyncio.wait_for(last, 1)
+        assert bot.edits[0] == (1, 11, {"embed": "embed", "content": "3 stars"})
+
+        scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_discarded_edit_is_dropped():
+    async def run():
+        bot = FakeBot()
+        scheduler = star_utils.StarEditScheduler(bot)
+        scheduler._bucket(1).tokens = 0
+
+        future = scheduler.edit(1, 10, content="1 star")
+        scheduler.discard(1, 10)
+
+        assert await future is None
+        assert scheduler.stats.dropped == 1
+        assert not len(scheduler)
+        scheduler.stop()
+
+    asyncio.run(run())
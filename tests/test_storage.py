@@ -0,0 +1,219 @@
+import asyncio
+import os
+
+import asyncpg
+import pytest
+
+import common.star_classes as star_classes
+import common.storage as storage
+
+# postgres tests need a database that's fine to write to
+TEST_DB_URL = os.environ.get("TEST_DB_URL")
+
+
+def _full(ori_mes_id=100, star_var_id=200, ori_reactors=(1, 2), var_reactors=(3,)):
+    return (
+        ori_mes_id,
+        1,
+        star_var_id,
+        5,
+        9,
+        list(ori_reactors),
+        list(var_reactors),
+        7,
+        False,
+        False,
+        False,
+    )
+
+
+def _delta(ori_added=(), ori_removed=(), var_added=(), var_removed=()):
+    return (
+        100,
+        1,
+        200,
+        5,
+        9,
+        7,
+        False,
+        False,
+        False,
+        list(ori_added),
+        list(ori_removed),
+        list(var_added),
+        list(var_removed),
+    )
+
+
+def _run(tmp_path, test):
+    async def run():
+        backend = await storage.SqliteBackend.connect(str(tmp_path / "sb.db"))
+        try:
+            await backend.migrate()
+            await test(backend)
+        finally:
+            await backend.close()
+
+    asyncio.run(run())
+
+
+def test_full_write_and_lookup(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_entries([_full()], [], [], [])
+
+        # both the original and the starboard message find it
+        by_ori = await backend.fetch_entry(100)
+        by_var = await backend.fetch_entry(200)
+        assert dict(by_ori) == dict(by_var)
+        assert by_ori["ori_reactors"] == [1, 2]
+        assert by_ori["var_reactors"] == [3]
+        assert by_ori["stars"] == 3
+        assert by_ori["forced"] is False
+
+        assert await backend.fetch_entry(300) is None
+
+    _run(tmp_path, test)
+
+
+def test_fetch_entries(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_entries(
+            [_full(), _full(ori_mes_id=101, star_var_id=201)], [], [], []
+        )
+
+        rows = await backend.fetch_entries([100, 201, 300])
+        assert sorted(r["ori_mes_id"] for r in rows) == [100, 101]
+
+    _run(tmp_path, test)
+
+
+def test_delta_write(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_entries([_full()], [], [], [])
+        await backend.write_entries(
+            [], [_delta(ori_added=(4,), ori_removed=(1,), var_removed=(3,))], [], []
+        )
+
+        row = await backend.fetch_entry(100)
+        assert sorted(row["ori_reactors"]) == [2, 4]
+        assert row["var_reactors"] == []
+        assert row["stars"] == 2
+
+    _run(tmp_path, test)
+
+
+def test_delete(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_entries(
+            [_full(), _full(ori_mes_id=101, star_var_id=201)], [], [], []
+        )
+        await backend.write_entries([], [], [100], [])
+
+        assert await backend.fetch_entry(100) is None
+        assert await backend.fetch_entry(101) is not None
+
+    _run(tmp_path, test)
+
+
+def test_top_entries_and_leaderboard(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_entries(
+            [
+                _full(ori_reactors=(1,), var_reactors=()),
+                _full(ori_mes_id=101, star_var_id=201, ori_reactors=(1, 2, 3)),
+            ],
+            [],
+            [],
+            [],
+        )
+
+        top = await backend.fetch_top_entries(7, 1)
+        assert [r["ori_mes_id"] for r in top] == [101]
+        assert await backend.fetch_top_entries(7, 5, author_ids=[10]) == []
+
+        (row,) = await backend.fetch_leaderboard(7)
+        assert (row["author_id"], row["stars"]) == (9, 5)
+        assert await backend.fetch_leaderboard(8) == []
+
+    _run(tmp_path, test)
+
+
+def test_configs(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_configs([(7, {"a": 1}), (8, {"b": 2})], [])
+        await backend.write_configs([], [(7, {"a": 3})])
+
+        configs = {r["guild_id"]: r["config"] for r in await backend.fetch_configs()}
+        assert configs == {7: {"a": 3}, 8: {"b": 2}}
+
+        (row,) = await backend.fetch_configs([8])
+        assert row["config"] == {"b": 2}
+
+    _run(tmp_path, test)
+
+
+def test_migrate_twice(tmp_path):
+    async def test(backend: storage.SqliteBackend):
+        await backend.write_entries([_full()], [], [], [])
+        applied = await backend.get_applied_migrations()
+
+        # already applied migrations are skipped, and nothing's lost
+        await backend.migrate()
+        assert await backend.get_applied_migrations() == applied
+        assert await backend.fetch_entry(100) is not None
+
+    _run(tmp_path, test)
+
+
+async def _connect(kind, tmp_path) -> storage.StorageBackend:
+    if kind == "sqlite":
+        backend = await storage.SqliteBackend.connect(str(tmp_path / "sb.db"))
+    else:
+        pool = await asyncpg.create_pool(TEST_DB_URL, init=storage.add_json_codec)
+        backend = storage.PostgresBackend(pool)
+    await backend.migrate()
+    return backend
+
+
+@pytest.mark.parametrize(
+    "kind",
+    [
+        "sqlite",
+        pytest.param(
+            "postgres",
+            marks=pytest.mark.skipif(not TEST_DB_URL, reason="TEST_DB_URL not set"),
+        ),
+    ],
+)
+def test_flush_writes_through_backend(kind, tmp_path):
+    async def run():
+        backend = await _connect(kind, tmp_path)
+        entries = star_classes.StarboardEntries(backend, flush_interval=60)
+        # postgres keeps events from earlier runs around
+        last_event_id = 0
+        async for event in backend.iter_events(0):
+            last_event_id = event["id"]
+
+        try:
+            entry = star_classes.StarboardEntry(
+                987654321, 1, None, None, 9, {1, 2}, set(), 7, False, False, False
+            )
+            entry._events.append((star_classes.StarEventKind.CREATE, None, 0.0))
+            entries.upsert(entry)
+            await entries._flush([entries._sql_queries.get_nowait()])
+
+            entry.add_reactor(3, star_classes.ReactorType.ORI_REACTORS)
+            entries.upsert(entry)
+            await entries._flush([entries._sql_queries.get_nowait()])
+
+            row = await backend.fetch_entry(987654321)
+            assert sorted(row["ori_reactors"]) == [1, 2, 3]
+            events = [e async for e in backend.iter_events(last_event_id)]
+            assert [e["ori_mes_id"] for e in events] == [987654321, 987654321]
+        finally:
+            entries.delete(987654321)
+            await entries._flush([entries._sql_queries.get_nowait()])
+            entries.stop()
+            await backend.close()
+
+    asyncio.run(run())
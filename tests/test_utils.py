@@ -0,0 +1,29 @@
+import common.utils as utils
+
+
+class FakeShardedBot(utils.ShardedBotMixin):
+    def __init__(self, shard_ids, shard_count):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+
+
+def _guild_on_shard(shard_id):
+    # the lowest guild id discord would put on that shard
+    return shard_id << 22
+
+
+def test_sharded_bot_with_shard_ids():
+    bot = FakeShardedBot([2, 3], 4)
+    assert not bot.is_primary
+    assert bot.owns_guild(_guild_on_shard(2))
+    assert not bot.owns_guild(_guild_on_shard(0))
+
+    assert FakeShardedBot([0, 1], 4).is_primary
+
+
+def test_sharded_bot_without_shard_ids():
+    # SHARD_COUNT without SHARD_IDS runs every shard
+    bot = FakeShardedBot(None, 4)
+    assert list(bot.own_shard_ids) == [0, 1, 2, 3]
+    assert bot.is_primary
+    assert all(bot.owns_guild(_guild_on_shard(i)) for i in range(4))